@@ -1,5 +1,6 @@
 from .base_agent import BaseResearchAgent
 from .multi_agent import MultiAgentResearcher
+from .batch import BatchResearcher
 
-__all__ = ["BaseResearchAgent", "MultiAgentResearcher"]
+__all__ = ["BaseResearchAgent", "MultiAgentResearcher", "BatchResearcher"]
 
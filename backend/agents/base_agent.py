@@ -1,13 +1,16 @@
 """
 基础 Agent 实现
 """
-from typing import AsyncIterator, Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import AsyncIterator, Dict, Any, List, Optional
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.prompts import PromptTemplate
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from config import get_llm_config
 from tools.tavily_search import get_search_tools
+from services.llm_factory import create_chat_model
+from services.run_context import RunContext
+from services.structured_logging import StepLogCallback
+from config import settings
+from agents.scratchpad import create_compressed_react_agent
 import json
 
 # ReAct 提示词模板
@@ -46,16 +49,8 @@ class BaseResearchAgent:
     
     def __init__(self):
         """初始化 Agent"""
-        llm_config = get_llm_config()
-        
-        # 初始化 LLM
-        self.llm = ChatOpenAI(
-            model=llm_config["model"],
-            temperature=llm_config["temperature"],
-            api_key=llm_config["api_key"],
-            base_url=llm_config["api_base"],
-            streaming=True,
-        )
+        # 初始化 LLM（单 Agent 阶段）
+        self.llm = create_chat_model("agent", streaming=True)
         
         # 获取工具
         self.tools = get_search_tools()
@@ -63,39 +58,53 @@ class BaseResearchAgent:
         # 创建提示词
         self.prompt = PromptTemplate.from_template(REACT_PROMPT)
         
-        # 创建 Agent
-        self.agent = create_react_agent(
-            llm=self.llm,
-            tools=self.tools,
-            prompt=self.prompt
-        )
+        # 创建 Agent（默认压缩草稿区中的搜索结果）
+        if settings.scratchpad_compression:
+            self.agent = create_compressed_react_agent(
+                llm=self.llm,
+                tools=self.tools,
+                prompt=self.prompt
+            )
+        else:
+            self.agent = create_react_agent(
+                llm=self.llm,
+                tools=self.tools,
+                prompt=self.prompt
+            )
         
         # 创建 Agent 执行器
         self.agent_executor = AgentExecutor(
             agent=self.agent,
             tools=self.tools,
-            verbose=True,
+            callbacks=[StepLogCallback("agent")],
             handle_parsing_errors=True,
             max_iterations=10,
         )
     
-    async def astream(self, query: str, session_history: List[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    async def astream(self, query: str, session_history: List[Dict[str, str]] = None,
+                      run_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
         """
         异步流式执行 Agent
         
         Args:
             query: 用户查询
             session_history: 会话历史
+            run_id: 运行 ID（可通过 /api/runs/{run_id}/trace 查询追踪），为空时自动生成
             
         Yields:
             Dict[str, Any]: 流式事件
         """
+        run = RunContext(run_id, name="single_agent", query=query)
+        error = None
+        
         try:
             # 构建输入
             inputs = {"input": query}
             
             # 流式执行
-            async for event in self.agent_executor.astream_events(inputs, version="v1"):
+            async for event in self.agent_executor.astream_events(
+                inputs, config=run.config("agent"), version="v1"
+            ):
                 event_type = event.get("event")
                 
                 # 处理不同类型的事件
@@ -148,19 +157,22 @@ class BaseResearchAgent:
                         "metadata": {}
                     }
             
-            # 发送完成事件
+            # 发送完成事件（附带本次运行的用量统计）
             yield {
                 "type": "done",
                 "content": "completed",
-                "metadata": {}
+                "metadata": {"run_id": run.run_id, "usage": run.usage.snapshot()}
             }
             
         except Exception as e:
+            error = e
             yield {
                 "type": "error",
                 "content": str(e),
-                "metadata": {}
+                "metadata": {"run_id": run.run_id}
             }
+        finally:
+            run.finish(error=error)
     
     async def ainvoke(self, query: str, session_history: List[Dict[str, str]] = None) -> str:
         """
@@ -173,10 +185,16 @@ class BaseResearchAgent:
         Returns:
             str: Agent 响应
         """
+        run = RunContext(name="single_agent", query=query)
+        error = None
+        
         try:
             inputs = {"input": query}
-            result = await self.agent_executor.ainvoke(inputs)
+            result = await self.agent_executor.ainvoke(inputs, config=run.config("agent"))
             return result.get("output", "")
         except Exception as e:
+            error = e
             return f"执行出错: {str(e)}"
+        finally:
+            run.finish(error=error)
 
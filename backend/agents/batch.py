@@ -0,0 +1,244 @@
+"""
+批量研究：一次提交多个主题，跨主题共享相同或近似的子任务与搜索
+"""
+from typing import AsyncIterator, Dict, Any, List, Optional
+import asyncio
+
+from config import settings
+from agents.multi_agent import TASK_ERROR_PREFIX, MultiAgentResearcher, ResearchEventThrottle
+from services.run_context import RunContext
+from services.load_policy import DEPTH_LEVELS, ResearchDepth
+from services.similarity import jaccard, normalize_text, term_set
+from services.task_cache import task_text
+from tools.search_dedup import SearchDeduplicator, current_search_dedup
+
+def group_similar_tasks(plans: List[List[Dict[str, Any]]], threshold: float) -> List[Dict[str, Any]]:
+    """
+    把所有主题的子任务按相似度分组，每组只需执行一次
+
+    Args:
+        plans: 每个主题的子任务列表
+        threshold: 词项 Jaccard 相似度达到该值即视为近似子任务
+
+    Returns:
+        List[Dict]: 分组列表，每组包含代表任务 task 和成员 members [(主题序号, 任务)]
+    """
+    groups: List[Dict[str, Any]] = []
+    for topic_index, tasks in enumerate(plans):
+        for task in tasks:
+            text = task_text(task)
+            terms = term_set(text)
+            normalized = normalize_text(text)
+            for group in groups:
+                if group["key"] == normalized or jaccard(terms, group["terms"]) >= threshold:
+                    group["members"].append((topic_index, task))
+                    break
+            else:
+                groups.append({
+                    "key": normalized,
+                    "terms": terms,
+                    "task": task,
+                    "members": [(topic_index, task)],
+                })
+    return groups
+
+class BatchResearcher:
+    """
+    批量研究流程
+
+    1. 并发规划所有主题
+    2. 合并相同或近似的子任务，每组只研究一次
+    3. 子任务在共享的并发上限内调度执行，搜索查询在整个批次内去重
+    4. 每个主题的子任务全部完成后立即撰写并输出该主题的报告
+    """
+
+    def __init__(self, researcher: MultiAgentResearcher):
+        self.researcher = researcher
+
+    async def astream(self, topics: List[str], run_id: Optional[str] = None,
+                      depth: Optional[ResearchDepth] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式执行批量研究
+
+        所有事件的 metadata 中带有 topic_index（批次级事件除外）
+
+        Args:
+            topics: 研究主题列表
+            run_id: 运行 ID，为空时自动生成
+            depth: 研究深度（批量研究不会改走单 Agent 流程，只降低子任务数和迭代上限）
+
+        Yields:
+            Dict[str, Any]: 流式事件
+        """
+        run = RunContext(run_id, name="batch", topics=topics)
+        depth = depth or DEPTH_LEVELS[0]
+        if depth.route_single:
+            depth = DEPTH_LEVELS[depth.level - 1].because(*depth.reasons)
+        run.depth = depth
+        run.trace.root.set(degradation=depth.to_dict())
+        dedup = SearchDeduplicator(settings.batch_similarity_threshold)
+        current_search_dedup.set(dedup)
+        semaphore = asyncio.Semaphore(max(1, settings.batch_max_concurrency))
+        queue: asyncio.Queue = asyncio.Queue()
+        workers: List[asyncio.Task] = []
+        error = None
+
+        try:
+            # 步骤 1: 并发规划所有主题
+            yield {
+                "type": "thinking",
+                "content": f"🎯 正在规划 {len(topics)} 个研究主题...",
+                "metadata": {"step": "planning", "topic_count": len(topics)}
+            }
+
+            async def plan(topic: str) -> List[Dict[str, Any]]:
+                async with semaphore:
+                    return await self.researcher.plan_research(topic, run)
+
+            plans = await asyncio.gather(*(plan(topic) for topic in topics))
+
+            for topic_index, tasks in enumerate(plans):
+                yield {
+                    "type": "agent_action",
+                    "content": {"action": "plan_created", "tasks": tasks},
+                    "metadata": {"step": "planning", "topic_index": topic_index, "task_count": len(tasks)}
+                }
+
+            # 步骤 2: 合并相同或近似的子任务
+            groups = group_similar_tasks(plans, settings.batch_similarity_threshold)
+            total_tasks = sum(len(tasks) for tasks in plans)
+            yield {
+                "type": "agent_action",
+                "content": {
+                    "action": "batch_deduplicated",
+                    "total_tasks": total_tasks,
+                    "unique_tasks": len(groups)
+                },
+                "metadata": {"step": "planning"}
+            }
+
+            # 步骤 3: 在共享并发上限内执行各组子任务
+            group_results: List[asyncio.Future] = [
+                asyncio.get_running_loop().create_future() for _ in groups
+            ]
+
+            async def research_group(index: int):
+                group = groups[index]
+                
+                def fan_out(event: Dict[str, Any]):
+                    # 共享子任务的进度事件转发给每个所属主题
+                    for topic_index, task in group["members"]:
+                        queue.put_nowait({
+                            **event,
+                            "metadata": {**event["metadata"], "task_id": task.get("task_id"), "topic_index": topic_index}
+                        })
+                
+                throttle = None
+                if settings.research_stream_events:
+                    throttle = ResearchEventThrottle(
+                        fan_out,
+                        min_interval=settings.research_event_interval,
+                        output_chars=settings.research_event_output_chars,
+                    )
+                cached = False
+                try:
+                    async with semaphore:
+                        result, cached = await self.researcher.cached_research_task(group["task"], run, throttle)
+                except Exception as e:
+                    result = f"{TASK_ERROR_PREFIX}：{str(e)}"
+                group_results[index].set_result(result)
+                shared = len(group["members"]) > 1
+                for topic_index, task in group["members"]:
+                    await queue.put({
+                        "type": "agent_action",
+                        "content": {
+                            "action": "task_completed",
+                            "task_id": task.get("task_id"),
+                            "title": task.get("title"),
+                            "shared": shared,
+                            "cached": cached
+                        },
+                        "metadata": {"step": "researching", "topic_index": topic_index}
+                    })
+
+            # 每个主题的子任务 -> 所属分组
+            topic_groups: List[List[Any]] = [[] for _ in topics]
+            for index, group in enumerate(groups):
+                for topic_index, task in group["members"]:
+                    topic_groups[topic_index].append((task, index))
+
+            async def write_topic(topic_index: int):
+                topic = topics[topic_index]
+                try:
+                    research_results = []
+                    for task, index in topic_groups[topic_index]:
+                        research_results.append({
+                            "task": task,
+                            "result": await group_results[index]
+                        })
+                    await queue.put({
+                        "type": "thinking",
+                        "content": f"✍️ 正在撰写研究报告：{topic}",
+                        "metadata": {"step": "writing", "topic_index": topic_index}
+                    })
+                    async for section, content in self.researcher.astream_report(topic, research_results, run):
+                        metadata = {"step": "output", "topic_index": topic_index}
+                        if section:
+                            metadata["section"] = section
+                        await queue.put({"type": "text", "content": content, "metadata": metadata})
+                    await queue.put({
+                        "type": "agent_action",
+                        "content": {"action": "topic_completed", "topic": topic},
+                        "metadata": {"step": "output", "topic_index": topic_index}
+                    })
+                except Exception as e:
+                    await queue.put({
+                        "type": "error",
+                        "content": str(e),
+                        "metadata": {"topic_index": topic_index}
+                    })
+                finally:
+                    await queue.put(None)
+
+            workers = [asyncio.create_task(research_group(i)) for i in range(len(groups))]
+            workers += [asyncio.create_task(write_topic(i)) for i in range(len(topics))]
+
+            yield {
+                "type": "thinking",
+                "content": f"📚 正在执行 {len(groups)} 个子任务（共 {total_tasks} 个，已合并重复项）",
+                "metadata": {"step": "researching"}
+            }
+
+            # 每个主题结束时写入一个 None
+            remaining = len(topics)
+            while remaining:
+                event = await queue.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+
+            yield {
+                "type": "done",
+                "content": "completed",
+                "metadata": {
+                    "run_id": run.run_id,
+                    "usage": run.usage.snapshot(),
+                    "unique_tasks": len(groups),
+                    "total_tasks": total_tasks,
+                    "searches": dedup.stats()
+                }
+            }
+
+        except Exception as e:
+            error = e
+            yield {
+                "type": "error",
+                "content": str(e),
+                "metadata": {"run_id": run.run_id}
+            }
+        finally:
+            for worker in workers:
+                if not worker.done():
+                    worker.cancel()
+            run.finish(error=error)
@@ -2,14 +2,31 @@
 多 Agent 协作架构
 实现：任务拆解 Agent、信息收集 Agent、报告生成 Agent
 """
-from typing import AsyncIterator, Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import AsyncIterator, Callable, Deque, Dict, Any, List, Optional, Tuple
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.prompts import PromptTemplate
 from langchain.schema import HumanMessage, AIMessage
-from config import get_llm_config
+from config import settings
 from tools.tavily_search import get_search_tools
+from services.llm_factory import create_chat_model
+from services.run_context import RunContext
+from services.tracing import Span
+from services.load_policy import DEPTH_LEVELS, ResearchDepth
+from services.quota import QuotaExceededError, current_tenant
+from services.task_cache import task_cache
+from services.checkpoints import RunCheckpoint
+from services.shared_cache import PLAN, shared_cache
+from services.structured_logging import StepLogCallback, get_logger
+from agents.scratchpad import create_compressed_react_agent
+from collections import deque
+import asyncio
 import json
+import time
+
+logger = get_logger("multi_agent")
+
+# 子任务执行出错时研究结果的前缀（这类结果不会被缓存）
+TASK_ERROR_PREFIX = "任务执行出错"
 
 # 任务规划 Agent 提示词
 PLANNER_PROMPT = """你是一个专业的研究任务规划专家。
@@ -21,7 +38,7 @@ PLANNER_PROMPT = """你是一个专业的研究任务规划专家。
 
 用户问题：{input}
 
-请将任务拆解为 3-5 个具体的子任务，每个子任务应该包括：
+请将任务拆解为 {task_range} 个具体的子任务，每个子任务应该包括：
 - 任务标题
 - 调研方向和关键问题
 - 预期输出
@@ -103,29 +120,138 @@ WRITER_PROMPT = """你是一个专业的研究报告撰写专家。
 请撰写完整的研究报告：
 """
 
+# 分章节撰写：背景介绍（只依赖研究计划，可与分析章节并发生成）
+BACKGROUND_PROMPT = """你是一个专业的研究报告撰写专家，正在分章节撰写一份研究报告。
+
+研究主题：{topic}
+
+报告大纲：
+{outline}
+
+请撰写报告的"背景介绍"章节：说明研究主题的背景、研究范围和本报告的结构。
+要求：
+- 使用 Markdown 格式，以 "## 背景介绍" 作为章节标题
+- 只输出本章节内容，不要撰写其他章节
+"""
+
+# 分章节撰写：单个子任务的详细分析
+SECTION_PROMPT = """你是一个专业的研究报告撰写专家，正在分章节撰写一份研究报告。
+
+研究主题：{topic}
+
+报告大纲：
+{outline}
+
+你负责撰写的章节：{section_title}
+
+该子任务的研究结果：
+{research_result}
+
+要求：
+- 使用 Markdown 格式，以 "### {section_title}" 作为章节标题
+- 只输出本章节内容，避免与大纲中其他章节重复
+- 内容要有理有据，引用具体信息，语言专业、客观
+"""
+
+# 分章节撰写：依赖各分析章节的总结性章节
+CLOSING_PROMPT = """你是一个专业的研究报告撰写专家，正在分章节撰写一份研究报告。
+
+研究主题：{topic}
+
+报告的详细分析部分如下：
+{sections}
+
+请撰写报告的"{section_title}"章节：{instruction}
+要求：
+- 使用 Markdown 格式，以 "## {section_title}" 作为章节标题
+- 只输出本章节内容
+"""
+
+# 依赖分析章节的总结性章节：(标题, 撰写要求)
+CLOSING_SECTIONS = [
+    ("总结与关键发现", "概括全部分析的核心结论，并列出最重要的关键发现"),
+    ("结论和展望", "给出整体结论，并对未来发展趋势和后续研究方向进行展望"),
+]
+
+# 研究员进度事件的回调
+EventEmitter = Callable[[Dict[str, Any]], None]
+
+class ResearchEventThrottle:
+    """
+    研究员进度事件的限流
+
+    工具调用总是转发，工具结果只转发摘要；思考过程按子任务限频，避免并发的子任务刷屏
+    """
+
+    def __init__(self, emit: EventEmitter, min_interval: float, output_chars: int):
+        """
+        Args:
+            emit: 实际转发事件的回调
+            min_interval: 同一子任务两次思考事件的最小间隔（秒）
+            output_chars: 工具结果摘要的最大字符数
+        """
+        self.emit = emit
+        self.min_interval = min_interval
+        self.output_chars = output_chars
+        # task_id -> 上次转发思考事件的时间
+        self._last_thinking: Dict[Any, float] = {}
+        self.dropped = 0
+
+    def __call__(self, event: Dict[str, Any]):
+        if event["type"] == "thinking":
+            task_id = event["metadata"].get("task_id")
+            now = time.monotonic()
+            if now - self._last_thinking.get(task_id, float("-inf")) < self.min_interval:
+                self.dropped += 1
+                return
+            self._last_thinking[task_id] = now
+        elif event["type"] == "tool_result":
+            output = event["content"].get("output")
+            text = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False, default=str)
+            if len(text) > self.output_chars:
+                event["content"] = {**event["content"], "output": text[:self.output_chars] + "...", "truncated": True}
+        self.emit(event)
+
+async def stream_while(work: "asyncio.Future", queue: asyncio.Queue) -> AsyncIterator[Any]:
+    """
+    在 work 执行期间逐个产出 queue 中的事件，work 结束后产出剩余事件
+
+    提前停止迭代时会取消 work
+
+    Args:
+        work: 正在执行的任务
+        queue: 事件队列
+    """
+    try:
+        while not work.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({work, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+            else:
+                getter.cancel()
+        while not queue.empty():
+            yield queue.get_nowait()
+    finally:
+        if not work.done():
+            work.cancel()
+
+def _thought_text(text: str) -> str:
+    """从 ReAct 输出中提取思考部分（去掉 Action / Final Answer 之后的内容）"""
+    for marker in ("Action:", "Final Answer:"):
+        text = text.split(marker)[0]
+    return text.replace("Thought:", "").strip()
+
 class MultiAgentResearcher:
     """多 Agent 研究系统"""
     
     def __init__(self):
         """初始化多个 Agent"""
-        llm_config = get_llm_config()
-        
-        # 初始化 LLM
-        self.llm = ChatOpenAI(
-            model=llm_config["model"],
-            temperature=llm_config["temperature"],
-            api_key=llm_config["api_key"],
-            base_url=llm_config["api_base"],
-            streaming=True,
-        )
-        
-        # 低温度 LLM（用于规划和写作）
-        self.llm_low_temp = ChatOpenAI(
-            model=llm_config["model"],
-            temperature=0.3,
-            api_key=llm_config["api_key"],
-            base_url=llm_config["api_base"],
-        )
+        # 各阶段分别初始化 LLM，可配置为不同的模型和 provider
+        # 研究员调用次数最多，适合配置更快、更便宜的模型
+        self.planner_llm = create_chat_model("planner")
+        self.researcher_llm = create_chat_model("researcher", streaming=True)
+        self.writer_llm = create_chat_model("writer")
         
         # 获取工具
         self.tools = get_search_tools()
@@ -138,32 +264,64 @@ class MultiAgentResearcher:
         
         # 研究员 Agent（带工具）
         researcher_prompt = PromptTemplate.from_template(RESEARCHER_PROMPT)
-        researcher_agent = create_react_agent(
-            llm=self.llm,
-            tools=self.tools,
-            prompt=researcher_prompt
-        )
-        self.researcher_executor = AgentExecutor(
-            agent=researcher_agent,
-            tools=self.tools,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=8,
-        )
+        if settings.scratchpad_compression:
+            # 压缩草稿区中的搜索结果，避免提示词随迭代次数膨胀
+            researcher_agent = create_compressed_react_agent(
+                llm=self.researcher_llm,
+                tools=self.tools,
+                prompt=researcher_prompt
+            )
+        else:
+            researcher_agent = create_react_agent(
+                llm=self.researcher_llm,
+                tools=self.tools,
+                prompt=researcher_prompt
+            )
+        self.researcher_agent = researcher_agent
+        self._researcher_executors: Dict[int, AgentExecutor] = {}
+        self.researcher_executor = self._get_researcher_executor(DEPTH_LEVELS[0].max_iterations)
+    
+    def _get_researcher_executor(self, max_iterations: int) -> AgentExecutor:
+        """获取指定迭代上限的研究员执行器（按迭代上限缓存）"""
+        if max_iterations not in self._researcher_executors:
+            self._researcher_executors[max_iterations] = AgentExecutor(
+                agent=self.researcher_agent,
+                tools=self.tools,
+                callbacks=[StepLogCallback("researcher")],
+                handle_parsing_errors=True,
+                max_iterations=max_iterations,
+            )
+        return self._researcher_executors[max_iterations]
     
-    async def plan_research(self, query: str) -> List[Dict[str, Any]]:
+    async def plan_research(self, query: str, run: Optional[RunContext] = None) -> List[Dict[str, Any]]:
         """
         规划研究任务
         
         Args:
             query: 用户查询
+            run: 所属运行的上下文
             
         Returns:
             List[Dict]: 研究任务列表
         """
+        run = run or RunContext(name="plan_research", register=False, query=query)
+        depth = run.depth or DEPTH_LEVELS[0]
+        span = run.trace.start_span("plan", "stage", degradation_level=depth.level)
+        
+        # 同一租户的相同问题（忽略大小写和空白差异）在相同深度下复用其他进程或之前运行的计划
+        cache_key = f"{current_tenant.get()}:{depth.level}:{' '.join(query.lower().split())}"
+        if settings.shared_cache_enabled:
+            cached = await shared_cache.aget(PLAN, cache_key)
+            if cached is not None:
+                span.end(task_count=len(cached), cached=True)
+                return cached
+        
         try:
-            prompt = PLANNER_PROMPT.format(input=query)
-            response = await self.llm_low_temp.ainvoke([HumanMessage(content=prompt)])
+            prompt = PLANNER_PROMPT.format(input=query, task_range=depth.task_range)
+            response = await self.planner_llm.ainvoke(
+                [HumanMessage(content=prompt)],
+                config=run.config("planner", span)
+            )
             
             # 解析 JSON
             content = response.content
@@ -181,10 +339,20 @@ class MultiAgentResearcher:
                 json_str = content
             
             plan_data = json.loads(json_str)
-            return plan_data.get("research_plan", [])
+            # 负载较高时限制子任务数量
+            tasks = plan_data.get("research_plan", [])[:depth.max_tasks]
+            if settings.shared_cache_enabled and tasks:
+                await shared_cache.aput(PLAN, cache_key, tasks, settings.shared_cache_plan_ttl)
+            span.end(task_count=len(tasks))
+            return tasks
             
+        except QuotaExceededError as e:
+            # 配额用尽时中止整个运行，而不是继续用降级结果
+            span.end(error=e)
+            raise
         except Exception as e:
-            print(f"Plan research error: {e}")
+            logger.warning("Plan research error: %s", e, exc_info=True)
+            span.end(error=e, fallback_plan=True)
             # 返回默认计划
             return [
                 {
@@ -195,41 +363,152 @@ class MultiAgentResearcher:
                 }
             ]
     
-    async def research_task(self, task: Dict[str, Any]) -> str:
+    async def research_task(self, task: Dict[str, Any], run: Optional[RunContext] = None,
+                            emit: Optional[EventEmitter] = None) -> str:
         """
         执行单个研究任务
         
         Args:
             task: 任务信息
+            run: 所属运行的上下文
+            emit: 进度事件回调，提供时通过 astream_events 执行并转发工具调用、工具结果和思考过程
             
         Returns:
             str: 研究结果
         """
+        run = run or RunContext(name="research_task", register=False)
+        span = run.trace.start_span(
+            f"task {task.get('task_id')}", "task",
+            task_id=task.get("task_id"), title=task.get("title")
+        )
+        
         try:
             # 构建研究查询
             query = f"{task['title']}\n"
             query += f"调研方向：{', '.join(task['directions'])}\n"
             query += f"预期输出：{task['expected_output']}"
             
-            # 执行研究
-            result = await self.researcher_executor.ainvoke({"input": query})
-            return result.get("output", "")
+            # 执行研究（迭代上限随负载降级）
+            executor = self._get_researcher_executor((run.depth or DEPTH_LEVELS[0]).max_iterations)
+            if emit is None:
+                result = await executor.ainvoke(
+                    {"input": query},
+                    config=run.config("researcher", span)
+                )
+            else:
+                result = await self._stream_researcher(executor, query, task.get("task_id"), run, span, emit)
+            
+            output = result.get("output", "")
+            span.end(result_size=len(output))
+            return output
             
+        except QuotaExceededError as e:
+            span.end(error=e)
+            raise
         except Exception as e:
-            print(f"Research task error: {e}")
-            return f"任务执行出错：{str(e)}"
+            logger.warning("Research task error: %s", e, exc_info=True, extra={"task_id": task.get("task_id")})
+            span.end(error=e)
+            return f"{TASK_ERROR_PREFIX}：{str(e)}"
+    
+    async def _stream_researcher(self, executor: AgentExecutor, query: str, task_id: Any,
+                                 run: RunContext, span: Span, emit: EventEmitter) -> Dict[str, Any]:
+        """通过 astream_events 执行研究员，转发进度事件，返回执行器的最终输出"""
+        metadata = {"step": "researching", "task_id": task_id}
+        root_run_id = None
+        thought = ""
+        result: Dict[str, Any] = {}
+        # 执行器计划好的 AgentAction（先于对应的工具调用输出）；
+        # ReAct 以字符串调用工具，工具事件本身不带输入，只能从这里取
+        pending_actions: Deque[Any] = deque()
+        
+        async for event in executor.astream_events(
+            {"input": query}, config=run.config("researcher", span), version="v2"
+        ):
+            event_type = event.get("event")
+            if root_run_id is None:
+                root_run_id = event.get("run_id")
+            
+            if event_type == "on_chat_model_stream":
+                thought += event["data"]["chunk"].content or ""
+            
+            elif event_type == "on_chat_model_end":
+                # 每轮推理结束时转发思考过程
+                text = _thought_text(thought)
+                thought = ""
+                if text:
+                    emit({"type": "thinking", "content": f"💭 {text}", "metadata": dict(metadata)})
+            
+            elif event_type == "on_chain_stream" and event.get("run_id") == root_run_id:
+                chunk = event["data"].get("chunk")
+                if isinstance(chunk, dict):
+                    pending_actions.extend(chunk.get("actions", []))
+            
+            elif event_type == "on_tool_start":
+                action = pending_actions.popleft() if pending_actions else None
+                tool_input = event["data"].get("input") or (action.tool_input if action is not None else {})
+                emit({
+                    "type": "tool_call",
+                    "content": {"tool": event["name"], "input": tool_input},
+                    "metadata": dict(metadata)
+                })
+            
+            elif event_type == "on_tool_end":
+                emit({
+                    "type": "tool_result",
+                    "content": {"tool": event["name"], "output": event["data"].get("output")},
+                    "metadata": dict(metadata)
+                })
+            
+            elif event_type == "on_chain_end" and event.get("run_id") == root_run_id:
+                result = event["data"].get("output") or {}
+        
+        return result
     
-    async def generate_report(self, topic: str, research_results: List[Dict[str, Any]]) -> str:
+    async def cached_research_task(self, task: Dict[str, Any], run: RunContext,
+                                   emit: Optional[EventEmitter] = None) -> Tuple[str, bool]:
+        """
+        执行单个研究任务，相同或近似的子任务优先复用本租户缓存的研究结果
+        
+        Args:
+            task: 任务信息
+            run: 所属运行的上下文
+            emit: 进度事件回调（见 research_task）
+            
+        Returns:
+            Tuple[str, bool]: (研究结果, 是否命中缓存)
+        """
+        depth_level = (run.depth or DEPTH_LEVELS[0]).level
+        tenant = current_tenant.get()
+        if settings.task_cache_enabled:
+            cached = task_cache.get(task, depth_level, tenant)
+            if cached is not None:
+                run.trace.start_span(
+                    f"task {task.get('task_id')}", "task",
+                    task_id=task.get("task_id"), title=task.get("title"), cached=True
+                ).end(result_size=len(cached))
+                return cached, True
+        
+        result = await self.research_task(task, run, emit)
+        if settings.task_cache_enabled and not result.startswith(TASK_ERROR_PREFIX):
+            task_cache.put(task, result, depth_level, tenant)
+        return result, False
+    
+    async def generate_report(self, topic: str, research_results: List[Dict[str, Any]],
+                              run: Optional[RunContext] = None) -> str:
         """
         生成研究报告
         
         Args:
             topic: 研究主题
             research_results: 各子任务的研究结果
+            run: 所属运行的上下文
             
         Returns:
             str: 完整报告
         """
+        run = run or RunContext(name="generate_report", register=False, topic=topic)
+        span = run.trace.start_span("write", "stage", result_count=len(research_results))
+        
         try:
             # 整理研究结果
             results_text = ""
@@ -243,54 +522,242 @@ class MultiAgentResearcher:
                 research_results=results_text
             )
             
-            response = await self.llm_low_temp.ainvoke([HumanMessage(content=prompt)])
+            response = await self.writer_llm.ainvoke(
+                [HumanMessage(content=prompt)],
+                config=run.config("writer", span)
+            )
+            span.end(input_size=len(results_text), report_size=len(response.content))
             return response.content
             
+        except QuotaExceededError as e:
+            span.end(error=e)
+            raise
         except Exception as e:
-            print(f"Generate report error: {e}")
+            logger.warning("Generate report error: %s", e, exc_info=True)
+            span.end(error=e)
             return f"报告生成出错：{str(e)}"
     
-    async def astream(self, query: str) -> AsyncIterator[Dict[str, Any]]:
+    async def _write_section(self, prompt: str, name: str, run: RunContext, parent: Span,
+                             semaphore: asyncio.Semaphore) -> str:
+        """撰写报告的单个章节，失败时返回错误说明"""
+        span = parent.child(name, "section")
+        try:
+            async with semaphore:
+                response = await self.writer_llm.ainvoke(
+                    [HumanMessage(content=prompt)],
+                    config=run.config("writer", span)
+                )
+            span.end(section_size=len(response.content))
+            return response.content.strip()
+        except QuotaExceededError as e:
+            span.end(error=e)
+            raise
+        except Exception as e:
+            logger.warning("Write section error: %s", e, exc_info=True, extra={"section": name})
+            span.end(error=e)
+            return f"## {name}\n\n（本章节生成出错：{str(e)}）"
+    
+    async def astream_sectioned_report(self, topic: str, research_results: List[Dict[str, Any]],
+                                       run: Optional[RunContext] = None) -> AsyncIterator[Tuple[str, str]]:
+        """
+        分章节并发生成研究报告，按文档顺序流式输出已完成的章节
+        
+        背景介绍与各子任务的分析章节并发生成；总结性章节依赖分析章节，在其全部完成后并发生成
+        
+        Args:
+            topic: 研究主题
+            research_results: 各子任务的研究结果
+            run: 所属运行的上下文
+            
+        Yields:
+            Tuple[str, str]: (章节名称, 章节内容)
+        """
+        run = run or RunContext(name="generate_report", register=False, topic=topic)
+        span = run.trace.start_span("write", "stage", mode="sectioned", result_count=len(research_results))
+        semaphore = asyncio.Semaphore(max(1, settings.writer_max_concurrency))
+        
+        # 根据研究计划生成大纲
+        outline = "\n".join(
+            ["## 背景介绍", "## 详细分析"]
+            + [f"### {result['task']['title']}" for result in research_results]
+            + [f"## {title}" for title, _ in CLOSING_SECTIONS]
+        )
+        
+        background_task = asyncio.create_task(self._write_section(
+            BACKGROUND_PROMPT.format(topic=topic, outline=outline),
+            "背景介绍", run, span, semaphore
+        ))
+        section_tasks = [
+            asyncio.create_task(self._write_section(
+                SECTION_PROMPT.format(
+                    topic=topic,
+                    outline=outline,
+                    section_title=result['task']['title'],
+                    research_result=result['result']
+                ),
+                result['task']['title'], run, span, semaphore
+            ))
+            for result in research_results
+        ]
+        closing_tasks: List[asyncio.Task] = []
+        
+        try:
+            yield "title", f"# {topic}"
+            yield "背景介绍", await background_task
+            yield "详细分析", "## 详细分析"
+            
+            sections = []
+            for result, task in zip(research_results, section_tasks):
+                section = await task
+                sections.append(section)
+                yield result['task']['title'], section
+            
+            sections_text = "\n\n".join(sections)
+            closing_tasks = [
+                asyncio.create_task(self._write_section(
+                    CLOSING_PROMPT.format(
+                        topic=topic,
+                        sections=sections_text,
+                        section_title=title,
+                        instruction=instruction
+                    ),
+                    title, run, span, semaphore
+                ))
+                for title, instruction in CLOSING_SECTIONS
+            ]
+            for (title, _), task in zip(CLOSING_SECTIONS, closing_tasks):
+                yield title, await task
+            
+            span.end(section_count=len(sections) + len(CLOSING_SECTIONS) + 1)
+        finally:
+            # 客户端断开等情况下取消尚未完成的章节
+            for task in [background_task, *section_tasks, *closing_tasks]:
+                if not task.done():
+                    task.cancel()
+    
+    async def astream_report(self, topic: str, research_results: List[Dict[str, Any]],
+                             run: Optional[RunContext] = None) -> AsyncIterator[Tuple[Optional[str], str]]:
+        """
+        按配置的撰写模式流式输出报告
+        
+        Args:
+            topic: 研究主题
+            research_results: 各子任务的研究结果
+            run: 所属运行的上下文
+            
+        Yields:
+            Tuple[Optional[str], str]: (章节名称, 内容)；一次性撰写模式下章节名称为 None
+        """
+        if settings.writer_mode == "sectioned":
+            # 分章节并发撰写，按文档顺序输出已完成的章节
+            async for section, content in self.astream_sectioned_report(topic, research_results, run):
+                yield section, content + "\n\n"
+            return
+        
+        report = await self.generate_report(topic, research_results, run)
+        
+        # 输出报告（逐段流式输出）
+        paragraphs = report.split('\n\n')
+        for paragraph in paragraphs:
+            if paragraph.strip():
+                yield None, paragraph + "\n\n"
+    
+    async def astream(self, query: str, run_id: Optional[str] = None,
+                      depth: Optional[ResearchDepth] = None,
+                      checkpoint: Optional[RunCheckpoint] = None) -> AsyncIterator[Dict[str, Any]]:
         """
         流式执行完整的多 Agent 研究流程
         
+        传入检查点时，每个阶段完成后写入检查点；检查点中已有的计划、子任务结果和报告直接复用
+        
         Args:
             query: 用户查询
+            run_id: 运行 ID（可通过 /api/runs/{run_id}/trace 查询追踪），为空时自动生成
+            depth: 研究深度（负载降级策略给出），为空时使用正常深度
+            checkpoint: 运行的检查点（恢复中断的运行时包含已完成的阶段）
             
         Yields:
             Dict[str, Any]: 流式事件
         """
+        run = RunContext(run_id, name="multi_agent", query=query)
+        run.depth = depth or DEPTH_LEVELS[0]
+        run.trace.root.set(degradation=run.depth.to_dict())
+        error = None
+        
         try:
             # 步骤 1: 规划任务
-            yield {
-                "type": "thinking",
-                "content": "🎯 正在规划研究任务...",
-                "metadata": {"step": "planning"}
-            }
-            
-            tasks = await self.plan_research(query)
+            resumed_plan = checkpoint is not None and checkpoint.plan is not None
+            if resumed_plan:
+                tasks = checkpoint.plan
+            else:
+                yield {
+                    "type": "thinking",
+                    "content": "🎯 正在规划研究任务...",
+                    "metadata": {"step": "planning"}
+                }
+                
+                tasks = await self.plan_research(query, run)
+                if checkpoint is not None:
+                    await checkpoint.save(plan=tasks)
             
             yield {
                 "type": "agent_action",
                 "content": {
                     "action": "plan_created",
-                    "tasks": tasks
+                    "tasks": tasks,
+                    "resumed": resumed_plan
                 },
                 "metadata": {"step": "planning", "task_count": len(tasks)}
             }
             
             # 步骤 2: 执行各个子任务
             research_results = []
+            progress: asyncio.Queue = asyncio.Queue()
+            throttle = ResearchEventThrottle(
+                progress.put_nowait,
+                min_interval=settings.research_event_interval,
+                output_chars=settings.research_event_output_chars,
+            )
             
             for i, task in enumerate(tasks, 1):
+                # 检查点中已完成的子任务不再执行
+                result = checkpoint.result(task['task_id']) if checkpoint is not None else None
+                if result is not None:
+                    research_results.append({
+                        "task": task,
+                        "result": result
+                    })
+                    yield {
+                        "type": "agent_action",
+                        "content": {
+                            "action": "task_completed",
+                            "task_id": task['task_id'],
+                            "title": task['title'],
+                            "cached": False,
+                            "resumed": True
+                        },
+                        "metadata": {"step": "researching"}
+                    }
+                    continue
+                
                 yield {
                     "type": "thinking",
                     "content": f"📚 正在执行子任务 {i}/{len(tasks)}: {task['title']}",
                     "metadata": {"step": "researching", "task_id": task['task_id']}
                 }
                 
-                # 执行研究任务（流式输出工具调用）
-                result = await self.research_task(task)
+                # 执行研究任务（相同或近似的子任务复用缓存结果），期间转发研究员的进度事件
+                if settings.research_stream_events:
+                    work = asyncio.ensure_future(self.cached_research_task(task, run, throttle))
+                    async for event in stream_while(work, progress):
+                        yield event
+                    result, cached = work.result()
+                else:
+                    result, cached = await self.cached_research_task(task, run)
+                
+                # 出错的结果不写入检查点，恢复时重新执行
+                if checkpoint is not None and not result.startswith(TASK_ERROR_PREFIX):
+                    await checkpoint.save_result(task['task_id'], result)
                 
                 research_results.append({
                     "task": task,
@@ -302,41 +769,58 @@ class MultiAgentResearcher:
                     "content": {
                         "action": "task_completed",
                         "task_id": task['task_id'],
-                        "title": task['title']
+                        "title": task['title'],
+                        "cached": cached,
+                        "resumed": False
                     },
                     "metadata": {"step": "researching"}
                 }
             
-            # 步骤 3: 生成报告
-            yield {
-                "type": "thinking",
-                "content": "✍️ 正在撰写研究报告...",
-                "metadata": {"step": "writing"}
-            }
-            
-            report = await self.generate_report(query, research_results)
-            
-            # 输出报告（逐段流式输出）
-            paragraphs = report.split('\n\n')
-            for paragraph in paragraphs:
-                if paragraph.strip():
+            # 步骤 3: 生成报告（检查点中已有报告时直接输出）
+            if checkpoint is not None and checkpoint.report is not None:
+                for paragraph in checkpoint.report.split('\n\n'):
+                    if paragraph.strip():
+                        yield {
+                            "type": "text",
+                            "content": paragraph + "\n\n",
+                            "metadata": {"step": "output", "resumed": True}
+                        }
+            else:
+                yield {
+                    "type": "thinking",
+                    "content": "✍️ 正在撰写研究报告...",
+                    "metadata": {"step": "writing"}
+                }
+                
+                report_parts = []
+                async for section, content in self.astream_report(query, research_results, run):
+                    report_parts.append(content)
+                    metadata = {"step": "output"}
+                    if section:
+                        metadata["section"] = section
                     yield {
                         "type": "text",
-                        "content": paragraph + "\n\n",
-                        "metadata": {"step": "output"}
+                        "content": content,
+                        "metadata": metadata
                     }
+                
+                if checkpoint is not None:
+                    await checkpoint.save(report="".join(report_parts))
             
-            # 完成
+            # 完成（附带各阶段耗时和 token 用量）
             yield {
                 "type": "done",
                 "content": "completed",
-                "metadata": {}
+                "metadata": {"run_id": run.run_id, "usage": run.usage.snapshot()}
             }
             
         except Exception as e:
+            error = e
             yield {
                 "type": "error",
                 "content": str(e),
-                "metadata": {}
+                "metadata": {"run_id": run.run_id}
             }
+        finally:
+            run.finish(error=error)
 
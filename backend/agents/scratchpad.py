@@ -0,0 +1,234 @@
+"""
+ReAct 草稿区（agent_scratchpad）压缩
+
+默认的 ReAct Agent 会把每次搜索的完整结果原样拼进 agent_scratchpad，
+提示词长度随迭代次数线性增长。这里按查询相关度挑选每条观察结果中最相关的段落，
+并把整个草稿区控制在 token 预算内（只影响发给 LLM 的提示词，工具调用本身的输出不变）
+"""
+from typing import Any, Dict, List, Sequence, Tuple
+from collections import Counter
+from functools import lru_cache
+import json
+import math
+import re
+
+from langchain.agents.output_parsers import ReActSingleInputOutputParser
+from langchain.prompts import PromptTemplate
+from langchain.tools.render import render_text_description
+from langchain_core.agents import AgentAction
+from langchain_core.runnables import Runnable, RunnablePassthrough
+
+from config import settings
+from services.usage import estimate_tokens
+from services.similarity import text_terms
+
+# 段落切分：中英文句末标点和换行
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?；;])|(?<=\.)\s+|\n+")
+
+# 单个段落的目标长度（字符）
+PASSAGE_CHARS = 240
+
+# 观察结果被完全省略时的占位文本
+OMITTED_OBSERVATION = "（早期观察结果已省略）"
+
+def _split_passages(text: str) -> List[str]:
+    """把文本按句子切分并合并成长度接近 PASSAGE_CHARS 的段落"""
+    passages, current = [], ""
+    for sentence in _SENTENCE_SPLIT.split(text):
+        sentence = (sentence or "").strip()
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) > PASSAGE_CHARS:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip() if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+def _observation_documents(observation: Any) -> List[Tuple[str, str]]:
+    """把工具输出规整为 [(来源, 文本)]，兼容 Tavily 的结果列表和普通字符串"""
+    if isinstance(observation, str):
+        try:
+            parsed = json.loads(observation)
+        except ValueError:
+            return [("", observation)]
+        observation = parsed
+    if isinstance(observation, dict):
+        observation = [observation]
+    if isinstance(observation, list):
+        documents = []
+        for item in observation:
+            if isinstance(item, dict):
+                documents.append((str(item.get("url", "")), str(item.get("content", "") or item)))
+            else:
+                documents.append(("", str(item)))
+        return documents
+    return [("", str(observation))]
+
+def _bm25_scores(query_terms: List[str], passages: List[List[str]], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """BM25 打分（以候选段落集合自身计算 IDF）"""
+    if not passages:
+        return []
+    n = len(passages)
+    avg_len = sum(len(p) for p in passages) / n or 1.0
+    doc_freq = Counter(term for passage in passages for term in set(passage))
+    query_counts = Counter(query_terms)
+    scores = []
+    for passage in passages:
+        counts = Counter(passage)
+        score = 0.0
+        for term, weight in query_counts.items():
+            tf = counts.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += weight * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(passage) / avg_len))
+        scores.append(score)
+    return scores
+
+@lru_cache(maxsize=512)
+def _compress_text(query: str, observation_text: str, max_tokens: int) -> str:
+    """按相关度压缩一条观察结果（带缓存，每轮迭代会重复压缩之前的观察结果）"""
+    if max_tokens <= 0:
+        return OMITTED_OBSERVATION
+    if estimate_tokens(observation_text) <= max_tokens:
+        return observation_text
+
+    # (来源序号, 段落序号, 来源, 段落)
+    candidates = []
+    for doc_index, (source, text) in enumerate(_observation_documents(observation_text)):
+        for passage_index, passage in enumerate(_split_passages(text)):
+            candidates.append((doc_index, passage_index, source, passage))
+    if not candidates:
+        return observation_text[:max_tokens]
+
+    scores = _bm25_scores(text_terms(query), [text_terms(c[3]) for c in candidates])
+    ranked = sorted(range(len(candidates)), key=lambda i: (-scores[i], i))
+
+    selected, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(candidates[i][3])
+        if used + cost > max_tokens:
+            if selected:
+                continue
+            # 至少保留一个段落（截断）
+            selected.append(i)
+            break
+        selected.append(i)
+        used += cost
+
+    # 按原始顺序输出，同一来源的段落合并
+    lines, last_doc = [], None
+    for i in sorted(selected):
+        doc_index, _, source, passage = candidates[i]
+        if doc_index != last_doc:
+            lines.append(f"[{source}]" if source else "[-]")
+            last_doc = doc_index
+        lines.append(passage if estimate_tokens(passage) <= max_tokens else passage[:max_tokens])
+    return "\n".join(lines)
+
+def _observation_to_text(observation: Any) -> str:
+    if isinstance(observation, str):
+        return observation
+    try:
+        return json.dumps(observation, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return str(observation)
+
+def compress_observation(query: str, observation: Any, max_tokens: int) -> str:
+    """
+    保留观察结果中与查询最相关的段落
+
+    Args:
+        query: 查询（工具输入 + 研究问题）
+        observation: 工具输出
+        max_tokens: 压缩后的 token 上限
+
+    Returns:
+        str: 压缩后的观察结果
+    """
+    return _compress_text(query, _observation_to_text(observation), max_tokens)
+
+def format_compressed_scratchpad(intermediate_steps: Sequence[Tuple[AgentAction, Any]], question: str,
+                                 token_budget: int, observation_budget: int) -> str:
+    """
+    生成压缩后的 agent_scratchpad
+
+    每条观察结果先压缩到 observation_budget；草稿区整体超过 token_budget 时，
+    从最早的观察结果开始逐步减半，必要时整条省略
+
+    Args:
+        intermediate_steps: (AgentAction, 观察结果) 列表
+        question: 当前研究问题
+        token_budget: 草稿区 token 预算
+        observation_budget: 单条观察结果的 token 预算
+
+    Returns:
+        str: agent_scratchpad 文本
+    """
+    steps = list(intermediate_steps)
+    budgets = [observation_budget] * len(steps)
+    queries = [f"{action.tool_input} {question}" for action, _ in steps]
+    log_tokens = sum(estimate_tokens(action.log) for action, _ in steps)
+
+    def render(index: int) -> str:
+        return compress_observation(queries[index], steps[index][1], budgets[index])
+
+    observations = [render(i) for i in range(len(steps))]
+    total = log_tokens + sum(estimate_tokens(o) for o in observations)
+
+    # 从最早的观察结果开始收缩，最新一条保持不变
+    index = 0
+    while total > token_budget and len(steps) > 1:
+        if index >= len(steps) - 1:
+            if all(budget == 0 for budget in budgets[:-1]):
+                break
+            index = 0
+            continue
+        if budgets[index] > 0:
+            budgets[index] = budgets[index] // 2 if budgets[index] > 64 else 0
+            old_tokens = estimate_tokens(observations[index])
+            observations[index] = render(index)
+            total += estimate_tokens(observations[index]) - old_tokens
+        index += 1
+
+    thoughts = ""
+    for (action, _), observation in zip(steps, observations):
+        thoughts += action.log
+        thoughts += f"\nObservation: {observation}\nThought: "
+    return thoughts
+
+def create_compressed_react_agent(llm: Any, tools: Sequence[Any], prompt: PromptTemplate) -> Runnable:
+    """
+    创建 ReAct Agent（与 create_react_agent 相同，但使用压缩后的草稿区）
+
+    Args:
+        llm: LLM
+        tools: 工具列表
+        prompt: ReAct 提示词模板（需包含 tools / tool_names / input / agent_scratchpad）
+
+    Returns:
+        Runnable: Agent
+    """
+    prompt = prompt.partial(
+        tools=render_text_description(list(tools)),
+        tool_names=", ".join(tool.name for tool in tools),
+    )
+    llm_with_stop = llm.bind(stop=["\nObservation"])
+
+    def scratchpad(inputs: Dict[str, Any]) -> str:
+        return format_compressed_scratchpad(
+            inputs["intermediate_steps"],
+            inputs["input"],
+            token_budget=settings.scratchpad_token_budget,
+            observation_budget=settings.observation_token_budget,
+        )
+
+    return (
+        RunnablePassthrough.assign(agent_scratchpad=scratchpad)
+        | prompt
+        | llm_with_stop
+        | ReActSingleInputOutputParser()
+    )
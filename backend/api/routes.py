@@ -1,103 +1,442 @@
 """
 API 路由定义
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
 from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from typing import Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
 import json
+import secrets
 import uuid
 from datetime import datetime
 
 from models.schemas import (
-    ChatRequest, ChatResponse, StreamEvent,
+    ChatRequest, BatchResearchRequest, ChatResponse, StreamEvent,
     Session, SessionCreate, SessionList, Message
 )
 from agents.base_agent import BaseResearchAgent
 from agents.multi_agent import MultiAgentResearcher
+from agents.batch import BatchResearcher
+from config import settings
+from services.llm_factory import describe_stage_models
+from services.usage import llm_usage
+from services.provider_pool import provider_health_snapshot
+from services.rate_limiter import rate_limiter_snapshot
+from services.tracing import trace_store
+from services.load_policy import DEPTH_LEVELS, ResearchDepth, degrade_for_quota, load_monitor
+from services.quota import DEFAULT_TENANT, UNKNOWN_TENANT, current_tenant, quota_ledger
+from services.session_store import create_session_store
+from services.structured_logging import logging_stats
+from services.task_cache import task_cache
+from services.run_streams import END_EVENT, run_streams
+from services.checkpoints import STATUS_COMPLETED, STATUS_RUNNING, RunCheckpoint, checkpoint_store
+from services.shared_cache import shared_cache
+from services.structured_logging import get_logger
 
 router = APIRouter()
+logger = get_logger("routes")
 
-# 简单的内存存储（生产环境应该使用数据库）
-sessions_db: Dict[str, Session] = {}
+# 内存会话存储（带容量限制，生产环境应该使用数据库）
+session_store = create_session_store()
 
 # Agent 实例（单例）
 agent = BaseResearchAgent()
 multi_agent = MultiAgentResearcher()
+batch_agent = BatchResearcher(multi_agent)
+
+def _resolve_tenant(http_request: HTTPConnection) -> str:
+    """
+    确定请求所属的租户
+    
+    带 API Key 时以 Key 映射的租户为准（忽略租户请求头，未映射的 Key 共用 unknown 租户）；
+    没有 API Key 时，只有开启 tenant_header_trusted 才使用租户请求头；
+    否则开启配额时同样归入 unknown 租户（不能共用默认租户的预算），未开启时为默认租户
+    
+    Args:
+        http_request: HTTP 请求或 WebSocket 连接
+        
+    Returns:
+        str: 租户名称
+    """
+    api_key = http_request.headers.get("X-API-Key")
+    authorization = http_request.headers.get("Authorization", "")
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[7:]
+    if api_key:
+        for item in settings.tenant_api_keys.split(","):
+            key, _, name = item.partition(":")
+            if key.strip() and key.strip() == api_key.strip():
+                return name.strip()
+        return UNKNOWN_TENANT
+    
+    tenant = http_request.headers.get(settings.tenant_header)
+    if tenant and settings.tenant_header_trusted:
+        return tenant.strip()
+    return UNKNOWN_TENANT if settings.quota_enabled else DEFAULT_TENANT
+
+def _start_quota(tenant: str) -> str:
+    """
+    检查租户配额并记录一次运行，超过预算时拒绝请求
+    
+    Args:
+        tenant: 租户名称
+        
+    Returns:
+        str: 配额状态（ok / soft / exceeded）
+    """
+    level = quota_ledger.status(tenant)["level"]
+    if settings.quota_enabled and level == "exceeded":
+        raise HTTPException(status_code=429, detail=f"租户 {tenant} 今日配额已用尽")
+    quota_ledger.record(tenant, runs=1)
+    return level
+
+def _quota_depth(depth: ResearchDepth, quota_level: str) -> ResearchDepth:
+    """租户用量超过软限制时把研究深度再降一级"""
+    if not settings.quota_enabled or quota_level != "soft":
+        return depth
+    return degrade_for_quota(depth)
+
+async def _open_chat_session(message: str, session_id: Optional[str]) -> Session:
+    """
+    获取或创建会话，并添加用户消息
+    
+    Args:
+        message: 用户消息
+        session_id: 会话 ID，为空时创建新会话
+        
+    Returns:
+        Session: 会话
+    """
+    session_id = session_id or str(uuid.uuid4())
+    
+    session = await session_store.aget(session_id)
+    if session is None:
+        session = Session(
+            session_id=session_id,
+            title=message[:50],
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            messages=[]
+        )
+        session_store.put(session)
+    
+    # 添加用户消息
+    user_message = Message(
+        role="user",
+        content=message,
+        timestamp=datetime.now()
+    )
+    session_store.add_message(session, user_message)
+    return session
+
+async def _chat_events(message: str, session: Session, tenant: str,
+                       depth: Optional[ResearchDepth] = None,
+                       run_id: Optional[str] = None,
+                       checkpoint: Optional[RunCheckpoint] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    执行一次聊天运行，产出 (事件名, 数据)，结束后把助手回复保存到会话（SSE 和 WebSocket 共用）
+    
+    多 Agent 运行的每个阶段写入检查点；运行中断（客户端断开、进程退出）时检查点保持进行中状态，
+    之后可以从检查点恢复
+    
+    Args:
+        message: 用户消息
+        session: 会话
+        tenant: 租户名称
+        depth: 研究深度，为空时走单 Agent 流程
+        run_id: 运行 ID，为空时自动生成
+        checkpoint: 恢复运行时的检查点（需已由当前进程声明执行），为空时为新的多 Agent 运行创建检查点
+        
+    Yields:
+        Tuple[str, Dict]: 事件名和事件数据
+    """
+    # 本次运行的用量计入该租户
+    current_tenant.set(tenant)
+    run_id = run_id or str(uuid.uuid4())
+    # 单 Agent 请求，或负载过高时改走单 Agent 流程
+    multi = depth is not None and not depth.route_single
+    # 运行期间会话不会被淘汰，助手回复写入的始终是内存中的会话
+    session_store.pin(session.session_id)
+    try:
+        # 发送会话 ID 和运行 ID
+        yield "session", {"session_id": session.session_id, "run_id": run_id}
+        
+        if multi and checkpoint is None and settings.checkpoint_enabled:
+            checkpoint = await checkpoint_store.create(
+                run_id, message,
+                session_id=session.session_id, tenant=tenant,
+                depth_level=depth.level, depth_reasons=depth.reasons
+            )
+        
+        # 收集完整响应
+        full_response = ""
+        failed = None
+        
+        with load_monitor.track_run():
+            if multi:
+                stream = multi_agent.astream(message, run_id=run_id, depth=depth, checkpoint=checkpoint)
+            else:
+                stream = agent.astream(message, run_id=run_id)
+            
+            async for event in stream:
+                # 附带降级等级
+                if depth is not None:
+                    event["metadata"] = {**(event.get("metadata") or {}), "degradation": depth.to_metadata()}
+                
+                yield event["type"], event
+                
+                # 收集文本内容
+                if event["type"] == "text":
+                    full_response += event["content"]
+                elif event["type"] == "error":
+                    failed = event["content"]
+        
+        # 保存助手消息
+        assistant_message = Message(
+            role="assistant",
+            content=full_response,
+            timestamp=datetime.now()
+        )
+        session_store.add_message(session, assistant_message)
+        
+        if checkpoint is not None:
+            if failed is None:
+                await checkpoint.complete()
+            else:
+                await checkpoint.fail(failed)
+        
+    except Exception as e:
+        if checkpoint is not None:
+            await checkpoint.fail(e)
+        yield "error", {"error": str(e)}
+    except (asyncio.CancelledError, GeneratorExit) as e:
+        # 用户取消、无人订阅超时或客户端断开的运行不再恢复；只有关闭服务时被中断的运行保持可恢复
+        if checkpoint is not None and not checkpoint_store.draining:
+            checkpoint.cancel(str(e) or "client_disconnected")
+        raise
+    finally:
+        session_store.unpin(session.session_id)
+        # 进程关闭时被中断的运行只释放执行权，检查点保持进行中状态，下次启动时恢复
+        if checkpoint is not None:
+            checkpoint_store.release(run_id)
+
+async def _restore_session(checkpoint: RunCheckpoint) -> Session:
+    """获取检查点所属的会话，会话已不存在（如进程重启）时按原会话 ID 重建"""
+    session_id = checkpoint.meta.get("session_id") or str(uuid.uuid4())
+    session = await session_store.aget(session_id)
+    if session is None:
+        session = Session(
+            session_id=session_id,
+            title=checkpoint.query[:50],
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            messages=[Message(role="user", content=checkpoint.query, timestamp=datetime.now())]
+        )
+        session_store.put(session)
+    return session
+
+async def _resume_events(checkpoint: RunCheckpoint) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    从检查点恢复一次多 Agent 运行（沿用原运行 ID、会话、租户和研究深度）
+    
+    Args:
+        checkpoint: 运行的检查点
+        
+    Yields:
+        Tuple[str, Dict]: 事件名和事件数据
+    """
+    if not checkpoint_store.claim(checkpoint.run_id):
+        yield "error", {"error": "运行正在进行中"}
+        return
+    
+    logger.info("Resuming run from checkpoint", extra={"checkpoint_run_id": checkpoint.run_id})
+    try:
+        await checkpoint.save(status=STATUS_RUNNING, error=None)
+    except Exception:
+        checkpoint_store.release(checkpoint.run_id)
+        raise
+    
+    # 检查点只在多 Agent 流程中创建，恢复时不降级到单 Agent
+    depth = DEPTH_LEVELS[min(checkpoint.meta.get("depth_level", 0), len(DEPTH_LEVELS) - 2)]
+    depth = depth.because(*checkpoint.meta.get("depth_reasons", []))
+    try:
+        session = await _restore_session(checkpoint)
+    except Exception:
+        checkpoint_store.release(checkpoint.run_id)
+        raise
+    async for event, data in _chat_events(
+        checkpoint.query, session, checkpoint.meta.get("tenant", DEFAULT_TENANT),
+        depth, checkpoint.run_id, checkpoint
+    ):
+        yield event, data
+
+def resume_interrupted_runs() -> List[str]:
+    """
+    在后台恢复所有中断的运行（启动时调用），客户端可以通过 WebSocket 按运行 ID 订阅
+    
+    Returns:
+        List[str]: 恢复的运行 ID
+    """
+    checkpoint_store.purge()
+    run_ids = []
+    for checkpoint in checkpoint_store.interrupted():
+        if run_streams.get(checkpoint.run_id) is None:
+            run_streams.start(
+                checkpoint.run_id, _resume_events(checkpoint), checkpoint.meta.get("tenant", DEFAULT_TENANT)
+            )
+            run_ids.append(checkpoint.run_id)
+    return run_ids
+
+async def drain_runs(timeout: float):
+    """
+    关闭前等待进行中的运行完成，超时后取消剩余的后台运行（检查点保留，下次启动时恢复）
+    
+    Args:
+        timeout: 最长等待时间（秒）
+    """
+    checkpoint_store.draining = True
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while load_monitor.in_flight > 0 and loop.time() < deadline:
+        await asyncio.sleep(0.5)
+    if load_monitor.in_flight > 0:
+        logger.warning(
+            "Shutdown drain timed out with %s runs in flight", load_monitor.in_flight,
+            extra={"in_flight": load_monitor.in_flight, "drain_timeout": timeout}
+        )
+    await run_streams.cancel_all("shutdown")
 
 @router.post("/chat/multi", response_class=EventSourceResponse)
-async def chat_multi_agent(request: ChatRequest):
+async def chat_multi_agent(request: ChatRequest, http_request: Request):
     """
     多 Agent 研究接口 - 支持流式响应
     
     Args:
         request: 聊天请求
+        http_request: HTTP 请求（用于确定租户）
         
     Returns:
         StreamingResponse: SSE 流式响应
     """
+    tenant = _resolve_tenant(http_request)
+    quota_level = _start_quota(tenant)
+    
     try:
-        # 获取或创建会话
-        session_id = request.session_id or str(uuid.uuid4())
+        session = await _open_chat_session(request.message, request.session_id)
+        
+        # 根据当前负载和租户配额确定研究深度
+        depth = _quota_depth(load_monitor.assess(), quota_level)
+        
+        # 流式响应生成器
+        async def event_generator():
+            """生成 SSE 事件"""
+            async for event, data in _chat_events(request.message, session, tenant, depth):
+                yield {"event": event, "data": json.dumps(data, ensure_ascii=False)}
+        
+        return EventSourceResponse(event_generator())
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/batch", response_class=EventSourceResponse)
+async def chat_batch(request: BatchResearchRequest, http_request: Request):
+    """
+    批量研究接口 - 一次提交多个主题，跨主题合并重复的子任务和搜索
+    
+    每个主题对应一个会话，报告完成后保存到对应会话中；
+    事件的 metadata.topic_index 标识所属主题
+    
+    Args:
+        request: 批量研究请求
+        http_request: HTTP 请求（用于确定租户）
         
-        if session_id not in sessions_db:
-            sessions_db[session_id] = Session(
+    Returns:
+        StreamingResponse: SSE 流式响应
+    """
+    topics = [topic.strip() for topic in request.topics if topic.strip()]
+    if not topics:
+        raise HTTPException(status_code=400, detail="请至少提供一个研究主题")
+    if len(topics) > settings.batch_max_topics:
+        raise HTTPException(status_code=400, detail=f"单批最多 {settings.batch_max_topics} 个主题")
+    
+    tenant = _resolve_tenant(http_request)
+    quota_level = _start_quota(tenant)
+    
+    try:
+        # 每个主题创建一个会话
+        sessions = []
+        for topic in topics:
+            session_id = str(uuid.uuid4())
+            session = Session(
                 session_id=session_id,
-                title=request.message[:50],
+                title=topic[:50],
                 created_at=datetime.now(),
                 updated_at=datetime.now(),
-                messages=[]
+                messages=[Message(role="user", content=topic, timestamp=datetime.now())]
             )
+            session_store.put(session)
+            sessions.append(session)
         
-        session = sessions_db[session_id]
-        
-        # 添加用户消息
-        user_message = Message(
-            role="user",
-            content=request.message,
-            timestamp=datetime.now()
-        )
-        session.messages.append(user_message)
+        run_id = str(uuid.uuid4())
         
         # 流式响应生成器
         async def event_generator():
             """生成 SSE 事件"""
+            # 本次运行的用量计入该租户
+            current_tenant.set(tenant)
+            # 运行期间各主题的会话不会被淘汰
+            for session in sessions:
+                session_store.pin(session.session_id)
             try:
-                # 发送会话 ID
+                # 发送各主题的会话 ID 和运行 ID
                 yield {
                     "event": "session",
-                    "data": json.dumps({"session_id": session_id})
+                    "data": json.dumps({
+                        "run_id": run_id,
+                        "sessions": [
+                            {"topic_index": i, "session_id": session.session_id}
+                            for i, session in enumerate(sessions)
+                        ]
+                    })
                 }
                 
-                # 收集完整响应
-                full_response = ""
+                # 按主题收集报告
+                reports = [""] * len(topics)
                 
-                # 流式执行多 Agent
-                async for event in multi_agent.astream(request.message):
-                    # 发送事件
-                    yield {
-                        "event": event["type"],
-                        "data": json.dumps(event, ensure_ascii=False)
-                    }
-                    
-                    # 收集文本内容
-                    if event["type"] == "text":
-                        full_response += event["content"]
+                depth = _quota_depth(load_monitor.assess(), quota_level)
                 
-                # 保存助手消息
-                assistant_message = Message(
-                    role="assistant",
-                    content=full_response,
-                    timestamp=datetime.now()
-                )
-                session.messages.append(assistant_message)
-                session.updated_at = datetime.now()
+                with load_monitor.track_run():
+                    async for event in batch_agent.astream(topics, run_id=run_id, depth=depth):
+                        event["metadata"] = {**(event.get("metadata") or {}), "degradation": depth.to_metadata()}
+                        yield {
+                            "event": event["type"],
+                            "data": json.dumps(event, ensure_ascii=False)
+                        }
+                        
+                        topic_index = event["metadata"].get("topic_index")
+                        if topic_index is None:
+                            continue
+                        if event["type"] == "text":
+                            reports[topic_index] += event["content"]
+                        elif event["type"] == "agent_action" and event["content"].get("action") == "topic_completed":
+                            # 保存助手消息
+                            session = sessions[topic_index]
+                            session_store.add_message(session, Message(
+                                role="assistant",
+                                content=reports[topic_index],
+                                timestamp=datetime.now()
+                            ))
                 
             except Exception as e:
                 yield {
                     "event": "error",
                     "data": json.dumps({"error": str(e)}, ensure_ascii=False)
                 }
+            finally:
+                for session in sessions:
+                    session_store.unpin(session.session_id)
         
         return EventSourceResponse(event_generator())
         
@@ -105,78 +444,28 @@ async def chat_multi_agent(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat", response_class=EventSourceResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     单 Agent 聊天接口 - 支持流式响应
     
     Args:
         request: 聊天请求
+        http_request: HTTP 请求（用于确定租户）
         
     Returns:
         StreamingResponse: SSE 流式响应
     """
+    tenant = _resolve_tenant(http_request)
+    _start_quota(tenant)
+    
     try:
-        # 获取或创建会话
-        session_id = request.session_id or str(uuid.uuid4())
-        
-        if session_id not in sessions_db:
-            sessions_db[session_id] = Session(
-                session_id=session_id,
-                title=request.message[:50],
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-                messages=[]
-            )
-        
-        session = sessions_db[session_id]
-        
-        # 添加用户消息
-        user_message = Message(
-            role="user",
-            content=request.message,
-            timestamp=datetime.now()
-        )
-        session.messages.append(user_message)
+        session = await _open_chat_session(request.message, request.session_id)
         
         # 流式响应生成器
         async def event_generator():
             """生成 SSE 事件"""
-            try:
-                # 发送会话 ID
-                yield {
-                    "event": "session",
-                    "data": json.dumps({"session_id": session_id})
-                }
-                
-                # 收集完整响应
-                full_response = ""
-                
-                # 流式执行 Agent
-                async for event in agent.astream(request.message):
-                    # 发送事件
-                    yield {
-                        "event": event["type"],
-                        "data": json.dumps(event, ensure_ascii=False)
-                    }
-                    
-                    # 收集文本内容
-                    if event["type"] == "text":
-                        full_response += event["content"]
-                
-                # 保存助手消息
-                assistant_message = Message(
-                    role="assistant",
-                    content=full_response,
-                    timestamp=datetime.now()
-                )
-                session.messages.append(assistant_message)
-                session.updated_at = datetime.now()
-                
-            except Exception as e:
-                yield {
-                    "event": "error",
-                    "data": json.dumps({"error": str(e)}, ensure_ascii=False)
-                }
+            async for event, data in _chat_events(request.message, session, tenant):
+                yield {"event": event, "data": json.dumps(data, ensure_ascii=False)}
         
         return EventSourceResponse(event_generator())
         
@@ -184,16 +473,21 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat/simple", response_model=ChatResponse)
-async def chat_simple(request: ChatRequest):
+async def chat_simple(request: ChatRequest, http_request: Request):
     """
     简单聊天接口 - 非流式响应（用于测试）
     
     Args:
         request: 聊天请求
+        http_request: HTTP 请求（用于确定租户）
         
     Returns:
         ChatResponse: 聊天响应
     """
+    tenant = _resolve_tenant(http_request)
+    _start_quota(tenant)
+    current_tenant.set(tenant)
+    
     try:
         session_id = request.session_id or str(uuid.uuid4())
         
@@ -208,6 +502,119 @@ async def chat_simple(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    WebSocket 接口 - 在一个连接上同时运行和订阅多个研究流
+    
+    客户端消息（JSON，s 为客户端分配的流 ID）：
+        {"op": "start", "s": "1", "message": "...", "session_id": null, "mode": "multi" | "single"}
+        {"op": "subscribe", "s": "2", "run_id": "..."}  订阅已有的运行（先补发最近的事件）
+        {"op": "unsubscribe", "s": "2"}
+        {"op": "cancel", "s": "1"}  取消该流对应的运行
+        {"op": "ping"}
+    
+    服务端消息：{"s": 流 ID, "e": 事件名, "d": 事件数据}，事件名和数据与 SSE 接口相同，
+    运行结束后发送 e 为 "end" 的消息
+    """
+    await websocket.accept()
+    tenant = _resolve_tenant(websocket)
+    outgoing: asyncio.Queue = asyncio.Queue()
+    # 流 ID -> 运行事件流
+    subscriptions: Dict[str, Any] = {}
+    
+    async def sender():
+        while True:
+            stream_id, event, data = await outgoing.get()
+            if event == END_EVENT:
+                subscriptions.pop(stream_id, None)
+            frame = {"s": stream_id, "e": event, "d": data} if stream_id is not None else {"e": event, "d": data}
+            await websocket.send_text(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+    
+    def reply_error(stream_id: Optional[str], error: str):
+        outgoing.put_nowait((stream_id, "error", {"error": error}))
+    
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None:
+                reply_error(None, "只支持文本消息")
+                continue
+            try:
+                payload = json.loads(message["text"])
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                reply_error(None, "消息格式错误")
+                continue
+            op = payload.get("op")
+            stream_id = str(payload.get("s")) if payload.get("s") is not None else None
+            
+            if op == "ping":
+                outgoing.put_nowait((None, "pong", {}))
+                continue
+            if stream_id is None:
+                reply_error(None, "缺少流 ID")
+                continue
+            
+            if op == "start":
+                if stream_id in subscriptions:
+                    reply_error(stream_id, "流 ID 已被使用")
+                    continue
+                message = (payload.get("message") or "").strip()
+                if not message:
+                    reply_error(stream_id, "消息不能为空")
+                    continue
+                try:
+                    quota_level = _start_quota(tenant)
+                except HTTPException as e:
+                    reply_error(stream_id, e.detail)
+                    continue
+                session = await _open_chat_session(message, payload.get("session_id"))
+                depth = None
+                if payload.get("mode", "multi") == "multi":
+                    depth = _quota_depth(load_monitor.assess(), quota_level)
+                run_id = str(uuid.uuid4())
+                stream = run_streams.start(run_id, _chat_events(message, session, tenant, depth, run_id), tenant)
+                stream.subscribe((id(websocket), stream_id), outgoing, stream_id)
+                subscriptions[stream_id] = stream
+            
+            elif op == "subscribe":
+                stream = run_streams.get(payload.get("run_id") or "")
+                # 其他租户的运行同样视为不存在，不能订阅（也就不能取消）
+                if stream is None or stream.tenant != tenant:
+                    reply_error(stream_id, "运行不存在或已结束")
+                    continue
+                if stream_id in subscriptions:
+                    subscriptions.pop(stream_id).unsubscribe((id(websocket), stream_id))
+                stream.subscribe((id(websocket), stream_id), outgoing, stream_id)
+                subscriptions[stream_id] = stream
+            
+            elif op == "unsubscribe":
+                stream = subscriptions.pop(stream_id, None)
+                if stream is not None:
+                    stream.unsubscribe((id(websocket), stream_id))
+                    outgoing.put_nowait((stream_id, END_EVENT, {"run_id": stream.run_id}))
+            
+            elif op == "cancel":
+                stream = subscriptions.get(stream_id)
+                if stream is None or not stream.cancel("user_cancelled"):
+                    reply_error(stream_id, "运行不存在或已结束")
+            
+            else:
+                reply_error(stream_id, f"未知操作：{op}")
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # 断开连接只取消订阅，运行在没有订阅者一段时间后才会取消（便于重连后继续订阅）
+        for stream_id, stream in subscriptions.items():
+            stream.unsubscribe((id(websocket), stream_id))
+        sender_task.cancel()
+
 @router.get("/sessions", response_model=SessionList)
 async def get_sessions():
     """
@@ -216,7 +623,7 @@ async def get_sessions():
     Returns:
         SessionList: 会话列表
     """
-    sessions = list(sessions_db.values())
+    sessions = session_store.list()
     sessions.sort(key=lambda x: x.updated_at, reverse=True)
     
     return SessionList(
@@ -235,10 +642,11 @@ async def get_session(session_id: str):
     Returns:
         Session: 会话详情
     """
-    if session_id not in sessions_db:
+    session = await session_store.aget(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    return sessions_db[session_id]
+    return session
 
 @router.post("/sessions", response_model=Session)
 async def create_session(request: SessionCreate):
@@ -259,7 +667,7 @@ async def create_session(request: SessionCreate):
         updated_at=datetime.now(),
         messages=[]
     )
-    sessions_db[session_id] = session
+    session_store.put(session)
     
     return session
 
@@ -274,10 +682,208 @@ async def delete_session(session_id: str):
     Returns:
         Dict: 操作结果
     """
-    if session_id not in sessions_db:
+    if not session_store.delete(session_id):
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    del sessions_db[session_id]
-    
     return {"message": "会话已删除", "session_id": session_id}
 
+
+@router.get("/metrics/llm")
+async def get_llm_metrics():
+    """
+    获取各阶段 LLM 的模型配置、耗时和 token 用量统计，以及 provider 健康状态
+    
+    Returns:
+        Dict: 各阶段模型配置与统计信息
+    """
+    return {
+        "models": describe_stage_models(),
+        "usage": llm_usage.snapshot(),
+        "providers": provider_health_snapshot()
+    }
+
+@router.get("/metrics/rate-limits")
+async def get_rate_limits():
+    """
+    获取出站限流状态（各 provider 的剩余配额、排队数量和 Retry-After 暂停情况）
+    
+    Returns:
+        Dict: provider -> 限流器状态
+    """
+    return rate_limiter_snapshot()
+
+@router.get("/runs")
+async def list_runs():
+    """
+    获取最近研究运行的摘要（保存在内存环形缓冲区中）
+    
+    Returns:
+        Dict: 运行摘要列表
+    """
+    runs = trace_store.list()
+    return {"runs": runs, "total": len(runs)}
+
+@router.get("/runs/{run_id}/trace")
+async def get_run_trace(run_id: str):
+    """
+    获取指定运行的完整追踪（span 树的扁平列表，通过 parent_id 关联）
+    
+    Args:
+        run_id: 运行 ID
+        
+    Returns:
+        Dict: 追踪详情
+    """
+    trace = trace_store.get(run_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="运行不存在或已被淘汰")
+    
+    return trace.to_dict()
+
+@router.get("/checkpoints")
+async def list_checkpoints(http_request: Request):
+    """
+    获取当前租户的多 Agent 运行检查点摘要（interrupted 为可以恢复的中断运行数）
+    
+    Args:
+        http_request: HTTP 请求（只返回本租户的运行）
+        
+    Returns:
+        Dict: 检查点列表
+    """
+    tenant = _resolve_tenant(http_request)
+    checkpoints = [
+        checkpoint for checkpoint in checkpoint_store.list()
+        if checkpoint.meta.get("tenant", DEFAULT_TENANT) == tenant
+    ]
+    interrupted = {
+        checkpoint.run_id for checkpoint in checkpoint_store.interrupted()
+        if checkpoint.meta.get("tenant", DEFAULT_TENANT) == tenant
+    }
+    return {
+        "checkpoints": [
+            {**checkpoint.to_dict(), "resumable": checkpoint.run_id in interrupted}
+            for checkpoint in checkpoints
+        ],
+        "interrupted": len(interrupted),
+    }
+
+@router.post("/runs/{run_id}/resume", response_class=EventSourceResponse)
+async def resume_run(run_id: str, http_request: Request):
+    """
+    从检查点恢复中断、失败或已取消的多 Agent 运行，已完成的计划、子任务和报告不会重新生成
+    
+    Args:
+        run_id: 运行 ID
+        http_request: HTTP 请求（只能恢复本租户的运行）
+        
+    Returns:
+        StreamingResponse: SSE 流式响应
+    """
+    checkpoint = checkpoint_store.load(run_id)
+    if checkpoint is None or checkpoint.meta.get("tenant", DEFAULT_TENANT) != _resolve_tenant(http_request):
+        raise HTTPException(status_code=404, detail="检查点不存在或已过期")
+    if checkpoint.status == STATUS_COMPLETED:
+        raise HTTPException(status_code=409, detail="运行已完成")
+    if checkpoint_store.is_claimed(run_id):
+        raise HTTPException(status_code=409, detail="运行正在进行中")
+    
+    # 流式响应生成器
+    async def event_generator():
+        """生成 SSE 事件"""
+        async for event, data in _resume_events(checkpoint):
+            yield {"event": event, "data": json.dumps(data, ensure_ascii=False)}
+    
+    return EventSourceResponse(event_generator())
+
+@router.get("/metrics/load")
+async def get_load_metrics():
+    """
+    获取当前负载和研究深度降级状态
+    
+    Returns:
+        Dict: 进行中的运行数、排队深度、近期耗时和当前研究深度
+    """
+    return load_monitor.snapshot()
+
+@router.get("/metrics/task-cache")
+async def get_task_cache_metrics():
+    """
+    获取子任务结果缓存的状态（条目数、命中和未命中次数）
+    
+    Returns:
+        Dict: 缓存统计
+    """
+    return task_cache.stats()
+
+@router.get("/metrics/streams")
+async def get_stream_metrics():
+    """
+    获取 WebSocket 运行事件流的状态（进行中的运行数、订阅数）
+    
+    Returns:
+        Dict: 事件流统计
+    """
+    return run_streams.stats()
+
+@router.get("/metrics/shared-cache")
+async def get_shared_cache_metrics():
+    """
+    获取跨进程共享缓存的状态（各命名空间的条目数、大小，以及当前进程的命中统计）
+    
+    Returns:
+        Dict: 缓存统计
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, shared_cache.stats)
+
+@router.get("/metrics/sessions")
+async def get_session_metrics():
+    """
+    获取会话存储的内存占用（会话数、消息数、字节数、淘汰和落盘情况）
+    
+    Returns:
+        Dict: 会话存储统计
+    """
+    return session_store.stats()
+
+@router.get("/metrics/logging")
+async def get_logging_metrics():
+    """
+    获取日志队列状态（排队数量、队列满时丢弃的日志数和步骤日志采样率）
+    
+    Returns:
+        Dict: 日志队列状态
+    """
+    return logging_stats()
+
+@router.get("/usage")
+async def get_usage(http_request: Request, days: int = 7):
+    """
+    获取当前租户最近若干天的 token 和搜索用量，以及今日的配额状态
+    
+    Args:
+        http_request: HTTP 请求（用于确定租户）
+        days: 天数
+        
+    Returns:
+        Dict: 租户用量
+    """
+    tenant = _resolve_tenant(http_request)
+    return quota_ledger.snapshot(tenant, days=days)[tenant]
+
+@router.get("/metrics/tenants")
+async def get_tenant_metrics(http_request: Request, days: int = 7):
+    """
+    获取所有租户最近若干天的用量和配额状态（需要管理员 Key，未配置 admin_api_key 时不开放）
+    
+    Args:
+        http_request: HTTP 请求（X-Admin-Key 请求头）
+        days: 天数
+        
+    Returns:
+        Dict: 租户 -> 用量
+    """
+    admin_key = http_request.headers.get("X-Admin-Key", "")
+    if not settings.admin_api_key or not secrets.compare_digest(admin_key, settings.admin_api_key):
+        raise HTTPException(status_code=403, detail="需要管理员 Key")
+    return quota_ledger.snapshot(days=days)
@@ -21,6 +21,161 @@ class Settings(BaseSettings):
     llm_model: str = "gpt-4-turbo-preview"
     llm_temperature: float = 0.7
     
+    # 分阶段模型配置（未配置的项回退到上面的全局配置）
+    # provider 可选 "openai" / "volc"，可在不同阶段混用
+    planner_llm_provider: Optional[str] = None
+    planner_llm_model: Optional[str] = None
+    planner_llm_api_base: Optional[str] = None
+    planner_llm_temperature: Optional[float] = 0.3
+    
+    researcher_llm_provider: Optional[str] = None
+    researcher_llm_model: Optional[str] = None
+    researcher_llm_api_base: Optional[str] = None
+    researcher_llm_temperature: Optional[float] = None
+    
+    writer_llm_provider: Optional[str] = None
+    writer_llm_model: Optional[str] = None
+    writer_llm_api_base: Optional[str] = None
+    writer_llm_temperature: Optional[float] = 0.3
+    
+    # 单 Agent 模式
+    agent_llm_provider: Optional[str] = None
+    agent_llm_model: Optional[str] = None
+    agent_llm_api_base: Optional[str] = None
+    agent_llm_temperature: Optional[float] = None
+    
+    # 多 provider 故障转移与对冲请求
+    # 同时配置了 OpenAI 和火山引擎时，另一个 provider 作为备用（需配置其备用模型）
+    llm_failover_enabled: bool = True
+    openai_fallback_model: Optional[str] = None
+    volc_fallback_model: Optional[str] = None
+    llm_max_retries: int = 2
+    llm_retry_base_delay: float = 0.5
+    llm_retry_max_delay: float = 8.0
+    # 首 token 超过该时间（秒）未到达时向备用 provider 发起对冲请求，0 表示关闭
+    llm_hedge_delay: float = 0
+    llm_hedge_stages: str = "planner,writer"
+    # 连续失败达到阈值后 provider 进入冷却期（秒）
+    provider_failure_threshold: int = 3
+    provider_cooldown: float = 30.0
+    
+    # 出站限流（每分钟请求数 / token 数，0 表示不限制）
+    openai_rpm: int = 0
+    openai_tpm: int = 0
+    volc_rpm: int = 0
+    volc_tpm: int = 0
+    tavily_rpm: int = 0
+    # 估算 token 用量时为输出预留的 token 数
+    llm_estimated_completion_tokens: int = 1000
+    # Tavily 限流响应的重试次数和默认等待时间（秒）
+    search_max_retries: int = 2
+    search_retry_after: float = 5.0
+    
+    # ReAct 草稿区压缩：按相关度裁剪搜索结果，并限制草稿区总 token 数
+    scratchpad_compression: bool = True
+    scratchpad_token_budget: int = 3000
+    observation_token_budget: int = 800
+    
+    # 报告撰写模式："single" 一次生成完整报告；"sectioned" 按章节并发生成并按顺序流式输出
+    writer_mode: str = "single"
+    writer_max_concurrency: int = 5
+    
+    # 批量研究：单批最大主题数、共享的并发上限、近似子任务 / 查询的相似度阈值
+    batch_max_topics: int = 50
+    batch_max_concurrency: int = 4
+    batch_similarity_threshold: float = 0.8
+    
+    # 负载感知降级：依次为升到 1 / 2 / 3 级的阈值；延迟 SLO 为单次运行的目标耗时（秒）
+    adaptive_depth_enabled: bool = True
+    load_inflight_thresholds: str = "4,8,16"
+    load_queue_thresholds: str = "10,30,60"
+    load_latency_slo: float = 180.0
+    # 允许的最高降级等级（3 表示允许把多 Agent 请求改走单 Agent 流程；配额软限制最多降到 2 级）
+    max_degradation_level: int = 3
+    
+    # 运行追踪：内存中保留的最近运行数、单次运行的 span 上限、可选的导出文件（JSONL）
+    trace_buffer_size: int = 200
+    trace_max_spans: int = 2000
+    trace_export_path: Optional[str] = None
+    
+    # 会话存储：内存中的会话数、单个会话的消息数、总字节数上限，空闲过期时间（秒，0 表示不过期）
+    # 配置落盘目录后，被淘汰的会话压缩写入磁盘，访问时再加载回内存
+    session_max_count: int = 1000
+    session_max_messages: int = 200
+    session_max_bytes: int = 200 * 1024 * 1024
+    session_idle_ttl: float = 0
+    session_spill_dir: Optional[str] = None
+    
+    # 日志：JSON 格式，经后台线程写入标准输出和 log_dir 下按大小轮转的文件（log_dir 为空时只输出到标准输出）
+    # Agent 步骤日志按 log_step_sample_rate 采样；队列满时丢弃日志而不是阻塞
+    log_level: str = "INFO"
+    log_dir: Optional[str] = "logs"
+    log_file_max_bytes: int = 10 * 1024 * 1024
+    log_file_backup_count: int = 5
+    log_queue_size: int = 10000
+    log_step_sample_rate: float = 0.1
+    
+    # 租户配额：按 API Key（或受信任的 tenant_header 请求头）区分租户，按天统计 token 和搜索用量
+    # 每日预算为 0 表示不限；quota_tenant_budgets 为 JSON，覆盖指定租户的预算，如 {"team-a": {"tokens": 2000000, "searches": 1000}}
+    # 用量超过预算 x quota_soft_ratio 时新运行降到最低研究深度，超过预算时拒绝新运行并中止进行中的 LLM 调用
+    quota_enabled: bool = False
+    tenant_header: str = "X-Tenant-ID"
+    # 只有网关会覆盖客户端传入的租户请求头时才开启；带 API Key 的请求始终以 Key 映射的租户为准
+    tenant_header_trusted: bool = False
+    # API Key 到租户的映射："key1:team-a,key2:team-b"，未映射的 API Key（开启配额时包括不带 Key 的请求）共用 unknown 租户的预算
+    tenant_api_keys: str = ""
+    # 查看所有租户用量（/metrics/tenants）的管理员 Key，通过 X-Admin-Key 请求头传入；未配置时不开放
+    admin_api_key: Optional[str] = None
+    quota_daily_tokens: int = 0
+    quota_daily_searches: int = 0
+    quota_tenant_budgets: str = ""
+    quota_soft_ratio: float = 0.8
+    quota_ledger_path: Optional[str] = "data/usage_ledger.json"
+    quota_flush_interval: float = 5.0
+    quota_history_days: int = 30
+    
+    # 子任务结果缓存：同一租户不同研究问题中相同或近似的子任务复用研究结果（有效期单位为秒）
+    task_cache_enabled: bool = True
+    task_cache_ttl: float = 6 * 3600
+    task_cache_max_entries: int = 500
+    task_cache_similarity_threshold: float = 0.8
+    
+    # 研究员进度事件：研究阶段转发子任务的工具调用、工具结果摘要和思考过程
+    # 同一子任务的思考事件至少间隔 research_event_interval 秒，工具结果摘要最多 research_event_output_chars 个字符
+    research_stream_events: bool = True
+    research_event_interval: float = 1.0
+    research_event_output_chars: int = 500
+    
+    # WebSocket 多路复用：新订阅者补发的最近事件数；没有订阅者的运行在 ws_orphan_timeout 秒后取消；
+    # 运行结束后保留 ws_finished_retention 秒供重新订阅
+    ws_replay_events: int = 500
+    ws_orphan_timeout: float = 60.0
+    ws_finished_retention: float = 120.0
+    
+    # 多 Agent 研究检查点：计划、子任务结果、报告完成后写入 checkpoint_dir，已结束运行的检查点保留 checkpoint_retention 秒；
+    # 启动时自动恢复中断的运行；关闭时最多等待 shutdown_drain_timeout 秒让进行中的运行完成
+    checkpoint_enabled: bool = True
+    checkpoint_dir: str = "data/checkpoints"
+    checkpoint_retention: float = 24 * 3600
+    checkpoint_resume_on_startup: bool = True
+    shutdown_drain_timeout: float = 30.0
+    
+    # 跨进程共享缓存（SQLite，多个 worker 共用）：搜索结果、LLM 补全和研究计划；
+    # 值的总大小超过 shared_cache_max_bytes 时淘汰最久未访问的条目；计划和补全结果按租户隔离；
+    # shared_cache_llm_stages 为缓存补全结果的阶段（逗号分隔，为空时不缓存）。缓存的补全在有效期内
+    # 对相同输入返回相同内容，默认只缓存规划阶段，研究员和报告阶段需要时再显式开启
+    shared_cache_enabled: bool = True
+    shared_cache_path: str = "data/shared_cache.db"
+    shared_cache_max_bytes: int = 256 * 1024 * 1024
+    shared_cache_search_ttl: float = 3600
+    shared_cache_llm_ttl: float = 24 * 3600
+    shared_cache_plan_ttl: float = 24 * 3600
+    shared_cache_llm_stages: str = "planner"
+    
+    # 服务进程数（大于 1 时不启用自动重载）；共享缓存、检查点和配额账本在进程间共享，
+    # 出站限流的 RPM / TPM 平分给各进程；会话、运行追踪和 WebSocket 运行仍保存在各进程内
+    workers: int = 1
+    
     # Tavily Search 配置
     tavily_api_key: Optional[str] = None
     
@@ -31,24 +186,92 @@ class Settings(BaseSettings):
 # 全局配置实例
 settings = Settings()
 
-def get_llm_config():
-    """获取 LLM 配置"""
-    if settings.openai_api_key:
-        return {
-            "type": "openai",
-            "api_key": settings.openai_api_key,
-            "api_base": settings.openai_api_base,
-            "model": settings.llm_model,
-            "temperature": settings.llm_temperature
-        }
+# 支持单独配置模型的阶段
+LLM_STAGES = ("planner", "researcher", "writer", "agent")
+
+def _get_provider_credentials(provider: str):
+    """获取指定 provider 的 API Key 和地址"""
+    if provider == "openai":
+        return settings.openai_api_key, settings.openai_api_base
+    elif provider == "volc":
+        return settings.volc_api_key, settings.volc_api_base
+    raise ValueError(f"不支持的 LLM provider: {provider}")
+
+def get_llm_config(stage: Optional[str] = None):
+    """
+    获取 LLM 配置
+    
+    Args:
+        stage: 阶段名称（planner / researcher / writer / agent），为空时返回全局配置
+        
+    Returns:
+        Dict: LLM 配置
+    """
+    if stage is not None and stage not in LLM_STAGES:
+        raise ValueError(f"未知的 LLM 阶段: {stage}")
+    
+    provider = getattr(settings, f"{stage}_llm_provider") if stage else None
+    
+    if provider:
+        provider = provider.lower()
+        api_key, api_base = _get_provider_credentials(provider)
+        if not api_key:
+            raise ValueError(f"{stage} 阶段使用 {provider}，但未配置对应的 API Key")
+    elif settings.openai_api_key:
+        provider = "openai"
+        api_key, api_base = settings.openai_api_key, settings.openai_api_base
     elif settings.volc_api_key:
-        return {
-            "type": "volc",
-            "api_key": settings.volc_api_key,
-            "api_base": settings.volc_api_base,
-            "model": settings.llm_model,
-            "temperature": settings.llm_temperature
-        }
+        provider = "volc"
+        api_key, api_base = settings.volc_api_key, settings.volc_api_base
     else:
         raise ValueError("请配置 OPENAI_API_KEY 或 VOLC_API_KEY")
+    
+    model = settings.llm_model
+    temperature = settings.llm_temperature
+    if stage:
+        model = getattr(settings, f"{stage}_llm_model") or model
+        api_base = getattr(settings, f"{stage}_llm_api_base") or api_base
+        stage_temperature = getattr(settings, f"{stage}_llm_temperature")
+        if stage_temperature is not None:
+            temperature = stage_temperature
+    
+    return {
+        "type": provider,
+        "api_key": api_key,
+        "api_base": api_base,
+        "model": model,
+        "temperature": temperature
+    }
 
+def get_provider_configs(stage: str):
+    """
+    获取指定阶段可用的全部 provider 配置（首个为主 provider，其余为备用）
+    
+    Args:
+        stage: 阶段名称
+        
+    Returns:
+        List[Dict]: LLM 配置列表
+    """
+    primary = get_llm_config(stage)
+    configs = [primary]
+    
+    if not settings.llm_failover_enabled:
+        return configs
+    
+    for provider in ("openai", "volc"):
+        if provider == primary["type"]:
+            continue
+        api_key, api_base = _get_provider_credentials(provider)
+        fallback_model = getattr(settings, f"{provider}_fallback_model")
+        if not api_key or not fallback_model:
+            continue
+        configs.append({
+            "type": provider,
+            "api_key": api_key,
+            "api_base": api_base,
+            "model": fallback_model,
+            "temperature": primary["temperature"]
+        })
+    
+    return configs
@@ -2,16 +2,25 @@
 DeepResearch Agent 后端服务主入口
 """
 import os
+import signal
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uvicorn
 
-from api.routes import router
+from api.routes import drain_runs, resume_interrupted_runs, router
+from config import settings
+from services.checkpoints import checkpoint_store
+from services.quota import quota_ledger
+from services.structured_logging import get_logger, setup_logging, shutdown_logging
 
 # 加载环境变量
 load_dotenv()
 
+# 配置结构化日志（后台线程写入）
+setup_logging()
+logger = get_logger("main")
+
 app = FastAPI(
     title="DeepResearch Agent API",
     description="深度研究 AI Agent 后端服务",
@@ -30,6 +39,45 @@ app.add_middleware(
 # 注册路由
 app.include_router(router, prefix="/api")
 
+def _mark_draining(previous):
+    """收到退出信号时先标记进程正在关闭，此后被中断的运行保持可恢复，再交给 uvicorn 处理"""
+    def handler(signum, frame):
+        checkpoint_store.draining = True
+        if callable(previous):
+            previous(signum, frame)
+    return handler
+
+@app.on_event("startup")
+async def startup():
+    if settings.workers > 1:
+        logger.warning(
+            "⚠️ Running with %s workers: sessions, run traces and WebSocket run streams are "
+            "kept per process, so session lists and run subscriptions only see the worker that served them; "
+            "rate limits are split evenly across workers and the quota ledger is synced every %ss",
+            settings.workers, settings.quota_flush_interval,
+            extra={"workers": settings.workers, "quota_flush_interval": settings.quota_flush_interval}
+        )
+    # uvicorn 在优雅关闭超时后会直接取消仍在进行的请求，需要在收到信号时就区分于客户端断开
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            signal.signal(sig, _mark_draining(signal.getsignal(sig)))
+        except ValueError:
+            # 非主线程中运行（如测试客户端）时无法设置信号处理
+            pass
+    # 恢复上次退出时中断的多 Agent 运行
+    if settings.checkpoint_enabled and settings.checkpoint_resume_on_startup:
+        run_ids = resume_interrupted_runs()
+        if run_ids:
+            logger.info("♻️ Resuming %s interrupted runs", len(run_ids), extra={"resumed_runs": run_ids})
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 等待进行中的运行完成（超时的运行保留检查点，下次启动时恢复）
+    await drain_runs(settings.shutdown_drain_timeout)
+    # 保存租户用量账本，写完队列中剩余的日志
+    quota_ledger.flush()
+    shutdown_logging()
+
 @app.get("/")
 async def root():
     return {
@@ -45,15 +93,22 @@ async def health_check():
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
+    # 多进程模式：WORKERS > 1 时启动多个 worker，共享缓存和检查点目录（自动重载只支持单进程）
+    workers = max(1, settings.workers)
     
-    print(f"🚀 Starting DeepResearch Agent API on {host}:{port}")
-    print(f"📚 API Docs: http://{host}:{port}/docs")
+    logger.info(
+        "🚀 Starting DeepResearch Agent API on %s:%s with %s worker(s)", host, port, workers,
+        extra={"host": host, "port": port, "workers": workers}
+    )
+    logger.info("📚 API Docs: http://%s:%s/docs", host, port)
     
     uvicorn.run(
         "main:app",
         host=host,
         port=port,
-        reload=True,
-        log_level="info"
+        reload=workers == 1,
+        workers=workers,
+        log_level="info",
+        timeout_graceful_shutdown=int(settings.shutdown_drain_timeout)
     )
 
@@ -1,10 +1,10 @@
 from .schemas import (
-    Message, ChatRequest, ChatResponse, StreamEvent,
+    Message, ChatRequest, BatchResearchRequest, ChatResponse, StreamEvent,
     Session, SessionCreate, SessionList
 )
 
 __all__ = [
-    "Message", "ChatRequest", "ChatResponse", "StreamEvent",
+    "Message", "ChatRequest", "BatchResearchRequest", "ChatResponse", "StreamEvent",
     "Session", "SessionCreate", "SessionList"
 ]
 
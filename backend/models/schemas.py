@@ -18,6 +18,10 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = Field(None, description="会话 ID")
     stream: bool = Field(True, description="是否流式响应")
 
+class BatchResearchRequest(BaseModel):
+    """批量研究请求"""
+    topics: List[str] = Field(..., description="研究主题列表")
+
 class ChatResponse(BaseModel):
     """聊天响应"""
     session_id: str
@@ -0,0 +1,31 @@
+from .usage import UsageTracker, StageUsageCallback, estimate_tokens, llm_usage
+from .tracing import Trace, Span, TraceCallbackHandler, trace_store
+from .run_context import RunContext, current_run_id, get_run_id
+from .rate_limiter import RateLimiter, get_rate_limiter, rate_limiter_snapshot
+from .provider_pool import ProviderPool, PooledChatModel, provider_health_snapshot
+from .load_policy import ResearchDepth, DEPTH_LEVELS, degrade_for_quota, load_monitor
+from .session_store import SessionStore, create_session_store
+from .structured_logging import StepLogCallback, get_logger, setup_logging
+from .quota import QuotaLedger, QuotaExceededError, current_tenant, quota_ledger
+from .task_cache import TaskResultCache, task_cache
+from .run_streams import RunStream, run_streams
+from .checkpoints import CheckpointStore, RunCheckpoint, checkpoint_store
+from .shared_cache import SharedCache, shared_cache
+from .llm_factory import create_chat_model, describe_stage_models
+
+__all__ = [
+    "UsageTracker", "StageUsageCallback", "estimate_tokens", "llm_usage",
+    "Trace", "Span", "TraceCallbackHandler", "trace_store",
+    "RunContext", "current_run_id", "get_run_id",
+    "RateLimiter", "get_rate_limiter", "rate_limiter_snapshot",
+    "ProviderPool", "PooledChatModel", "provider_health_snapshot",
+    "ResearchDepth", "DEPTH_LEVELS", "degrade_for_quota", "load_monitor",
+    "SessionStore", "create_session_store",
+    "StepLogCallback", "get_logger", "setup_logging",
+    "QuotaLedger", "QuotaExceededError", "current_tenant", "quota_ledger",
+    "TaskResultCache", "task_cache",
+    "RunStream", "run_streams",
+    "CheckpointStore", "RunCheckpoint", "checkpoint_store",
+    "SharedCache", "shared_cache",
+    "create_chat_model", "describe_stage_models"
+]
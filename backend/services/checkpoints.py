@@ -0,0 +1,263 @@
+"""
+多 Agent 研究运行的检查点
+
+每个阶段完成后（研究计划、每个子任务的结果、报告）立即写入本地文件，
+进程重启或运行中断后可以从最近的检查点继续，已完成的 LLM 工作不会重复执行
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import asyncio
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不支持跨进程的执行权声明
+    fcntl = None
+
+from config import settings
+from services.structured_logging import get_logger
+
+logger = get_logger("checkpoints")
+
+# 检查点状态
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+class RunCheckpoint:
+    """一次运行的检查点"""
+
+    def __init__(self, store: "CheckpointStore", data: Dict[str, Any]):
+        self.store = store
+        self.data = data
+
+    @property
+    def run_id(self) -> str:
+        return self.data["run_id"]
+
+    @property
+    def query(self) -> str:
+        return self.data["query"]
+
+    @property
+    def status(self) -> str:
+        return self.data["status"]
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        """创建检查点时附带的信息（会话 ID、租户、研究深度等）"""
+        return self.data["meta"]
+
+    @property
+    def plan(self) -> Optional[List[Dict[str, Any]]]:
+        return self.data.get("plan")
+
+    @property
+    def report(self) -> Optional[str]:
+        return self.data.get("report")
+
+    def result(self, task_id: Any) -> Optional[str]:
+        """已完成子任务的研究结果"""
+        return self.data["results"].get(str(task_id))
+
+    async def save(self, **fields: Any):
+        """更新并写入检查点（plan / report / status 等字段）"""
+        self.data.update(fields)
+        await self.store.write(self)
+
+    async def save_result(self, task_id: Any, result: str):
+        """写入一个子任务的研究结果"""
+        self.data["results"][str(task_id)] = result
+        await self.store.write(self)
+
+    async def complete(self):
+        await self.save(status=STATUS_COMPLETED)
+        self.store.release(self.run_id)
+
+    async def fail(self, error: Any):
+        await self.save(status=STATUS_FAILED, error=str(error))
+        self.store.release(self.run_id)
+
+    def cancel(self, reason: str):
+        """
+        标记为已取消（用户取消、无人订阅超时、客户端断开），不再自动恢复
+
+        在取消处理中调用，同步写入，避免写入过程被再次取消
+        """
+        self.data.update(status=STATUS_CANCELLED, error=reason)
+        self.data["updated_at"] = datetime.now().isoformat()
+        try:
+            self.store._write_file(self.run_id, json.dumps(self.data, ensure_ascii=False, default=str))
+        except OSError as e:
+            logger.warning("Write checkpoint error: %s", e, extra={"checkpoint_run_id": self.run_id})
+        self.store.release(self.run_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """检查点摘要（不包含研究结果和报告正文）"""
+        return {
+            "run_id": self.run_id,
+            "query": self.query,
+            "status": self.status,
+            "meta": self.meta,
+            "created_at": self.data.get("created_at"),
+            "updated_at": self.data.get("updated_at"),
+            "task_count": len(self.plan) if self.plan is not None else None,
+            "completed_tasks": len(self.data["results"]),
+            "has_report": self.report is not None,
+            "error": self.data.get("error"),
+        }
+
+class CheckpointStore:
+    """检查点文件存储（每个运行一个 JSON 文件，先写临时文件再替换）"""
+
+    def __init__(self, directory: str, retention: float):
+        """
+        Args:
+            directory: 检查点目录
+            retention: 已结束运行的检查点保留时间（秒）
+        """
+        self.directory = directory
+        self.retention = retention
+        # 当前进程持有的执行权：运行 ID -> 已加锁的文件对象
+        self._locks: Dict[str, Any] = {}
+        # 进程正在关闭：此时被中断的运行保持进行中状态，下次启动时恢复
+        self.draining = False
+
+    def _path(self, run_id: str, suffix: str = ".json") -> str:
+        safe_id = "".join(ch for ch in run_id if ch.isalnum() or ch in "-_")
+        return os.path.join(self.directory, f"{safe_id}{suffix}")
+
+    async def create(self, run_id: str, query: str, **meta: Any) -> RunCheckpoint:
+        """
+        创建检查点并声明由当前进程执行
+
+        Args:
+            run_id: 运行 ID
+            query: 研究问题
+            meta: 恢复运行时需要的信息（会话 ID、租户、研究深度等）
+        """
+        now = datetime.now().isoformat()
+        checkpoint = RunCheckpoint(self, {
+            "run_id": run_id,
+            "query": query,
+            "status": STATUS_RUNNING,
+            "meta": meta,
+            "plan": None,
+            "results": {},
+            "report": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        self.claim(run_id)
+        await self.write(checkpoint)
+        return checkpoint
+
+    async def write(self, checkpoint: RunCheckpoint):
+        """写入检查点（在线程池中执行，写完后才返回）"""
+        checkpoint.data["updated_at"] = datetime.now().isoformat()
+        data = json.dumps(checkpoint.data, ensure_ascii=False, default=str)
+        await asyncio.get_running_loop().run_in_executor(None, self._write_file, checkpoint.run_id, data)
+
+    def _write_file(self, run_id: str, data: str):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(run_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, run_id: str) -> Optional[RunCheckpoint]:
+        try:
+            with open(self._path(run_id), "r", encoding="utf-8") as f:
+                return RunCheckpoint(self, json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Load checkpoint error: %s", e, extra={"checkpoint_run_id": run_id})
+            return None
+
+    def list(self) -> List[RunCheckpoint]:
+        """全部检查点（新的在前）"""
+        if not os.path.isdir(self.directory):
+            return []
+        checkpoints = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                checkpoint = self.load(name[:-len(".json")])
+                if checkpoint is not None:
+                    checkpoints.append(checkpoint)
+        checkpoints.sort(key=lambda c: c.data.get("created_at") or "", reverse=True)
+        return checkpoints
+
+    def interrupted(self) -> List[RunCheckpoint]:
+        """中断的运行：状态仍为进行中，且没有存活的进程在执行"""
+        return [
+            checkpoint for checkpoint in self.list()
+            if checkpoint.status == STATUS_RUNNING and not self.is_claimed(checkpoint.run_id)
+        ]
+
+    # ---------- 执行权（多个进程共享检查点目录时避免重复恢复） ----------
+
+    def claim(self, run_id: str) -> bool:
+        """
+        声明由当前进程执行该运行
+
+        执行权是锁文件上的 flock，进程退出（包括崩溃）时由内核释放
+
+        Returns:
+            bool: 是否声明成功
+        """
+        if run_id in self._locks:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(self._path(run_id, ".lock"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._locks[run_id] = lock_file
+        return True
+
+    def is_claimed(self, run_id: str) -> bool:
+        """是否有进程（包括当前进程）正在执行该运行"""
+        if run_id in self._locks:
+            return True
+        if fcntl is None:
+            return False
+        try:
+            with open(self._path(run_id, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            return True
+        return False
+
+    def release(self, run_id: str):
+        """释放执行权（运行结束，或被中断后留给下次恢复）"""
+        lock_file = self._locks.pop(run_id, None)
+        if lock_file is not None:
+            lock_file.close()
+
+    def purge(self):
+        """删除超过保留时间的检查点（进行中的运行只在没有进程执行时删除）"""
+        deadline = time.time() - self.retention
+        for checkpoint in self.list():
+            if checkpoint.status == STATUS_RUNNING and self.is_claimed(checkpoint.run_id):
+                continue
+            path = self._path(checkpoint.run_id)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    os.remove(self._path(checkpoint.run_id, ".lock"))
+            except OSError:
+                pass
+
+# 全局检查点存储
+checkpoint_store = CheckpointStore(settings.checkpoint_dir, settings.checkpoint_retention)
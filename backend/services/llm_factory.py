@@ -0,0 +1,92 @@
+"""
+按阶段创建 LLM 实例
+"""
+from typing import Any, Dict
+from langchain_openai import ChatOpenAI
+from config import settings, get_llm_config, get_provider_configs, LLM_STAGES
+from services.usage import StageUsageCallback, llm_usage
+from services.provider_pool import PoolMember, ProviderPool, PooledChatModel
+from services.quota import QuotaCallback, quota_ledger
+from services.shared_cache import shared_cache
+
+def _create_provider_model(llm_config: Dict[str, Any], streaming: bool) -> ChatOpenAI:
+    """创建单个 provider 的底层 LLM（重试由 ProviderPool 统一负责）"""
+    return ChatOpenAI(
+        model=llm_config["model"],
+        temperature=llm_config["temperature"],
+        api_key=llm_config["api_key"],
+        base_url=llm_config["api_base"],
+        streaming=streaming,
+        max_retries=0,
+    )
+
+def _hedge_delay(stage: str) -> float:
+    """获取指定阶段的对冲延迟，未启用时返回 0"""
+    stages = {s.strip() for s in settings.llm_hedge_stages.split(",") if s.strip()}
+    return settings.llm_hedge_delay if stage in stages else 0
+
+def _completion_cache(stage: str) -> Any:
+    """指定阶段使用的补全缓存，未启用时返回 None"""
+    stages = {s.strip() for s in settings.shared_cache_llm_stages.split(",") if s.strip()}
+    return shared_cache if settings.shared_cache_enabled and stage in stages else None
+
+def create_chat_model(stage: str, streaming: bool = False) -> PooledChatModel:
+    """
+    创建指定阶段使用的 LLM
+
+    Args:
+        stage: 阶段名称（planner / researcher / writer / agent）
+        streaming: 是否启用流式输出
+
+    Returns:
+        PooledChatModel: 带故障转移的 LLM 实例（已挂载全局用量统计和租户配额回调）
+    """
+    provider_configs = get_provider_configs(stage)
+    members = [
+        PoolMember(
+            name=f"{llm_config['type']}:{llm_config['api_base']}",
+            model=_create_provider_model(llm_config, streaming),
+            model_name=llm_config["model"],
+            provider=llm_config["type"],
+        )
+        for llm_config in provider_configs
+    ]
+    pool = ProviderPool(stage, members, hedge_delay=_hedge_delay(stage))
+
+    return PooledChatModel(
+        pool=pool,
+        stage=stage,
+        primary_model=provider_configs[0]["model"],
+        streaming=streaming,
+        completion_cache=_completion_cache(stage),
+        callbacks=[StageUsageCallback(stage, llm_usage), QuotaCallback(stage, quota_ledger)],
+        tags=[f"stage:{stage}"],
+        metadata={"stage": stage, "provider": provider_configs[0]["type"]},
+    )
+
+def describe_stage_models() -> Dict[str, Dict[str, Any]]:
+    """
+    获取各阶段实际使用的模型配置（不包含 API Key）
+
+    Returns:
+        Dict: 阶段名称 -> 模型信息
+    """
+    result = {}
+    for stage in LLM_STAGES:
+        try:
+            llm_config = get_llm_config(stage)
+        except ValueError as e:
+            result[stage] = {"error": str(e)}
+            continue
+        result[stage] = {
+            "provider": llm_config["type"],
+            "model": llm_config["model"],
+            "api_base": llm_config["api_base"],
+            "temperature": llm_config["temperature"],
+            "fallbacks": [
+                {"provider": c["type"], "model": c["model"]}
+                for c in get_provider_configs(stage)[1:]
+            ],
+            "hedge_delay": _hedge_delay(stage),
+        }
+    return result
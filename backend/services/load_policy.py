@@ -0,0 +1,175 @@
+"""
+负载感知的研究深度降级策略
+
+根据进行中的运行数、出站限流排队深度和近期运行耗时计算降级等级，
+等级越高，子任务数量和研究员迭代上限越低，最高等级直接走单 Agent 流程；
+租户用量超过软限制时再降一级（不会因此改走单 Agent 流程）
+"""
+from typing import Any, Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+from config import settings
+from services.rate_limiter import rate_limiter_snapshot
+
+class ResearchDepth:
+    """某个降级等级对应的研究深度"""
+
+    def __init__(self, level: int, name: str, min_tasks: int, max_tasks: int,
+                 max_iterations: int, route_single: bool = False,
+                 reasons: Optional[List[str]] = None):
+        self.level = level
+        self.name = name
+        self.min_tasks = min_tasks
+        self.max_tasks = max_tasks
+        self.max_iterations = max_iterations
+        self.route_single = route_single
+        # 降级原因（load / quota），未降级时为空
+        self.reasons = reasons or []
+
+    def because(self, *reasons: str) -> "ResearchDepth":
+        """带降级原因的副本（DEPTH_LEVELS 中的对象是共享的，不直接修改）"""
+        return ResearchDepth(
+            self.level, self.name, self.min_tasks, self.max_tasks, self.max_iterations,
+            self.route_single, [*self.reasons, *reasons]
+        )
+
+    @property
+    def task_range(self) -> str:
+        """用于规划提示词的子任务数量范围"""
+        if self.min_tasks == self.max_tasks:
+            return str(self.max_tasks)
+        return f"{self.min_tasks}-{self.max_tasks}"
+
+    def to_metadata(self) -> Dict[str, Any]:
+        return {"level": self.level, "name": self.name, "reasons": self.reasons}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "level": self.level,
+            "name": self.name,
+            "task_range": self.task_range,
+            "max_iterations": self.max_iterations,
+            "route_single": self.route_single,
+            "reasons": self.reasons,
+        }
+
+# 降级等级：0 正常 -> 3 只走单 Agent
+DEPTH_LEVELS = [
+    ResearchDepth(0, "normal", 3, 5, 8),
+    ResearchDepth(1, "reduced", 2, 3, 5),
+    ResearchDepth(2, "minimal", 1, 2, 3),
+    ResearchDepth(3, "single_agent", 1, 1, 3, route_single=True),
+]
+
+def _parse_thresholds(value: str) -> List[float]:
+    """解析 "a,b,c" 形式的阈值配置（依次对应等级 1、2、3）"""
+    return [float(v) for v in value.split(",") if v.strip()]
+
+def _level_for(value: float, thresholds: List[float]) -> int:
+    level = 0
+    for i, threshold in enumerate(thresholds, 1):
+        if value >= threshold:
+            level = i
+    return level
+
+class LoadMonitor:
+    """统计系统负载并给出当前的研究深度"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._durations: deque = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self.degraded_runs = 0
+
+    @contextmanager
+    def track_run(self):
+        """在运行期间计入进行中的运行数，并记录运行耗时"""
+        started = time.monotonic()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self._durations.append(time.monotonic() - started)
+
+    def queue_depth(self) -> int:
+        """出站限流器中排队的调用总数"""
+        return sum(limiter["queued"] for limiter in rate_limiter_snapshot().values())
+
+    def recent_latency(self) -> Optional[float]:
+        """近期运行耗时的 p90（秒），样本不足时返回 None"""
+        with self._lock:
+            durations = sorted(self._durations)
+        if len(durations) < 5:
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * 0.9))]
+
+    def current_depth(self) -> ResearchDepth:
+        """根据当前负载计算研究深度"""
+        if not settings.adaptive_depth_enabled:
+            return DEPTH_LEVELS[0]
+
+        level = max(
+            _level_for(self.in_flight, _parse_thresholds(settings.load_inflight_thresholds)),
+            _level_for(self.queue_depth(), _parse_thresholds(settings.load_queue_thresholds)),
+        )
+        latency = self.recent_latency()
+        if latency is not None and settings.load_latency_slo > 0:
+            # 近期耗时超过 SLO 的 1 / 1.5 / 2 倍时分别升一级
+            level = max(level, _level_for(latency / settings.load_latency_slo, [1.0, 1.5, 2.0]))
+
+        level = min(level, settings.max_degradation_level, len(DEPTH_LEVELS) - 1)
+        return DEPTH_LEVELS[level].because("load") if level > 0 else DEPTH_LEVELS[level]
+
+    def assess(self) -> ResearchDepth:
+        """
+        为新的运行确定研究深度（计入降级统计）
+
+        Returns:
+            ResearchDepth: 研究深度
+        """
+        depth = self.current_depth()
+        if depth.level > 0:
+            with self._lock:
+                self.degraded_runs += 1
+        return depth
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取负载状态快照"""
+        latency = self.recent_latency()
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth(),
+            "recent_latency_p90": round(latency, 3) if latency is not None else None,
+            "degraded_runs": self.degraded_runs,
+            "current_depth": self.current_depth().to_dict(),
+        }
+
+def degrade_for_quota(depth: ResearchDepth) -> ResearchDepth:
+    """
+    租户用量超过软限制时，在负载决定的研究深度上再降一级
+
+    最多降到单 Agent 之前的等级，且不超过 max_degradation_level；
+    负载已经决定改走单 Agent 流程时保持不变
+
+    Args:
+        depth: 负载决定的研究深度
+
+    Returns:
+        ResearchDepth: 研究深度（降级时带上 quota 原因）
+    """
+    if depth.route_single:
+        return depth
+    cap = max(d.level for d in DEPTH_LEVELS if not d.route_single)
+    level = min(depth.level + 1, cap, settings.max_degradation_level)
+    if level <= depth.level:
+        return depth
+    return DEPTH_LEVELS[level].because(*depth.reasons, "quota")
+
+# 全局负载监控
+load_monitor = LoadMonitor()
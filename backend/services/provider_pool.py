@@ -0,0 +1,462 @@
+"""
+LLM Provider 池：健康检查、重试退避、故障转移与对冲请求
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import settings
+from services.quota import current_tenant
+from services.rate_limiter import get_rate_limiter, parse_retry_after
+from services.shared_cache import LLM
+from services.usage import estimate_tokens
+
+# 视为临时性错误、可重试的 HTTP 状态码
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# 视为临时性错误的异常类型名（openai SDK）
+TRANSIENT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"}
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    判断异常是否为可重试的临时性错误
+
+    Args:
+        error: 异常
+
+    Returns:
+        bool: 是否可重试
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """
+    计算第 attempt 次重试前的等待时间（指数退避 + 全抖动，不少于服务端的 Retry-After）
+
+    Args:
+        attempt: 重试序号（从 0 开始）
+        error: 上一次调用的异常
+
+    Returns:
+        float: 等待秒数
+    """
+    ceiling = min(settings.llm_retry_max_delay, settings.llm_retry_base_delay * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    retry_after = parse_retry_after(error) if error is not None else None
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+class ProviderHealth:
+    """单个 provider 的健康状态（简单熔断器）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_error: Optional[str] = None
+        self.avg_first_token_latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        """是否可用（冷却期结束后允许再次尝试）"""
+        return time.monotonic() >= self.cooldown_until
+
+    def record_success(self, first_token_latency: Optional[float] = None):
+        """记录一次成功调用"""
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.cooldown_until = 0.0
+            if first_token_latency is not None:
+                if self.avg_first_token_latency is None:
+                    self.avg_first_token_latency = first_token_latency
+                else:
+                    # 指数滑动平均
+                    self.avg_first_token_latency = 0.8 * self.avg_first_token_latency + 0.2 * first_token_latency
+
+    def record_failure(self, error: BaseException):
+        """记录一次失败调用，连续失败达到阈值后进入冷却期"""
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:300]
+            if self.consecutive_failures >= settings.provider_failure_threshold:
+                self.cooldown_until = time.monotonic() + settings.provider_cooldown
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取健康状态快照"""
+        return {
+            "healthy": self.healthy,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "cooldown_remaining": round(max(0.0, self.cooldown_until - time.monotonic()), 1),
+            "avg_first_token_latency": (
+                round(self.avg_first_token_latency, 3) if self.avg_first_token_latency is not None else None
+            ),
+            "last_error": self.last_error,
+        }
+
+# 全局 provider 健康状态（按 provider + 地址区分，各阶段共享）
+_health_registry: Dict[str, ProviderHealth] = {}
+_health_lock = threading.Lock()
+
+def get_provider_health(name: str) -> ProviderHealth:
+    """获取（或创建）provider 的健康状态"""
+    with _health_lock:
+        if name not in _health_registry:
+            _health_registry[name] = ProviderHealth(name)
+        return _health_registry[name]
+
+def provider_health_snapshot() -> Dict[str, Dict[str, Any]]:
+    """获取全部 provider 的健康状态"""
+    with _health_lock:
+        return {name: health.snapshot() for name, health in _health_registry.items()}
+
+class PoolMember:
+    """Provider 池中的一个成员"""
+
+    def __init__(self, name: str, model: BaseChatModel, model_name: str, provider: str):
+        self.name = name
+        self.model = model
+        self.model_name = model_name
+        self.provider = provider
+        self.health = get_provider_health(name)
+        self.limiter = get_rate_limiter(name, provider)
+
+    def _estimated_tokens(self, messages: List[BaseMessage]) -> int:
+        prompt_tokens = estimate_tokens("".join(str(message.content) for message in messages))
+        return prompt_tokens + settings.llm_estimated_completion_tokens
+
+    async def acquire(self, messages: List[BaseMessage]):
+        """按估算的 token 数申请限流配额"""
+        await self.limiter.acquire(self._estimated_tokens(messages))
+
+    def acquire_blocking(self, messages: List[BaseMessage]):
+        """同步调用按估算的 token 数申请限流配额（阻塞当前线程）"""
+        self.limiter.acquire_blocking(self._estimated_tokens(messages))
+
+    def record_failure(self, error: BaseException):
+        """记录失败，限流错误同时暂停该 provider 的限流器"""
+        self.health.record_failure(error)
+        retry_after = parse_retry_after(error)
+        if retry_after is None and getattr(error, "status_code", None) == 429:
+            retry_after = settings.llm_retry_base_delay
+        if retry_after is not None:
+            self.limiter.penalize(retry_after)
+
+class ProviderPool:
+    """
+    LLM Provider 池
+
+    - 按健康状态选择 provider，失败时自动切换到备用 provider
+    - 临时性错误按指数退避 + 抖动重试
+    - 可选对冲请求：首 token 迟迟不到时向备用 provider 并发请求，取先返回者
+    """
+
+    def __init__(self, stage: str, members: List[PoolMember], hedge_delay: float = 0):
+        self.stage = stage
+        self.members = members
+        self.hedge_delay = hedge_delay
+
+    @property
+    def hedging_enabled(self) -> bool:
+        return self.hedge_delay > 0 and len(self.members) > 1
+
+    @property
+    def provider_names(self) -> List[str]:
+        return [member.name for member in self.members]
+
+    def _ordered_members(self, attempt: int) -> List[PoolMember]:
+        """按健康状态排序成员；重试时轮换主 provider，全部不健康时仍然全部尝试"""
+        healthy = [m for m in self.members if m.health.healthy]
+        unhealthy = sorted(
+            (m for m in self.members if not m.health.healthy),
+            key=lambda m: m.health.cooldown_until
+        )
+        if healthy and attempt:
+            shift = attempt % len(healthy)
+            healthy = healthy[shift:] + healthy[:shift]
+        return healthy + unhealthy
+
+    async def agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                        **kwargs: Any) -> ChatResult:
+        """
+        非流式调用（带重试和故障转移，不对冲）
+
+        Args:
+            messages: 输入消息
+            stop: 停止词
+
+        Returns:
+            ChatResult: 调用结果
+        """
+        last_error: Optional[BaseException] = None
+        for attempt in range(settings.llm_max_retries + 1):
+            member = self._ordered_members(attempt)[0]
+            await member.acquire(messages)
+            started = time.perf_counter()
+            try:
+                result = await member.model._agenerate(messages, stop=stop, **kwargs)
+                member.health.record_success(time.perf_counter() - started)
+                return result
+            except Exception as e:
+                member.record_failure(e)
+                last_error = e
+                if not is_transient_error(e) and len(self.members) == 1:
+                    raise
+            if attempt < settings.llm_max_retries:
+                await asyncio.sleep(backoff_delay(attempt, last_error))
+        raise last_error
+
+    def generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                 **kwargs: Any) -> ChatResult:
+        """同步调用（带重试和故障转移，不对冲；限流时阻塞当前线程）"""
+        last_error: Optional[BaseException] = None
+        for attempt in range(settings.llm_max_retries + 1):
+            member = self._ordered_members(attempt)[0]
+            member.acquire_blocking(messages)
+            started = time.perf_counter()
+            try:
+                result = member.model._generate(messages, stop=stop, **kwargs)
+                member.health.record_success(time.perf_counter() - started)
+                return result
+            except Exception as e:
+                member.record_failure(e)
+                last_error = e
+                if not is_transient_error(e) and len(self.members) == 1:
+                    raise
+            if attempt < settings.llm_max_retries:
+                time.sleep(backoff_delay(attempt, last_error))
+        raise last_error
+
+    async def astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                      **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """
+        流式调用（带重试、故障转移和对冲）
+
+        只有在尚未向调用方输出任何内容时才会重试或切换 provider
+
+        Args:
+            messages: 输入消息
+            stop: 停止词
+
+        Yields:
+            ChatGenerationChunk: 输出片段
+        """
+        last_error: Optional[BaseException] = None
+        for attempt in range(settings.llm_max_retries + 1):
+            members = self._ordered_members(attempt)
+            emitted = False
+            try:
+                async for chunk in self._race(members, messages, stop, **kwargs):
+                    emitted = True
+                    yield chunk
+                return
+            except Exception as e:
+                last_error = e
+                if emitted or (not is_transient_error(e) and len(self.members) == 1):
+                    raise
+            if attempt < settings.llm_max_retries:
+                await asyncio.sleep(backoff_delay(attempt, last_error))
+        raise last_error
+
+    async def _pump(self, index: int, member: PoolMember, queue: asyncio.Queue,
+                    messages: List[BaseMessage], stop: Optional[List[str]], **kwargs: Any):
+        """在独立任务中读取某个 provider 的流式输出，写入共享队列"""
+        try:
+            await member.acquire(messages)
+            async for chunk in member.model._astream(messages, stop=stop, **kwargs):
+                await queue.put((index, "chunk", chunk))
+            await queue.put((index, "end", None))
+        except Exception as e:
+            await queue.put((index, "error", e))
+
+    async def _race(self, members: List[PoolMember], messages: List[BaseMessage],
+                    stop: Optional[List[str]], **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """
+        启动主 provider，必要时启动对冲请求，输出最先产生首 token 的 provider 的结果
+
+        对冲关闭时，主 provider 在首 token 前失败会立即切换到下一个 provider
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[int, asyncio.Task] = {}
+        started_at: Dict[int, float] = {}
+        failed: Dict[int, BaseException] = {}
+        winner: Optional[int] = None
+        next_index = 0
+
+        def start_next() -> bool:
+            nonlocal next_index
+            if next_index >= len(members):
+                return False
+            index = next_index
+            next_index += 1
+            started_at[index] = time.perf_counter()
+            tasks[index] = asyncio.create_task(
+                self._pump(index, members[index], queue, messages, stop, **kwargs)
+            )
+            return True
+
+        try:
+            start_next()
+            hedge_deadline = time.perf_counter() + self.hedge_delay if self.hedging_enabled else None
+
+            # 等待首 token，决出胜者
+            while winner is None:
+                timeout = None
+                if hedge_deadline is not None and next_index < len(members):
+                    timeout = max(0.0, hedge_deadline - time.perf_counter())
+                try:
+                    index, kind, payload = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    # 对冲：首 token 超时，向下一个 provider 发起请求
+                    start_next()
+                    hedge_deadline = time.perf_counter() + self.hedge_delay
+                    continue
+
+                if kind == "error":
+                    members[index].record_failure(payload)
+                    failed[index] = payload
+                    if len(failed) == len(tasks) and not start_next():
+                        raise payload
+                    continue
+
+                winner = index
+                members[index].health.record_success(time.perf_counter() - started_at[index])
+                for other, task in tasks.items():
+                    if other != winner:
+                        task.cancel()
+                if kind == "end":
+                    return
+                yield payload
+
+            # 继续输出胜者的后续内容
+            while True:
+                index, kind, payload = await queue.get()
+                if index != winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    members[index].record_failure(payload)
+                    raise payload
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+class PooledChatModel(BaseChatModel):
+    """基于 ProviderPool 的 Chat 模型，可直接用于 LangChain Agent"""
+
+    pool: Any
+    stage: str
+    primary_model: str = ""
+    streaming: bool = False
+    # 补全结果缓存（SharedCache），为空时不缓存
+    completion_cache: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "model_name": self.primary_model,
+            "providers": self.pool.provider_names,
+        }
+
+    def _cache_key(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Optional[str]:
+        """补全缓存的键：租户、阶段、模型、停止词和消息内容的摘要（不同租户之间不共享）"""
+        if self.completion_cache is None:
+            return None
+        payload = json.dumps(
+            [current_tenant.get(), self.stage, self.primary_model, stop, [(m.type, m.content) for m in messages]],
+            ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        key = self._cache_key(messages, stop)
+        if key is not None:
+            cached = self.completion_cache.get(LLM, key)
+            if cached is not None:
+                return _cached_result(cached)
+        result = self.pool.generate(messages, stop=stop, **kwargs)
+        if key is not None:
+            self.completion_cache.put(LLM, key, result.generations[0].text, settings.shared_cache_llm_ttl)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        # 对冲以首 token 为准，因此需要走流式通道（缓存在 _astream 中处理）
+        if self.streaming or self.pool.hedging_enabled:
+            return await agenerate_from_stream(
+                self._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            )
+        key = self._cache_key(messages, stop)
+        if key is not None:
+            cached = await self.completion_cache.aget(LLM, key)
+            if cached is not None:
+                return _cached_result(cached)
+        result = await self.pool.agenerate(messages, stop=stop, **kwargs)
+        if key is not None:
+            await self.completion_cache.aput(LLM, key, result.generations[0].text, settings.shared_cache_llm_ttl)
+        return result
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._cache_key(messages, stop)
+        if key is not None:
+            cached = await self.completion_cache.aget(LLM, key)
+            if cached is not None:
+                # 命中缓存时一次性输出，token 用量记为 0，并标记为缓存结果（不计入调用耗时）
+                chunk = ChatGenerationChunk(message=AIMessageChunk(
+                    content=cached,
+                    usage_metadata={"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+                    response_metadata={"cached": True}
+                ))
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+                return
+
+        parts = []
+        async for chunk in self.pool.astream(messages, stop=stop, **kwargs):
+            parts.append(chunk.text)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        if key is not None:
+            await self.completion_cache.aput(LLM, key, "".join(parts), settings.shared_cache_llm_ttl)
+
+def _cached_result(text: str) -> ChatResult:
+    """由缓存的补全文本构造结果（token 用量记为 0，不计入用量、耗时和配额）"""
+    return ChatResult(
+        generations=[ChatGeneration(message=AIMessage(content=text, response_metadata={"cached": True}))],
+        llm_output={"token_usage": {"prompt_tokens": 0, "completion_tokens": 0}, "cached": True},
+    )
@@ -0,0 +1,272 @@
+"""
+按租户统计 token / 搜索用量并执行配额
+
+- 用量按租户、按天累计，定期合并写入本地 JSON 账本（重启后继续累计；多个 worker 共用同一账本）
+- 新运行开始时检查配额：超过软限制（预算 x quota_soft_ratio）时降级研究深度，超过预算时拒绝
+- 运行过程中超过预算时，后续 LLM 调用直接失败，搜索返回配额用尽的提示
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from datetime import date, timedelta
+from uuid import UUID
+import asyncio
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不支持跨进程文件锁
+    fcntl = None
+
+from config import settings
+from services.structured_logging import get_logger
+from services.usage import StageUsageCallback
+
+logger = get_logger("quota")
+
+DEFAULT_TENANT = "default"
+# 未映射的 API Key 共用的租户（避免换一个 Key 就得到一份新的预算）
+UNKNOWN_TENANT = "unknown"
+
+# 当前请求所属的租户，asyncio 任务创建时会自动继承
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+_RESOURCE_NAMES = {"tokens": " token ", "searches": "搜索"}
+
+class QuotaExceededError(Exception):
+    """租户的用量超过预算"""
+
+    def __init__(self, tenant: str, resource: str, used: int, limit: int):
+        self.tenant = tenant
+        self.resource = resource
+        self.used = used
+        self.limit = limit
+        super().__init__(f"租户 {tenant} 今日{_RESOURCE_NAMES[resource]}配额已用尽（{used}/{limit}）")
+
+def _empty_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "searches": 0, "runs": 0}
+
+def _parse_tenant_budgets(value: str) -> Dict[str, Dict[str, int]]:
+    """解析 JSON 形式的租户预算配置：{"租户": {"tokens": 1000000, "searches": 500}}"""
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except ValueError:
+        logger.warning("Invalid quota_tenant_budgets: %s", value)
+        return {}
+
+class QuotaLedger:
+    """租户用量账本"""
+
+    def __init__(self, path: Optional[str], history_days: int = 30):
+        """
+        Args:
+            path: 账本文件路径，为空时只保存在内存中
+            history_days: 保留的历史天数
+        """
+        self.path = path
+        self.history_days = history_days
+        # 租户 -> 日期 -> 用量（最近一次同步的账本 + 本进程之后的用量）
+        self._usage: Dict[str, Dict[str, Dict[str, int]]] = {}
+        # 本进程尚未写入账本的用量增量（结构同上）
+        self._pending: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        with self._lock:
+            self._usage = self._read()
+
+    # ---------- 预算 ----------
+
+    def budget(self, tenant: str) -> Dict[str, int]:
+        """租户的每日预算（0 表示不限）"""
+        budget = {"tokens": settings.quota_daily_tokens, "searches": settings.quota_daily_searches}
+        budget.update(_parse_tenant_budgets(settings.quota_tenant_budgets).get(tenant, {}))
+        return budget
+
+    def today(self, tenant: str) -> Dict[str, int]:
+        """租户今日的用量"""
+        with self._lock:
+            return dict(self._usage.get(tenant, {}).get(date.today().isoformat(), _empty_usage()))
+
+    def status(self, tenant: str) -> Dict[str, Any]:
+        """
+        租户今日的配额状态
+
+        Returns:
+            Dict: level 为 ok / soft（超过软限制）/ exceeded（超过预算），以及各项用量和预算
+        """
+        self._maybe_flush()
+        usage = self.today(tenant)
+        budget = self.budget(tenant)
+        used = {
+            "tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "searches": usage["searches"],
+        }
+        level = "ok"
+        for resource, limit in budget.items():
+            if not limit or resource not in used:
+                continue
+            if used[resource] >= limit:
+                level = "exceeded"
+                break
+            if used[resource] >= limit * settings.quota_soft_ratio:
+                level = "soft"
+        return {"tenant": tenant, "level": level, "usage": usage, "used": used, "budget": budget}
+
+    def check(self, tenant: str, resource: str):
+        """检查某项资源是否仍有配额，没有时抛出 QuotaExceededError"""
+        if not settings.quota_enabled:
+            return
+        limit = self.budget(tenant).get(resource) or 0
+        if not limit:
+            return
+        self._maybe_flush()
+        usage = self.today(tenant)
+        used = usage["prompt_tokens"] + usage["completion_tokens"] if resource == "tokens" else usage["searches"]
+        if used >= limit:
+            raise QuotaExceededError(tenant, resource, used, limit)
+
+    # ---------- 记录 ----------
+
+    def record(self, tenant: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               searches: int = 0, runs: int = 0):
+        """累计租户今日的用量"""
+        day = date.today().isoformat()
+        delta = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "searches": searches, "runs": runs,
+        }
+        with self._lock:
+            _merge(self._usage, {tenant: {day: delta}})
+            _merge(self._pending, {tenant: {day: delta}})
+        self._maybe_flush()
+
+    def snapshot(self, tenant: Optional[str] = None, days: int = 7) -> Dict[str, Any]:
+        """
+        最近若干天的用量
+
+        Args:
+            tenant: 租户，为空时返回所有租户
+            days: 天数
+        """
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        with self._lock:
+            tenants = [tenant] if tenant else sorted(self._usage)
+            history = {
+                name: {day: dict(usage) for day, usage in sorted(self._usage.get(name, {}).items()) if day >= since}
+                for name in tenants
+            }
+        return {
+            name: {"history": history[name], **self.status(name)}
+            for name in tenants
+        }
+
+    # ---------- 持久化 ----------
+
+    def _read(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Load quota ledger error: %s", e)
+            return {}
+
+    def _maybe_flush(self):
+        if not self.path or time.monotonic() - self._last_flush < settings.quota_flush_interval:
+            return
+        self._last_flush = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        loop.run_in_executor(None, self.flush)
+
+    def flush(self):
+        """
+        与磁盘上的账本同步：在文件锁内读取账本，加上本进程的用量增量后写回
+        （先写临时文件再替换，避免写到一半的文件），并载入其他进程记录的用量
+        """
+        if not self.path:
+            return
+        cutoff = (date.today() - timedelta(days=self.history_days)).isoformat()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._flush_lock, open(f"{self.path}.lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                usage = self._read()
+                _merge(usage, pending)
+                for days in usage.values():
+                    for day in [day for day in days if day < cutoff]:
+                        del days[day]
+                if pending:
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(json.dumps(usage, ensure_ascii=False))
+                    os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Flush quota ledger error: %s", e)
+            with self._lock:
+                _merge(self._pending, pending)
+            return
+        with self._lock:
+            # 同步期间本进程新记录的用量仍在 _pending 中，叠加到账本上
+            _merge(usage, self._pending)
+            self._usage = usage
+
+def _merge(target: Dict[str, Dict[str, Dict[str, int]]], delta: Dict[str, Dict[str, Dict[str, int]]]):
+    """把用量增量累加到 target 上（租户 -> 日期 -> 用量）"""
+    for tenant, days in delta.items():
+        for day, usage in days.items():
+            current = target.setdefault(tenant, {}).setdefault(day, _empty_usage())
+            for key, value in usage.items():
+                current[key] = current.get(key, 0) + value
+
+class _TenantTracker:
+    """把 StageUsageCallback 记录的 token 用量计入当前租户的账本"""
+
+    def __init__(self, ledger: QuotaLedger):
+        self.ledger = ledger
+
+    def record(self, stage: str, latency: float, prompt_tokens: int,
+               completion_tokens: int, model: Optional[str] = None,
+               estimated: bool = False):
+        self.ledger.record(current_tenant.get(), prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def record_cache_hit(self, stage: str):
+        # 命中补全缓存不消耗 token
+        pass
+
+class QuotaCallback(StageUsageCallback):
+    """记录当前租户的 token 用量，每次 LLM 调用前检查配额（超出时中止调用）"""
+
+    # 让回调中的异常中止调用，而不是只记录日志
+    raise_error = True
+
+    def __init__(self, stage: str, ledger: QuotaLedger):
+        super().__init__(stage, _TenantTracker(ledger))
+        self.ledger = ledger
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]],
+                                  *, run_id: UUID, **kwargs: Any) -> None:
+        self.ledger.check(current_tenant.get(), "tokens")
+        await super().on_chat_model_start(serialized, messages, run_id=run_id, **kwargs)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                           *, run_id: UUID, **kwargs: Any) -> None:
+        self.ledger.check(current_tenant.get(), "tokens")
+        await super().on_llm_start(serialized, prompts, run_id=run_id, **kwargs)
+
+# 全局租户账本
+quota_ledger = QuotaLedger(settings.quota_ledger_path, settings.quota_history_days)
@@ -0,0 +1,276 @@
+"""
+出站限流调度器
+
+按 provider 维护请求数 / token 数两个令牌桶，多个研究运行之间轮询公平排队，
+并支持服务端返回的 Retry-After
+"""
+from typing import Any, Deque, Dict, Optional, Tuple
+from collections import OrderedDict, deque
+import asyncio
+import threading
+import time
+
+from config import settings
+from services.run_context import get_run_id
+
+class TokenBucket:
+    """令牌桶（rate_per_minute 为 0 表示不限制）"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate_per_minute <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """获取足够 amount 个令牌还需等待的秒数"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate_per_minute
+
+    def consume(self, amount: float):
+        """扣除令牌（调用前应确认 wait_time 为 0）"""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def available(self) -> Optional[float]:
+        """当前可用令牌数，不限制时返回 None"""
+        if self.unlimited:
+            return None
+        self._refill()
+        return round(self.tokens, 1)
+
+class RateLimiter:
+    """
+    单个 provider 的限流器
+
+    - 请求数令牌桶（RPM）和 token 数令牌桶（TPM）同时满足才放行
+    - 等待中的调用按运行 ID 分组，运行之间轮询放行，避免单个大任务占满配额
+    - 收到 Retry-After 后在指定时间内暂停放行
+    """
+
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        # 运行 ID -> 等待队列 [(future, 估算 token 数)]
+        self._waiters: "OrderedDict[str, Deque[Tuple[asyncio.Future, int]]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 同步调用在其他线程中申请配额，与事件循环中的放行互斥
+        self._grant_lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.retry_after_events = 0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.requests.unlimited and self.tokens.unlimited
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, estimated_tokens: int = 0, run_id: Optional[str] = None):
+        """
+        获取一次调用许可，配额不足时排队等待
+
+        Args:
+            estimated_tokens: 本次调用估算的 token 数
+            run_id: 所属运行 ID，默认取当前上下文
+        """
+        if self.unlimited and time.monotonic() >= self.blocked_until:
+            self.granted += 1
+            return
+
+        run_id = run_id or get_run_id()
+        if not self._waiters and self._try_grant(estimated_tokens):
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.setdefault(run_id, deque()).append((future, estimated_tokens))
+        self.throttled += 1
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        finally:
+            self.total_wait += time.monotonic() - started
+            if not future.done():
+                future.cancel()
+            self._dispatch()
+
+    def acquire_blocking(self, estimated_tokens: int = 0):
+        """
+        同步调用获取许可：在当前线程中等待到配额足够为止
+
+        同步调用不参与按运行轮询，有异步调用排队时让它们先放行
+
+        Args:
+            estimated_tokens: 本次调用估算的 token 数
+        """
+        if self.unlimited and time.monotonic() >= self.blocked_until:
+            self.granted += 1
+            return
+        if not self._waiters and self._try_grant(estimated_tokens):
+            return
+
+        self.throttled += 1
+        started = time.monotonic()
+        try:
+            while self._waiters or not self._try_grant(estimated_tokens):
+                time.sleep(max(self._next_wait(estimated_tokens), 0.01))
+        finally:
+            self.total_wait += time.monotonic() - started
+
+    def penalize(self, retry_after: float):
+        """
+        收到限流响应后暂停放行
+
+        Args:
+            retry_after: 服务端要求等待的秒数
+        """
+        self.retry_after_events += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def _try_grant(self, estimated_tokens: int) -> bool:
+        with self._grant_lock:
+            if time.monotonic() < self.blocked_until:
+                return False
+            if self.requests.wait_time(1) > 0 or self.tokens.wait_time(estimated_tokens) > 0:
+                return False
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self.granted += 1
+            return True
+
+    def _next_wait(self, estimated_tokens: int) -> float:
+        return max(
+            self.blocked_until - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(estimated_tokens),
+            0.0,
+        )
+
+    def _dispatch(self):
+        """按运行轮询放行等待中的调用，放不下时设置定时器稍后再试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            run_id, queue = next(iter(self._waiters.items()))
+            # 清理已取消的等待者
+            while queue and queue[0][0].done():
+                queue.popleft()
+            if not queue:
+                del self._waiters[run_id]
+                continue
+
+            future, estimated_tokens = queue[0]
+            if not self._try_grant(estimated_tokens):
+                delay = self._next_wait(estimated_tokens)
+                self._timer = asyncio.get_running_loop().call_later(max(delay, 0.01), self._dispatch)
+                return
+
+            queue.popleft()
+            future.set_result(None)
+            # 轮询：当前运行移到队尾
+            self._waiters.move_to_end(run_id)
+            if not queue:
+                del self._waiters[run_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取限流器状态快照"""
+        return {
+            "rpm": self.requests.rate_per_minute,
+            "tpm": self.tokens.rate_per_minute,
+            "available_requests": self.requests.available(),
+            "available_tokens": self.tokens.available(),
+            "queued": self.queued,
+            "queued_by_run": {run_id: len(queue) for run_id, queue in self._waiters.items()},
+            "blocked_remaining": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "total_wait": round(self.total_wait, 3),
+            "retry_after_events": self.retry_after_events,
+        }
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """
+    从异常携带的响应头中解析 Retry-After（秒）
+
+    Args:
+        error: 调用异常
+
+    Returns:
+        Optional[float]: 等待秒数，没有时返回 None
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    for key in ("retry-after-ms", "retry-after"):
+        value = headers.get(key)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            continue
+        return seconds / 1000 if key == "retry-after-ms" else seconds
+    return None
+
+# provider 类型 -> (RPM 配置项, TPM 配置项)
+_LIMIT_SETTINGS = {
+    "openai": ("openai_rpm", "openai_tpm"),
+    "volc": ("volc_rpm", "volc_tpm"),
+    "tavily": ("tavily_rpm", None),
+}
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(key: str, provider: Optional[str] = None) -> RateLimiter:
+    """
+    获取（或创建）指定 key 的限流器
+
+    Args:
+        key: 限流器 key（通常为 provider + 地址）
+        provider: provider 类型，用于读取配额配置，默认与 key 相同
+
+    Returns:
+        RateLimiter: 限流器
+    """
+    with _limiters_lock:
+        if key not in _limiters:
+            rpm_setting, tpm_setting = _LIMIT_SETTINGS.get(provider or key, (None, None))
+            # 令牌桶保存在进程内，多个 worker 时每个进程只分得配额的 1/workers，合计不超过 provider 的限制
+            share = max(1, settings.workers)
+            _limiters[key] = RateLimiter(
+                key,
+                rpm=getattr(settings, rpm_setting) / share if rpm_setting else 0,
+                tpm=getattr(settings, tpm_setting) / share if tpm_setting else 0,
+            )
+        return _limiters[key]
+
+def rate_limiter_snapshot() -> Dict[str, Dict[str, Any]]:
+    """获取全部限流器状态"""
+    with _limiters_lock:
+        return {key: limiter.snapshot() for key, limiter in _limiters.items()}
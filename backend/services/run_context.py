@@ -0,0 +1,71 @@
+"""
+研究运行的上下文
+
+RunContext 汇总一次运行的 ID、用量统计和追踪，并负责生成各阶段调用的 RunnableConfig；
+current_run_id 用于在 LLM / 工具调用中识别所属的运行
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+import uuid
+
+from services.usage import StageUsageCallback, UsageTracker
+from services.tracing import Span, Trace, TraceCallbackHandler, trace_store
+
+# 当前运行 ID，asyncio 任务创建时会自动继承
+current_run_id: ContextVar[Optional[str]] = ContextVar("current_run_id", default=None)
+
+def get_run_id(default: str = "default") -> str:
+    """获取当前运行 ID，不在任何运行中时返回 default"""
+    return current_run_id.get() or default
+
+class RunContext:
+    """一次研究运行的上下文"""
+
+    def __init__(self, run_id: Optional[str] = None, name: str = "research",
+                 register: bool = True, **attributes: Any):
+        """
+        Args:
+            run_id: 运行 ID，为空时自动生成
+            name: 运行名称（记录在追踪的根 span 上）
+            register: 是否登记追踪并设置 current_run_id（直到 finish）；
+                单独调用某个阶段时的临时上下文不登记，因为它们不会调用 finish
+            attributes: 根 span 的附加属性
+        """
+        self.run_id = run_id or str(uuid.uuid4())
+        self.usage = UsageTracker()
+        if register:
+            self.trace = trace_store.start_trace(self.run_id, name, **attributes)
+            self._run_id_token = current_run_id.set(self.run_id)
+        else:
+            self.trace = Trace(self.run_id, name, attributes)
+            self._run_id_token = None
+        # 研究深度（负载降级策略给出，为空时使用正常深度）
+        self.depth: Optional[Any] = None
+
+    def config(self, stage: str, span: Optional[Span] = None) -> Dict[str, Any]:
+        """
+        构建某个阶段调用的 RunnableConfig，将用量和追踪记录到本次运行
+
+        Args:
+            stage: 阶段名称
+            span: 调用所属的 span，默认为根 span
+
+        Returns:
+            Dict: 可传给 ainvoke / astream_events 的 config
+        """
+        callbacks: List[Any] = [
+            StageUsageCallback(stage, self.usage),
+            TraceCallbackHandler(self.trace, span),
+        ]
+        return {"callbacks": callbacks, "metadata": {"run_id": self.run_id}}
+
+    def finish(self, error: Optional[BaseException] = None):
+        """结束运行，记录最终用量，并恢复之前的 current_run_id"""
+        self.trace.finish(error=error, usage=self.usage.snapshot())
+        token, self._run_id_token = self._run_id_token, None
+        if token is not None:
+            try:
+                current_run_id.reset(token)
+            except ValueError:
+                # 在创建时以外的上下文中结束（如生成器被其他任务关闭），这个上下文中没有设置过运行 ID
+                pass
@@ -0,0 +1,147 @@
+"""
+可订阅的运行事件流（WebSocket 多路复用使用）
+
+运行在后台任务中执行，事件广播给所有订阅者；新的订阅者会先收到最近的事件，
+断线重连或在其他标签页中可以通过运行 ID 重新订阅。没有订阅者的运行在超时后自动取消
+"""
+from typing import Any, AsyncIterator, Dict, Hashable, Optional, Tuple
+from collections import deque
+import asyncio
+
+from config import settings
+
+# 运行结束的事件名（运行完成、出错或被取消后发送给订阅者）
+END_EVENT = "end"
+
+class RunStream:
+    """一次运行的事件流"""
+
+    def __init__(self, run_id: str, tenant: str):
+        self.run_id = run_id
+        # 运行所属的租户（只允许同一租户订阅）
+        self.tenant = tenant
+        # 最近的事件 (事件名, 数据)，供新订阅者补发
+        self.history: deque = deque(maxlen=settings.ws_replay_events)
+        # 订阅键 -> (连接的发送队列, 客户端的流 ID)
+        self.subscribers: Dict[Hashable, Tuple[asyncio.Queue, str]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.done = False
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, event: str, data: Any):
+        """向所有订阅者广播事件"""
+        self.history.append((event, data))
+        for queue, stream_id in list(self.subscribers.values()):
+            queue.put_nowait((stream_id, event, data))
+
+    def subscribe(self, key: Hashable, queue: asyncio.Queue, stream_id: str, replay: bool = True):
+        """
+        订阅事件流
+
+        Args:
+            key: 订阅键（同一连接内唯一）
+            queue: 连接的发送队列，事件以 (流 ID, 事件名, 数据) 写入
+            stream_id: 客户端为该订阅分配的流 ID
+            replay: 是否先补发最近的事件
+        """
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        if replay:
+            for event, data in self.history:
+                queue.put_nowait((stream_id, event, data))
+        if self.done:
+            queue.put_nowait((stream_id, END_EVENT, {"run_id": self.run_id}))
+            return
+        self.subscribers[key] = (queue, stream_id)
+
+    def unsubscribe(self, key: Hashable):
+        """取消订阅，运行没有订阅者时在 ws_orphan_timeout 秒后取消"""
+        self.subscribers.pop(key, None)
+        if not self.subscribers and not self.done and self._orphan_timer is None:
+            self._orphan_timer = asyncio.get_running_loop().call_later(
+                settings.ws_orphan_timeout, self._cancel_orphan
+            )
+
+    def _cancel_orphan(self):
+        self._orphan_timer = None
+        if not self.subscribers:
+            self.cancel("orphaned")
+
+    def cancel(self, reason: str) -> bool:
+        """
+        取消运行
+
+        Args:
+            reason: 取消原因（作为 CancelledError 的消息传给运行，记录到检查点）
+        """
+        if self.task is None or self.task.done():
+            return False
+        self.task.cancel(reason)
+        return True
+
+    def _finish(self):
+        self.done = True
+        for queue, stream_id in self.subscribers.values():
+            queue.put_nowait((stream_id, END_EVENT, {"run_id": self.run_id}))
+        self.subscribers.clear()
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+class RunStreamRegistry:
+    """进行中（以及最近结束）的运行事件流"""
+
+    def __init__(self):
+        self._streams: Dict[str, RunStream] = {}
+
+    def start(self, run_id: str, events: AsyncIterator[Tuple[str, Any]], tenant: str) -> RunStream:
+        """
+        在后台任务中执行运行，并登记其事件流
+
+        Args:
+            run_id: 运行 ID
+            events: 运行的事件生成器，产出 (事件名, 数据)
+            tenant: 运行所属的租户
+
+        Returns:
+            RunStream: 事件流
+        """
+        stream = RunStream(run_id, tenant)
+        self._streams[run_id] = stream
+
+        async def produce():
+            try:
+                async for event, data in events:
+                    stream.publish(event, data)
+            except asyncio.CancelledError:
+                stream.publish("cancelled", {"run_id": run_id})
+            finally:
+                stream._finish()
+                # 结束后保留一段时间，供重新订阅的客户端获取最近的事件
+                asyncio.get_running_loop().call_later(
+                    settings.ws_finished_retention, self._streams.pop, run_id, None
+                )
+
+        stream.task = asyncio.create_task(produce())
+        return stream
+
+    def get(self, run_id: str) -> Optional[RunStream]:
+        return self._streams.get(run_id)
+
+    async def cancel_all(self, reason: str):
+        """取消所有进行中的运行并等待其结束（关闭服务时使用）"""
+        tasks = [stream.task for stream in self._streams.values() if stream.cancel(reason)]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        active = [stream for stream in self._streams.values() if not stream.done]
+        return {
+            "active_runs": len(active),
+            "retained_runs": len(self._streams) - len(active),
+            "subscribers": sum(len(stream.subscribers) for stream in active),
+        }
+
+# 全局运行事件流
+run_streams = RunStreamRegistry()
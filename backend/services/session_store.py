@@ -0,0 +1,404 @@
+"""
+内存会话存储（带容量限制）
+
+- 限制会话数量、单个会话的消息数、总字节数，以及空闲过期时间
+- 超出限制时按 LRU 淘汰，可选把淘汰的会话压缩写入磁盘，访问时再懒加载回内存
+- 压缩和磁盘读写在线程池中执行，不阻塞事件循环；有运行进行中的会话（pin）不会被淘汰
+- 落盘的会话在内存中只保留摘要（ID、标题、时间），摘要同时写入索引文件，列出会话和启动时都不解压会话文件
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+
+from config import settings
+from models.schemas import Message, Session
+from services.structured_logging import get_logger
+
+logger = get_logger("session_store")
+
+# 落盘会话文件的后缀和摘要索引文件名
+SPILL_SUFFIX = ".json.gz"
+INDEX_FILE = "index.json"
+
+class SessionStore:
+    """带容量限制和 LRU 淘汰的会话存储"""
+
+    def __init__(self, max_sessions: int, max_messages: int, max_bytes: int,
+                 idle_ttl: float = 0, spill_dir: Optional[str] = None):
+        """
+        Args:
+            max_sessions: 内存中最多保留的会话数
+            max_messages: 单个会话最多保留的消息数（超出时丢弃最早的消息）
+            max_bytes: 内存中会话的总字节数上限
+            idle_ttl: 空闲超过该秒数的会话会被淘汰，0 表示不过期
+            spill_dir: 淘汰会话的落盘目录，为空时直接丢弃
+        """
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.spill_dir = spill_dir
+        # session_id -> 会话，按最近访问排序（最久未访问的在前）
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._last_access: Dict[str, float] = {}
+        self._total_bytes = 0
+        # 落盘会话的摘要（不含消息）：session_id -> 会话
+        self._spilled: Dict[str, Session] = {}
+        # 正在写入磁盘的会话：session_id -> (会话, 本次写入的标记)，写完之前取回时直接使用内存中的对象
+        self._writing: Dict[str, Tuple[Session, object]] = {}
+        # 有运行进行中的会话：session_id -> 运行数
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._index_lock = threading.Lock()
+        self.evicted = 0
+        self.reloaded = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spilled = self._read_index()
+
+    # ---------- 基本操作 ----------
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions or session_id in self._spilled
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """获取会话（已落盘的会话在当前线程读取后放回内存；事件循环中应使用 aget）"""
+        with self._lock:
+            session = self._take(session_id)
+            if session is not None or session_id not in self._spilled:
+                return session
+        return self._restore(session_id, self._load(session_id))
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        """获取会话（已落盘的会话在线程池中读取后放回内存）"""
+        with self._lock:
+            session = self._take(session_id)
+            if session is not None or session_id not in self._spilled:
+                return session
+        loaded = await asyncio.get_running_loop().run_in_executor(None, self._load, session_id)
+        return self._restore(session_id, loaded)
+
+    def put(self, session: Session):
+        """保存（或替换）会话"""
+        with self._lock:
+            self._drop(session.session_id)
+            self._insert(session)
+            self._enforce()
+
+    def add_message(self, session: Session, message: Message):
+        """
+        向会话追加消息，按消息大小增量更新占用，并执行容量限制
+
+        会话不在内存中（未固定的会话在运行期间被淘汰）时会重新放回内存
+        """
+        with self._lock:
+            session.messages.append(message)
+            delta = _message_size(message)
+            if self.max_messages > 0 and len(session.messages) > self.max_messages:
+                overflow = len(session.messages) - self.max_messages
+                delta -= sum(_message_size(m) for m in session.messages[:overflow])
+                del session.messages[:overflow]
+            session.updated_at = datetime.now()
+
+            session_id = session.session_id
+            if self._sessions.get(session_id) is session:
+                self._sizes[session_id] += delta
+                self._total_bytes += delta
+                self._touch(session_id)
+            else:
+                self._drop(session_id)
+                self._insert(session)
+            self._enforce()
+
+    def pin(self, session_id: str):
+        """
+        固定会话，直到 unpin：运行期间会话不会被淘汰
+
+        否则运行会继续向已落盘的旧对象追加消息，这些消息不会出现在落盘的副本中
+        """
+        with self._lock:
+            self._pins[session_id] = self._pins.get(session_id, 0) + 1
+
+    def unpin(self, session_id: str):
+        """取消一次 pin"""
+        with self._lock:
+            count = self._pins.get(session_id, 0) - 1
+            if count > 0:
+                self._pins[session_id] = count
+            else:
+                self._pins.pop(session_id, None)
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话（包括落盘的副本）"""
+        with self._lock:
+            if session_id not in self:
+                return False
+            self._drop(session_id)
+            return True
+
+    def list(self) -> List[Session]:
+        """列出全部会话（落盘的会话只返回不含消息的摘要，完整内容通过 get 获取）"""
+        with self._lock:
+            self._enforce()
+            return list(self._sessions.values()) + list(self._spilled.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """内存占用统计"""
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._sessions),
+                "sessions_spilled": len(self._spilled),
+                "sessions_pinned": len(self._pins),
+                "spills_pending": len(self._writing),
+                "messages_in_memory": sum(len(s.messages) for s in self._sessions.values()),
+                "bytes_in_memory": self._total_bytes,
+                "limits": {
+                    "max_sessions": self.max_sessions,
+                    "max_messages": self.max_messages,
+                    "max_bytes": self.max_bytes,
+                    "idle_ttl": self.idle_ttl,
+                    "spill_dir": self.spill_dir,
+                },
+                "evicted": self.evicted,
+                "reloaded": self.reloaded,
+            }
+
+    # ---------- 内部实现 ----------
+
+    def _size_of(self, session: Session) -> int:
+        return len(session.model_dump_json().encode("utf-8"))
+
+    def _insert(self, session: Session):
+        session_id = session.session_id
+        self._sessions[session_id] = session
+        self._sizes[session_id] = self._size_of(session)
+        self._total_bytes += self._sizes[session_id]
+        self._touch(session_id)
+
+    def _touch(self, session_id: str):
+        self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+
+    def _take(self, session_id: str) -> Optional[Session]:
+        """从内存中取会话（正在写入磁盘的会话直接放回内存），不在内存中时返回 None"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._touch(session_id)
+        else:
+            pending = self._writing.pop(session_id, None)
+            if pending is None:
+                return None
+            session = pending[0]
+            del self._spilled[session_id]
+            self.reloaded += 1
+            self._insert(session)
+            # 之前落盘的旧副本不再有效
+            self._run_io(self._remove_spill_file, session_id)
+        self._enforce()
+        return session
+
+    def _restore(self, session_id: str, loaded: Optional[Session]) -> Optional[Session]:
+        """把从磁盘读取的会话放回内存"""
+        with self._lock:
+            # 读取期间可能已被其他请求取回或删除
+            session = self._take(session_id)
+            if session is not None:
+                return session
+            if loaded is None or session_id not in self._spilled:
+                return None
+            del self._spilled[session_id]
+            self.reloaded += 1
+            self._insert(loaded)
+            self._enforce()
+        self._run_io(self._remove_spill_file, session_id)
+        return loaded
+
+    def _drop(self, session_id: str):
+        """从内存和磁盘中移除会话"""
+        if session_id in self._sessions:
+            del self._sessions[session_id]
+            self._total_bytes -= self._sizes.pop(session_id, 0)
+            self._last_access.pop(session_id, None)
+        if session_id in self._spilled:
+            del self._spilled[session_id]
+            self._writing.pop(session_id, None)
+            self._run_io(self._remove_spill_file, session_id)
+
+    def _evict(self, session_id: str):
+        """淘汰会话：配置了落盘目录时在线程池中写入磁盘，否则直接丢弃"""
+        session = self._sessions.pop(session_id)
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+        self._last_access.pop(session_id, None)
+        self.evicted += 1
+        if self.spill_dir:
+            token = object()
+            self._writing[session_id] = (session, token)
+            self._spilled[session_id] = _summary(session)
+            self._run_io(self._spill, session, token)
+
+    def _enforce(self):
+        """执行过期和容量限制（固定的会话不淘汰）"""
+        if self.idle_ttl > 0:
+            deadline = time.monotonic() - self.idle_ttl
+            expired = [
+                sid for sid, accessed in self._last_access.items()
+                if accessed < deadline and sid not in self._pins
+            ]
+            for session_id in expired:
+                self._evict(session_id)
+
+        # 至少保留最近访问的一个会话，避免单个超大会话被反复淘汰
+        while len(self._sessions) > 1 and (
+            (self.max_sessions > 0 and len(self._sessions) > self.max_sessions)
+            or (self.max_bytes > 0 and self._total_bytes > self.max_bytes)
+        ):
+            newest = next(reversed(self._sessions))
+            victim = next((sid for sid in self._sessions if sid not in self._pins and sid != newest), None)
+            if victim is None:
+                break
+            self._evict(victim)
+
+    # ---------- 磁盘读写（在线程池中执行） ----------
+
+    def _run_io(self, func: Callable[..., Any], *args: Any):
+        """在线程池中执行磁盘操作（不在事件循环中时直接执行）"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args)
+            return
+        loop.run_in_executor(None, func, *args)
+
+    def _spill_path(self, session_id: str) -> str:
+        # 会话 ID 由客户端传入，只保留安全字符
+        safe_id = "".join(ch for ch in session_id if ch.isalnum() or ch in "-_")
+        return os.path.join(self.spill_dir, f"{safe_id}{SPILL_SUFFIX}")
+
+    def _spill(self, session: Session, token: object):
+        """压缩写入淘汰的会话（先写临时文件，确认会话仍处于落盘状态后再替换）"""
+        session_id = session.session_id
+        path = self._spill_path(session_id)
+        tmp_path = f"{path}.{id(token)}.tmp"
+        try:
+            with self._lock:
+                # 写入之前会话已被取回或删除
+                if self._writing.get(session_id, (None, None))[1] is not token:
+                    return
+                data = session.model_dump_json()
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                f.write(data)
+            with self._lock:
+                if self._writing.get(session_id, (None, None))[1] is token:
+                    del self._writing[session_id]
+                    os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Spill session error: %s", e, extra={"session_id": session_id})
+            with self._lock:
+                if self._writing.get(session_id, (None, None))[1] is token:
+                    del self._writing[session_id]
+                    self._spilled.pop(session_id, None)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._save_index()
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        try:
+            with gzip.open(self._spill_path(session_id), "rt", encoding="utf-8") as f:
+                return Session.model_validate_json(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning("Load spilled session error: %s", e, extra={"session_id": session_id})
+            with self._lock:
+                if session_id not in self._writing:
+                    self._spilled.pop(session_id, None)
+            return None
+
+    def _remove_spill_file(self, session_id: str):
+        """删除落盘的会话文件（会话已再次落盘时保留）"""
+        with self._lock:
+            if session_id in self._spilled:
+                return
+            try:
+                os.remove(self._spill_path(session_id))
+            except OSError:
+                pass
+        self._save_index()
+
+    # ---------- 摘要索引 ----------
+
+    def _index_path(self) -> str:
+        return os.path.join(self.spill_dir, INDEX_FILE)
+
+    def _read_index(self) -> Dict[str, Session]:
+        """读取落盘会话的摘要索引；不在索引中的会话文件（写索引之前进程退出）才解压读取"""
+        summaries: Dict[str, Session] = {}
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    summary = Session.model_validate(item)
+                    summaries[summary.session_id] = summary
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Load session index error: %s", e)
+
+        names = {name for name in os.listdir(self.spill_dir) if name.endswith(SPILL_SUFFIX)}
+        spilled = {
+            session_id: summary for session_id, summary in summaries.items()
+            if os.path.basename(self._spill_path(session_id)) in names
+        }
+        indexed = {os.path.basename(self._spill_path(session_id)) for session_id in spilled}
+        for name in names - indexed:
+            session = self._load(name[:-len(SPILL_SUFFIX)])
+            if session is not None:
+                spilled[session.session_id] = _summary(session)
+        if spilled.keys() != summaries.keys():
+            self._spilled = spilled
+            self._save_index()
+        return spilled
+
+    def _save_index(self):
+        """写入摘要索引（先写临时文件再替换）"""
+        with self._index_lock:
+            with self._lock:
+                items = [summary.model_dump(mode="json") for summary in self._spilled.values()]
+            path = self._index_path()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(items, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Write session index error: %s", e)
+
+def _summary(session: Session) -> Session:
+    """会话摘要（不含消息）"""
+    return Session(
+        session_id=session.session_id,
+        title=session.title,
+        created_at=session.created_at,
+        updated_at=session.updated_at,
+    )
+
+def _message_size(message: Message) -> int:
+    """消息序列化后的字节数（加上列表中的分隔符），用于增量更新会话占用"""
+    return len(message.model_dump_json().encode("utf-8")) + 1
+
+def create_session_store() -> SessionStore:
+    """按配置创建会话存储"""
+    return SessionStore(
+        max_sessions=settings.session_max_count,
+        max_messages=settings.session_max_messages,
+        max_bytes=settings.session_max_bytes,
+        idle_ttl=settings.session_idle_ttl,
+        spill_dir=settings.session_spill_dir,
+    )
@@ -0,0 +1,212 @@
+"""
+跨进程共享缓存（SQLite 键值存储）
+
+多个 worker 进程共用同一个数据库文件，缓存搜索结果、LLM 补全和研究计划，
+新启动的 worker 不需要各自重新预热。每次写入是单条语句的事务（原子写入），
+总大小超过上限时按最近访问时间淘汰
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import settings
+from services.structured_logging import get_logger
+
+logger = get_logger("shared_cache")
+
+# 缓存命名空间
+SEARCH = "search"
+LLM = "llm"
+PLAN = "plan"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+class SharedCache:
+    """基于 SQLite 的跨进程键值缓存（值为 JSON，带过期时间和总大小上限）"""
+
+    def __init__(self, path: str, max_bytes: int, evict_interval: int = 50):
+        """
+        Args:
+            path: 数据库文件路径
+            max_bytes: 缓存值的总字节数上限，超出时淘汰最久未访问的条目
+            evict_interval: 每写入多少次检查一次总大小
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        # 每个线程使用自己的连接（sqlite3 连接不能跨线程共享）
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 当前进程的命中统计：命名空间 -> [命中, 未命中]
+        self._counters: Dict[str, list] = {}
+        self.evicted = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 自动提交模式，单条语句即一个事务；等锁最多 30 秒
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL 模式下读写互不阻塞，适合多个进程并发访问
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, namespace: str, hit: bool):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, [0, 0])
+            counters[0 if hit else 1] += 1
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        读取缓存
+
+        Args:
+            namespace: 命名空间
+            key: 键
+
+        Returns:
+            Optional[Any]: 缓存的值，未命中、已过期或读取出错时返回 None
+        """
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key)
+                )
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Shared cache read error: %s", e)
+            return None
+        self._count(namespace, row is not None)
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float):
+        """
+        写入缓存（覆盖同键的旧值）
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            value: 可以序列化为 JSON 的值
+            ttl: 有效期（秒）
+        """
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data.encode("utf-8")), now + ttl, now)
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Shared cache write error: %s", e)
+            return
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.evict_interval == 0
+        if check:
+            self.evict()
+
+    async def aget(self, namespace: str, key: str) -> Optional[Any]:
+        """在线程池中读取缓存，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, namespace, key)
+
+    async def aput(self, namespace: str, key: str, value: Any, ttl: float):
+        """在线程池中写入缓存，不阻塞事件循环"""
+        await asyncio.get_running_loop().run_in_executor(None, self.put, namespace, key, value, ttl)
+
+    def evict(self):
+        """删除过期条目；总大小仍超过上限时按最近访问时间淘汰到上限的 90%"""
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - int(self.max_bytes * 0.9)
+                    rows = conn.execute("SELECT rowid, size FROM cache ORDER BY accessed_at")
+                    victims = []
+                    for rowid, size in rows:
+                        if excess <= 0:
+                            break
+                        victims.append((rowid,))
+                        excess -= size
+                    conn.executemany("DELETE FROM cache WHERE rowid = ?", victims)
+                    deleted += len(victims)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Shared cache eviction error: %s", e)
+            return
+        self.evicted += deleted
+
+    def clear(self, namespace: Optional[str] = None):
+        """清空缓存（指定命名空间时只清空该命名空间）"""
+        try:
+            if namespace is None:
+                self._connection().execute("DELETE FROM cache")
+            else:
+                self._connection().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Shared cache clear error: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计（条目数和大小为所有进程共享的数据，命中率为当前进程的统计）"""
+        namespaces: Dict[str, Dict[str, Any]] = {}
+        try:
+            for namespace, entries, size in self._connection().execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache GROUP BY namespace"
+            ):
+                namespaces[namespace] = {"entries": entries, "bytes": size}
+        except sqlite3.Error as e:
+            logger.warning("Shared cache stats error: %s", e)
+        with self._lock:
+            for namespace, (hits, misses) in self._counters.items():
+                namespaces.setdefault(namespace, {"entries": 0, "bytes": 0}).update(hits=hits, misses=misses)
+        return {
+            "path": self.path,
+            "pid": os.getpid(),
+            "max_bytes": self.max_bytes,
+            "bytes": sum(item["bytes"] for item in namespaces.values()),
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "namespaces": namespaces,
+        }
+
+# 全局共享缓存（首次访问时才打开数据库）
+shared_cache = SharedCache(settings.shared_cache_path, settings.shared_cache_max_bytes)
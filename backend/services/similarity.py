@@ -0,0 +1,42 @@
+"""
+本地文本相似度工具（用于识别相同或近似的子任务、搜索查询）
+"""
+from typing import Iterable, List, Set
+import re
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+
+def text_terms(text: str) -> List[str]:
+    """
+    分词：英文按单词，中文按字符二元组
+
+    Args:
+        text: 文本
+
+    Returns:
+        List[str]: 词项列表（保留重复）
+    """
+    text = text.lower()
+    terms = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def term_set(text: str) -> Set[str]:
+    """文本的词项集合"""
+    return set(text_terms(text))
+
+def normalize_text(text: str) -> str:
+    """规范化文本：去除标点和大小写差异，词项排序后拼接"""
+    return " ".join(sorted(term_set(text)))
+
+def jaccard(a: Iterable[str], b: Iterable[str]) -> float:
+    """两个词项集合的 Jaccard 相似度"""
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,190 @@
+"""
+结构化日志
+
+- 日志记录在调用方只做入队（QueueHandler），格式化和写入由后台线程完成，不占用事件循环
+- 每条记录输出为一行 JSON，自动附带当前运行 ID（current_run_id）
+- Agent 步骤日志量大，按比例采样；警告及以上级别总是保留
+- 文件日志写入 log_dir 并按大小轮转
+"""
+from typing import Any, Dict, Optional
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from config import settings
+from services.run_context import current_run_id
+
+# 所有应用日志都在该命名空间下
+LOGGER_NAMESPACE = "deepresearch"
+
+# Agent 步骤日志（按 log_step_sample_rate 采样）
+STEP_LOGGER = f"{LOGGER_NAMESPACE}.steps"
+
+# 标准 LogRecord 属性，其余属性作为 extra 字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "run_id"}
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        run_id = getattr(record, "run_id", None)
+        if run_id:
+            data["run_id"] = run_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class RunIdFilter(logging.Filter):
+    """在调用方线程中记录当前运行 ID（后台线程中无法读取 ContextVar）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "run_id", None) is None:
+            record.run_id = current_run_id.get()
+        return True
+
+class StepSampler(logging.Filter):
+    """对 Agent 步骤日志按比例采样，警告及以上级别不采样"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not record.name.startswith(STEP_LOGGER):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    """队列满时直接丢弃日志记录，而不是阻塞或报错"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只合并消息参数并渲染异常堆栈，JSON 格式化留给后台线程
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+def setup_logging():
+    """
+    配置应用日志（重复调用无副作用）
+
+    根 logger 只挂一个非阻塞的队列处理器，后台线程负责输出到标准输出和轮转的日志文件
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter()
+    handlers = []
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+
+    if settings.log_dir:
+        os.makedirs(settings.log_dir, exist_ok=True)
+        # 多进程时每个 worker 写自己的文件，避免轮转时互相覆盖
+        filename = "app.log" if settings.workers <= 1 else f"app-{os.getpid()}.log"
+        file_handler = RotatingFileHandler(
+            os.path.join(settings.log_dir, filename),
+            maxBytes=settings.log_file_max_bytes,
+            backupCount=settings.log_file_backup_count,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    _queue_handler.addFilter(StepSampler(settings.log_step_sample_rate))
+    _queue_handler.addFilter(RunIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(settings.log_level.upper())
+
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """停止后台线程（会先写完队列中剩余的日志）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def logging_stats() -> Dict[str, Any]:
+    """日志队列状态"""
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "step_sample_rate": settings.log_step_sample_rate,
+    }
+
+def get_logger(name: str) -> logging.Logger:
+    """获取应用 logger（deepresearch.<name>）"""
+    return logging.getLogger(f"{LOGGER_NAMESPACE}.{name}")
+
+def _truncate(value: Any, limit: int = 200) -> str:
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+class StepLogCallback(AsyncCallbackHandler):
+    """
+    记录 AgentExecutor 的每个步骤（替代 verbose 输出）
+
+    作为执行器的构造参数传入，只接收执行器自身的事件；运行 ID 由 RunIdFilter 补充
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.logger = logging.getLogger(f"{STEP_LOGGER}.{stage}")
+
+    def _log(self, level: int, message: str, **fields: Any):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, extra={"stage": self.stage, **fields})
+
+    async def on_agent_action(self, action: Any, **kwargs: Any):
+        self._log(logging.INFO, "agent_action", tool=action.tool, tool_input=_truncate(action.tool_input))
+
+    async def on_agent_finish(self, finish: Any, **kwargs: Any):
+        self._log(logging.INFO, "agent_finish", output_size=len(str(finish.return_values.get("output", ""))))
+
+    async def on_chain_error(self, error: BaseException, **kwargs: Any):
+        self._log(logging.WARNING, "agent_error", error=_truncate(error))
@@ -0,0 +1,123 @@
+"""
+子任务研究结果缓存
+
+不同的研究问题经常拆解出相同或近似的子任务（如"X 的市场规模"），
+按规范化的标题 + 调研方向缓存研究结果，近似子任务按词项 Jaccard 相似度匹配；
+结果只在同一租户内复用（由该租户的配额支付，且可能带有该租户问题中的特定内容）
+"""
+from typing import Any, Dict, Optional, Set, Tuple
+from collections import OrderedDict
+import threading
+import time
+
+from config import settings
+from services.quota import DEFAULT_TENANT
+from services.similarity import jaccard, normalize_text, term_set
+
+def task_text(task: Dict[str, Any]) -> str:
+    """子任务的比较文本：标题 + 调研方向"""
+    return f"{task.get('title', '')} {' '.join(task.get('directions', []))}"
+
+class _Entry:
+    def __init__(self, tenant: str, terms: Set[str], result: str, depth_level: int):
+        self.tenant = tenant
+        self.terms = terms
+        self.result = result
+        self.depth_level = depth_level
+        self.created = time.monotonic()
+        self.hits = 0
+
+class TaskResultCache:
+    """子任务研究结果缓存（带过期时间和容量上限，超出时淘汰最久未使用的条目）"""
+
+    def __init__(self, ttl: float, max_entries: int, threshold: float):
+        """
+        Args:
+            ttl: 结果的有效期（秒）
+            max_entries: 最多缓存的子任务数
+            threshold: 词项 Jaccard 相似度达到该值即视为近似子任务
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        # (租户, 规范化文本) -> 条目，按最近使用排序
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task: Dict[str, Any], depth_level: int = 0, tenant: str = DEFAULT_TENANT) -> Optional[str]:
+        """
+        查找同一租户相同或近似子任务的研究结果
+
+        降级运行得到的结果只提供给同等或更低深度的运行
+
+        Args:
+            task: 子任务
+            depth_level: 当前运行的降级等级
+            tenant: 当前运行所属的租户
+
+        Returns:
+            Optional[str]: 缓存的研究结果，未命中时返回 None
+        """
+        text = task_text(task)
+        key = (tenant, normalize_text(text))
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None or entry.depth_level > depth_level:
+                terms = term_set(text)
+                entry, best = None, self.threshold
+                for candidate_key, candidate in self._entries.items():
+                    if candidate.tenant != tenant or candidate.depth_level > depth_level:
+                        continue
+                    score = jaccard(terms, candidate.terms)
+                    if score >= best:
+                        entry, best, key = candidate, score, candidate_key
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            return entry.result
+
+    def put(self, task: Dict[str, Any], result: str, depth_level: int = 0, tenant: str = DEFAULT_TENANT):
+        """缓存租户的子任务研究结果"""
+        text = task_text(task)
+        key = (tenant, normalize_text(text))
+        with self._lock:
+            existing = self._entries.get(key)
+            # 不用降级结果覆盖更完整的结果
+            if existing is not None and existing.depth_level < depth_level:
+                return
+            self._entries[key] = _Entry(tenant, term_set(text), result, depth_level)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry.created < deadline]:
+            del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "ttl": self.ttl,
+                "max_entries": self.max_entries,
+            }
+
+# 全局子任务结果缓存
+task_cache = TaskResultCache(
+    ttl=settings.task_cache_ttl,
+    max_entries=settings.task_cache_max_entries,
+    threshold=settings.task_cache_similarity_threshold,
+)
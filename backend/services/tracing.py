@@ -0,0 +1,331 @@
+"""
+研究运行的结构化追踪
+
+每次运行生成一棵 span 树：run -> plan / 子任务 / ReAct 步骤 / 工具调用 / 报告撰写，
+保存在进程内的环形缓冲区中，可选追加导出到本地 JSONL 文件
+"""
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from datetime import datetime
+from uuid import UUID
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from config import settings
+from services.usage import estimate_tokens, extract_token_usage
+
+def _preview(value: Any, limit: int = 200) -> str:
+    """截断过长的内容，用于 span 属性"""
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def _size(value: Any) -> int:
+    """计算内容大小（字符数）"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+class Span:
+    """一个计时区间"""
+
+    def __init__(self, trace: "Trace", name: str, kind: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "running"
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> "Span":
+        """设置属性"""
+        self.attributes.update(attributes)
+        return self
+
+    def child(self, name: str, kind: str, **attributes: Any) -> "Span":
+        """创建子 span"""
+        return self.trace.start_span(name, kind, parent=self, **attributes)
+
+    def end(self, error: Optional[BaseException] = None, **attributes: Any):
+        """结束 span（重复调用无效）"""
+        if self.duration is not None:
+            return
+        self.attributes.update(attributes)
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"[:500]
+        else:
+            self.status = "ok"
+
+    def to_dict(self) -> Dict[str, Any]:
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._start
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": datetime.fromtimestamp(self.started_at).isoformat(),
+            "offset": round(self.started_at - self.trace.root.started_at, 3),
+            "duration": round(duration, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+class Trace:
+    """一次研究运行的完整追踪"""
+
+    def __init__(self, run_id: str, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.run_id = run_id
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+        self.root = Span(self, name, "run", attributes=attributes)
+        self.spans.append(self.root)
+
+    def start_span(self, name: str, kind: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """
+        创建 span（超过单次运行的 span 上限后不再记录，但仍返回可用的 span）
+
+        Args:
+            name: span 名称
+            kind: 类型（stage / task / step / llm / tool / chain）
+            parent: 父 span，默认为根 span
+        """
+        span = Span(self, name, kind, parent_id=(parent or self.root).span_id, attributes=attributes)
+        with self._lock:
+            if len(self.spans) < settings.trace_max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+        return span
+
+    def finish(self, error: Optional[BaseException] = None, **attributes: Any):
+        """结束运行，并按配置导出到本地文件"""
+        self.root.end(error=error, **attributes)
+        # 结束所有未正常结束的 span（例如运行被取消）
+        for span in self.spans:
+            if span.duration is None:
+                span.end()
+                span.status = "incomplete"
+        if settings.trace_export_path:
+            _export(self.to_dict())
+
+    def summary(self) -> Dict[str, Any]:
+        """运行摘要"""
+        llm_spans = [s for s in self.spans if s.kind == "llm"]
+        return {
+            "run_id": self.run_id,
+            "name": self.root.name,
+            "status": self.root.status,
+            "start_time": datetime.fromtimestamp(self.root.started_at).isoformat(),
+            "duration": self.root.to_dict()["duration"],
+            "span_count": len(self.spans),
+            "llm_calls": len(llm_spans),
+            "tool_calls": sum(1 for s in self.spans if s.kind == "tool"),
+            "prompt_tokens": sum(s.attributes.get("prompt_tokens", 0) for s in llm_spans),
+            "completion_tokens": sum(s.attributes.get("completion_tokens", 0) for s in llm_spans),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            **self.summary(),
+            "dropped_spans": self.dropped_spans,
+            "spans": spans,
+        }
+
+def _write_export(path: str, record: Dict[str, Any]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+def _export(record: Dict[str, Any]):
+    """追加导出一条追踪记录（在事件循环中时放到线程池执行）"""
+    path = settings.trace_export_path
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_export(path, record)
+        return
+    loop.run_in_executor(None, _write_export, path, record)
+
+class TraceStore:
+    """最近运行追踪的环形缓冲区"""
+
+    def __init__(self, max_traces: int):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_trace(self, run_id: str, name: str, **attributes: Any) -> Trace:
+        """创建并登记一个新的追踪，超过容量时淘汰最早的追踪"""
+        trace = Trace(run_id, name, attributes)
+        with self._lock:
+            self._traces[run_id] = trace
+            self._traces.move_to_end(run_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace
+
+    def get(self, run_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(run_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """最近运行的摘要（新的在前）"""
+        with self._lock:
+            traces = list(self._traces.values())
+        return [trace.summary() for trace in reversed(traces)]
+
+class TraceCallbackHandler(AsyncCallbackHandler):
+    """
+    把 LangChain 回调转换为 span
+
+    - 顶层 chain（如 AgentExecutor）生成 chain span
+    - chain 内的每次 LLM 调用开启一个新的 ReAct 步骤 span，其后的工具调用归属该步骤
+    - 不在 chain 内的 LLM 调用（规划、写作）直接挂在 parent 下
+    """
+
+    def __init__(self, trace: Trace, parent: Optional[Span] = None):
+        self.trace = trace
+        self.parent = parent or trace.root
+        self._spans: Dict[UUID, Span] = {}
+        # LangChain run_id -> 所属顶层 chain 的 run_id
+        self._owner: Dict[UUID, UUID] = {}
+        # 顶层 chain run_id -> 当前 ReAct 步骤
+        self._steps: Dict[UUID, Span] = {}
+        self._step_counts: Dict[UUID, int] = {}
+
+    def _owner_of(self, parent_run_id: Optional[UUID]) -> Optional[UUID]:
+        return self._owner.get(parent_run_id) if parent_run_id is not None else None
+
+    async def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *,
+                             run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        owner = self._owner_of(parent_run_id)
+        if owner is not None:
+            self._owner[run_id] = owner
+            return
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+        self._spans[run_id] = self.parent.child(name, "chain", input_size=_size(inputs))
+        self._owner[run_id] = run_id
+        self._step_counts[run_id] = 0
+
+    async def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None or span.kind != "chain":
+            return
+        step = self._steps.pop(run_id, None)
+        if step is not None:
+            step.end()
+        span.end(output_size=_size(outputs), steps=self._step_counts.pop(run_id, 0))
+
+    async def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None or span.kind != "chain":
+            return
+        step = self._steps.pop(run_id, None)
+        if step is not None:
+            step.end(error=error)
+        span.end(error=error, steps=self._step_counts.pop(run_id, 0))
+
+    def _start_llm(self, run_id: UUID, parent_run_id: Optional[UUID], prompt_text: str, kwargs: Dict[str, Any]):
+        owner = self._owner_of(parent_run_id)
+        parent = self.parent
+        if owner is not None and owner in self._spans:
+            # chain 内的每次 LLM 调用对应一个 ReAct 步骤
+            previous = self._steps.get(owner)
+            if previous is not None:
+                previous.end()
+            self._step_counts[owner] += 1
+            parent = self._spans[owner].child(f"step {self._step_counts[owner]}", "step")
+            self._steps[owner] = parent
+            self._owner[run_id] = owner
+        metadata = kwargs.get("metadata") or {}
+        params = kwargs.get("invocation_params") or {}
+        self._spans[run_id] = parent.child(
+            "llm", "llm",
+            stage=metadata.get("stage"),
+            model=params.get("model_name") or params.get("model"),
+            prompt_size=len(prompt_text),
+            estimated_prompt_tokens=estimate_tokens(prompt_text),
+        )
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                                  run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        prompt_text = "".join(
+            str(getattr(message, "content", "")) for batch in messages for message in batch
+        )
+        self._start_llm(run_id, parent_run_id, prompt_text, kwargs)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                           run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start_llm(run_id, parent_run_id, "".join(prompts), kwargs)
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        output_text = "".join(g.text for generations in response.generations for g in generations)
+        prompt_tokens, completion_tokens = extract_token_usage(response)
+        if prompt_tokens is None:
+            prompt_tokens = span.attributes.get("estimated_prompt_tokens", 0)
+            completion_tokens = estimate_tokens(output_text)
+        span.end(
+            output_size=len(output_text),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.end(error=error)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                            run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        owner = self._owner_of(parent_run_id)
+        parent = self._steps.get(owner) if owner is not None else None
+        if parent is None:
+            parent = self._spans.get(owner) if owner is not None else None
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._spans[run_id] = (parent or self.parent).child(
+            name, "tool", input=_preview(input_str), input_size=_size(input_str)
+        )
+        if owner is not None:
+            self._owner[run_id] = owner
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            content = getattr(output, "content", output)
+            span.end(output_size=_size(content))
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.end(error=error)
+
+# 全局追踪存储
+trace_store = TraceStore(settings.trace_buffer_size)
@@ -0,0 +1,205 @@
+"""
+LLM 调用耗时与 Token 用量统计
+"""
+from typing import Any, Dict, List, Optional
+from collections import deque
+from uuid import UUID
+import threading
+import time
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# 每个阶段保留的最近耗时样本数（用于计算分位数）
+LATENCY_WINDOW = 200
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数
+
+    中文字符按 1 token/字计算，其余字符按 4 字符/token 计算
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        int: 估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _percentile(samples: List[float], q: float) -> float:
+    """计算分位数"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+class UsageTracker:
+    """按阶段累计 LLM 调用次数、耗时和 token 用量"""
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, latency: float, prompt_tokens: int,
+               completion_tokens: int, model: Optional[str] = None,
+               estimated: bool = False):
+        """
+        记录一次 LLM 调用
+
+        Args:
+            stage: 阶段名称
+            latency: 调用耗时（秒）
+            prompt_tokens: 输入 token 数
+            completion_tokens: 输出 token 数
+            model: 模型名称
+            estimated: token 数是否为估算值
+        """
+        with self._lock:
+            stats = self._stage(stage)
+            stats["calls"] += 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["latencies"].append(latency)
+            if estimated:
+                stats["estimated_calls"] += 1
+            if model:
+                stats["models"].add(model)
+
+    def record_cache_hit(self, stage: str):
+        """记录一次命中补全缓存的调用（不计入调用次数、耗时和 token 用量）"""
+        with self._lock:
+            self._stage(stage)["cache_hits"] += 1
+
+    def _stage(self, stage: str) -> Dict[str, Any]:
+        return self._stages.setdefault(stage, {
+            "calls": 0,
+            "cache_hits": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "estimated_calls": 0,
+            "models": set(),
+            "latencies": deque(maxlen=LATENCY_WINDOW),
+        })
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各阶段统计快照
+
+        Returns:
+            Dict: 阶段名称 -> 统计信息
+        """
+        with self._lock:
+            result = {}
+            for stage, stats in self._stages.items():
+                latencies = list(stats["latencies"])
+                result[stage] = {
+                    "calls": stats["calls"],
+                    "cache_hits": stats["cache_hits"],
+                    "avg_latency": round(stats["total_latency"] / max(stats["calls"], 1), 3),
+                    "p50_latency": round(_percentile(latencies, 0.5), 3),
+                    "p95_latency": round(_percentile(latencies, 0.95), 3),
+                    "max_latency": round(stats["max_latency"], 3),
+                    "total_latency": round(stats["total_latency"], 3),
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "total_tokens": stats["prompt_tokens"] + stats["completion_tokens"],
+                    "estimated_calls": stats["estimated_calls"],
+                    "models": sorted(stats["models"]),
+                }
+            return result
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._stages.clear()
+
+class StageUsageCallback(AsyncCallbackHandler):
+    """将 LLM 调用的耗时和 token 用量记录到 UsageTracker"""
+
+    def __init__(self, stage: str, tracker: UsageTracker):
+        self.stage = stage
+        self.tracker = tracker
+        # run_id -> (开始时间, 估算的输入 token 数, 模型名称)
+        self._pending: Dict[UUID, tuple] = {}
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]],
+                                  *, run_id: UUID, **kwargs: Any) -> None:
+        prompt_text = "".join(
+            str(getattr(message, "content", "")) for batch in messages for message in batch
+        )
+        model = (kwargs.get("invocation_params") or {}).get("model_name") \
+            or (kwargs.get("invocation_params") or {}).get("model")
+        self._pending[run_id] = (time.perf_counter(), estimate_tokens(prompt_text), model)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                           *, run_id: UUID, **kwargs: Any) -> None:
+        model = (kwargs.get("invocation_params") or {}).get("model_name")
+        self._pending[run_id] = (time.perf_counter(), estimate_tokens("".join(prompts)), model)
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        if is_cached_response(response):
+            # 命中补全缓存时没有真正调用模型，不计入耗时分位数和 token 用量
+            self.tracker.record_cache_hit(self.stage)
+            return
+        started, estimated_prompt, model = pending
+        latency = time.perf_counter() - started
+
+        prompt_tokens, completion_tokens = extract_token_usage(response)
+        estimated = prompt_tokens is None
+        if estimated:
+            prompt_tokens = estimated_prompt
+            completion_tokens = sum(
+                estimate_tokens(generation.text)
+                for generations in response.generations for generation in generations
+            )
+
+        model = model or (response.llm_output or {}).get("model_name")
+        self.tracker.record(self.stage, latency, prompt_tokens, completion_tokens,
+                            model=model, estimated=estimated)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._pending.pop(run_id, None)
+
+def is_cached_response(response: LLMResult) -> bool:
+    """结果是否来自补全缓存（PooledChatModel 在命中缓存的消息上标记 cached）"""
+    if (response.llm_output or {}).get("cached"):
+        return True
+    return any(
+        (getattr(getattr(generation, "message", None), "response_metadata", None) or {}).get("cached")
+        for generations in response.generations for generation in generations
+    )
+
+def extract_token_usage(response: LLMResult):
+    """从 LLM 返回结果中提取真实的 token 用量，取不到时返回 (None, None)"""
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage.get("prompt_tokens") is not None:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+    # 流式输出时 token 用量挂在消息的 usage_metadata 上
+    prompt_tokens = completion_tokens = 0
+    found = False
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                found = True
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if found:
+        return prompt_tokens, completion_tokens
+    return None, None
+
+# 全局用量统计（进程级）
+llm_usage = UsageTracker()
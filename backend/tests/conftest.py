@@ -0,0 +1,46 @@
+"""
+测试公共设置
+
+在 backend 目录下运行：python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+# 与应用本身一致，以 backend 目录为导入根目录（from config import settings）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import provider_pool, rate_limiter
+
+class FakeClock:
+    """可手动推进的时钟，替换模块中的 time（只提供被测代码用到的函数）"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture(autouse=True)
+def fresh_registries(monkeypatch):
+    """每个测试使用独立的 provider 健康状态和限流器"""
+    monkeypatch.setattr(provider_pool, "_health_registry", {})
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+
+@pytest.fixture
+def clock(monkeypatch):
+    """限流器和 provider 健康状态使用的假时钟"""
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake)
+    monkeypatch.setattr(provider_pool, "time", fake)
+    return fake
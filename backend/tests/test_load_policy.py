@@ -0,0 +1,33 @@
+"""
+研究深度降级策略的测试：配额软限制逐级降级、不改走单 Agent、降级原因
+"""
+from config import settings
+from services.load_policy import DEPTH_LEVELS, degrade_for_quota
+
+def test_quota_degrades_one_level_at_a_time():
+    depth = degrade_for_quota(DEPTH_LEVELS[0])
+    assert depth.level == 1
+    assert depth.to_metadata() == {"level": 1, "name": "reduced", "reasons": ["quota"]}
+
+    depth = degrade_for_quota(DEPTH_LEVELS[1].because("load"))
+    assert depth.level == 2
+    assert depth.reasons == ["load", "quota"]
+    # 共享的等级对象不被修改
+    assert DEPTH_LEVELS[2].reasons == []
+
+def test_quota_never_routes_to_single_agent():
+    depth = degrade_for_quota(DEPTH_LEVELS[2])
+    assert depth.level == 2 and not depth.route_single
+    assert depth.reasons == []
+
+    # 负载已经决定改走单 Agent 时保持不变
+    single = DEPTH_LEVELS[3].because("load")
+    assert degrade_for_quota(single) is single
+
+def test_quota_respects_max_degradation_level(monkeypatch):
+    monkeypatch.setattr(settings, "max_degradation_level", 1)
+    assert degrade_for_quota(DEPTH_LEVELS[0]).level == 1
+    assert degrade_for_quota(DEPTH_LEVELS[1]).level == 1
+
+    monkeypatch.setattr(settings, "max_degradation_level", 0)
+    assert degrade_for_quota(DEPTH_LEVELS[0]) is DEPTH_LEVELS[0]
@@ -0,0 +1,69 @@
+"""
+多 Agent 研究员流式执行的测试：转发给前端的工具调用、工具结果和思考过程
+"""
+import asyncio
+
+from langchain.agents import AgentExecutor
+from langchain.prompts import PromptTemplate
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from agents.multi_agent import RESEARCHER_PROMPT, MultiAgentResearcher
+from agents.scratchpad import create_compressed_react_agent
+from services.run_context import RunContext
+
+@tool
+def tavily_search(query: str) -> str:
+    """假的搜索工具"""
+    return f"关于 {query} 的搜索结果"
+
+def _executor(*replies: str) -> AgentExecutor:
+    """按顺序返回 replies 的研究员执行器"""
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content=reply) for reply in replies]))
+    agent = create_compressed_react_agent(
+        llm=llm, tools=[tavily_search], prompt=PromptTemplate.from_template(RESEARCHER_PROMPT)
+    )
+    return AgentExecutor(agent=agent, tools=[tavily_search], handle_parsing_errors=True)
+
+def _stream(executor: AgentExecutor):
+    """执行一次 _stream_researcher，返回 (执行器输出, 转发的事件)"""
+    events = []
+
+    async def run():
+        # 只测试流式执行，不需要创建各阶段的 LLM
+        researcher = object.__new__(MultiAgentResearcher)
+        context = RunContext(name="test")
+        span = context.trace.start_span("task 1", "task")
+        return await researcher._stream_researcher(executor, "研究问题", 1, context, span, events.append)
+
+    return asyncio.run(run()), events
+
+def test_tool_call_event_carries_the_search_query():
+    executor = _executor(
+        "Thought: 需要搜索\nAction: tavily_search\nAction Input: 量子计算 最新进展",
+        "Thought: 信息足够\nFinal Answer: 研究结论",
+    )
+
+    result, events = _stream(executor)
+
+    assert result["output"] == "研究结论"
+    calls = [event for event in events if event["type"] == "tool_call"]
+    assert [call["content"] for call in calls] == [{"tool": "tavily_search", "input": "量子计算 最新进展"}]
+    assert calls[0]["metadata"] == {"step": "researching", "task_id": 1}
+    results = [event for event in events if event["type"] == "tool_result"]
+    assert results[0]["content"]["output"] == "关于 量子计算 最新进展 的搜索结果"
+
+def test_tool_call_inputs_follow_each_step():
+    executor = _executor(
+        "Thought: 先查背景\nAction: tavily_search\nAction Input: 第一个查询",
+        "Thought: 再查细节\nAction: tavily_search\nAction Input: 第二个查询",
+        "Thought: 信息足够\nFinal Answer: 研究结论",
+    )
+
+    _, events = _stream(executor)
+
+    inputs = [event["content"]["input"] for event in events if event["type"] == "tool_call"]
+    assert inputs == ["第一个查询", "第二个查询"]
+    thoughts = [event["content"] for event in events if event["type"] == "thinking"]
+    assert thoughts[:2] == ["💭 先查背景", "💭 再查细节"]
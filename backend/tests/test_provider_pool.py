@@ -0,0 +1,346 @@
+"""
+LLM Provider 池的测试：重试退避、故障转移顺序、熔断冷却、对冲请求、Retry-After 和补全缓存
+"""
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import settings
+from services import provider_pool
+from services.provider_pool import PoolMember, PooledChatModel, ProviderPool, backoff_delay, is_transient_error
+from services.rate_limiter import RateLimiter
+from services.quota import current_tenant
+from services.usage import StageUsageCallback, UsageTracker
+
+MESSAGES = [HumanMessage(content="hi")]
+
+# 流式调用一直不返回首 token，直到被取消
+HANG = object()
+
+class FakeAPIError(Exception):
+    """模拟 openai SDK 的 HTTP 错误（status_code 和响应头）"""
+
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+class FakeChatModel:
+    """
+    按脚本返回结果的 chat 模型
+
+    每次调用取 outcomes 中的下一项（最后一项重复使用）：
+    字符串为完整回复，异常在首 token 前抛出，列表为依次输出的片段（其中的异常在输出到该处时抛出），
+    HANG 表示一直等待首 token
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.cancelled = False
+
+    def _next(self):
+        self.calls += 1
+        return self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+
+    def _generate(self, messages, stop=None, **kwargs):
+        outcome = self._next()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=outcome))])
+
+    async def _agenerate(self, messages, stop=None, **kwargs):
+        outcome = self._next()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=outcome))])
+
+    async def _astream(self, messages, stop=None, **kwargs):
+        outcome = self._next()
+        if outcome is HANG:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        for part in [outcome] if isinstance(outcome, str) else outcome:
+            if isinstance(part, BaseException):
+                raise part
+            yield ChatGenerationChunk(message=AIMessageChunk(content=part))
+            await asyncio.sleep(0)
+
+def _member(name: str, model: FakeChatModel) -> PoolMember:
+    return PoolMember(name, model, "fake-model", "fake")
+
+def _stream(pool: ProviderPool):
+    """运行一次流式调用，返回 (输出片段, 异常)"""
+    parts = []
+
+    async def run():
+        try:
+            async for chunk in pool.astream(MESSAGES):
+                parts.append(chunk.text)
+        except Exception as e:
+            return e
+        finally:
+            # 让被取消的对冲任务处理完取消
+            await asyncio.sleep(0)
+        return None
+
+    # 对冲失效时主 provider 会一直等待，超时让测试失败而不是卡住
+    error = asyncio.run(asyncio.wait_for(run(), timeout=5))
+    return parts, error
+
+@pytest.fixture(autouse=True)
+def pool_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_retries", 2)
+    monkeypatch.setattr(settings, "llm_retry_base_delay", 0)
+    monkeypatch.setattr(settings, "provider_failure_threshold", 1)
+    monkeypatch.setattr(settings, "provider_cooldown", 30.0)
+
+# ---------- 错误分类和退避 ----------
+
+def test_transient_error_classification():
+    assert is_transient_error(FakeAPIError(503))
+    assert is_transient_error(FakeAPIError(429))
+    assert not is_transient_error(FakeAPIError(400))
+    assert is_transient_error(asyncio.TimeoutError())
+    assert is_transient_error(type("APIConnectionError", (Exception,), {})())
+    assert not is_transient_error(ValueError("bad input"))
+
+def test_backoff_delay_is_capped_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(settings, "llm_retry_base_delay", 1.0)
+    monkeypatch.setattr(settings, "llm_retry_max_delay", 4.0)
+    # 全抖动取上限
+    monkeypatch.setattr(provider_pool.random, "uniform", lambda low, high: high)
+    assert backoff_delay(0) == 1.0
+    assert backoff_delay(1) == 2.0
+    assert backoff_delay(5) == 4.0
+    assert backoff_delay(0, FakeAPIError(429, {"retry-after": "7"})) == 7.0
+
+# ---------- 非流式调用 ----------
+
+def test_agenerate_fails_over_to_backup():
+    primary = FakeChatModel(FakeAPIError(503))
+    backup = FakeChatModel("from backup")
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)])
+
+    result = asyncio.run(pool.agenerate(MESSAGES))
+
+    assert result.generations[0].text == "from backup"
+    assert (primary.calls, backup.calls) == (1, 1)
+    assert pool.members[0].health.failures == 1
+    assert pool.members[1].health.successes == 1
+
+def test_agenerate_retries_single_provider_on_transient_error():
+    model = FakeChatModel(FakeAPIError(503), "ok")
+    pool = ProviderPool("test", [_member("only", model)])
+
+    result = asyncio.run(pool.agenerate(MESSAGES))
+
+    assert result.generations[0].text == "ok"
+    assert model.calls == 2
+
+def test_agenerate_does_not_retry_non_transient_error_on_single_provider():
+    model = FakeChatModel(FakeAPIError(400))
+    pool = ProviderPool("test", [_member("only", model)])
+
+    with pytest.raises(FakeAPIError):
+        asyncio.run(pool.agenerate(MESSAGES))
+    assert model.calls == 1
+
+def test_agenerate_raises_last_error_after_retries():
+    primary = FakeChatModel(FakeAPIError(503))
+    backup = FakeChatModel(FakeAPIError(502))
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)])
+
+    with pytest.raises(FakeAPIError):
+        asyncio.run(pool.agenerate(MESSAGES))
+    assert primary.calls + backup.calls == settings.llm_max_retries + 1
+
+def test_generate_waits_for_the_rate_limiter(clock):
+    model = FakeChatModel("ok")
+    member = _member("only", model)
+    member.limiter = RateLimiter("only", rpm=60)
+    member.limiter.requests.consume(60)
+    pool = ProviderPool("test", [member])
+    started = clock.now
+
+    result = pool.generate(MESSAGES)
+
+    # 同步调用和异步调用一样申请配额：等到令牌补充后才发出
+    assert result.generations[0].text == "ok"
+    assert clock.now - started == 1.0
+    assert member.limiter.throttled == 1
+
+# ---------- 故障转移顺序和熔断 ----------
+
+def test_ordered_members_rotate_on_retry():
+    pool = ProviderPool("test", [_member(name, FakeChatModel("ok")) for name in ("a", "b", "c")])
+    assert [m.name for m in pool._ordered_members(0)] == ["a", "b", "c"]
+    assert [m.name for m in pool._ordered_members(1)] == ["b", "c", "a"]
+    assert [m.name for m in pool._ordered_members(2)] == ["c", "a", "b"]
+
+def test_cooling_providers_are_tried_last_in_cooldown_order(clock):
+    pool = ProviderPool("test", [_member(name, FakeChatModel("ok")) for name in ("a", "b", "c")])
+    a, b, c = pool.members
+    a.record_failure(FakeAPIError(503))
+    clock.advance(1)
+    b.record_failure(FakeAPIError(503))
+
+    # 健康的在前；冷却中的按冷却结束时间排序（仍会被尝试）
+    assert [m.name for m in pool._ordered_members(0)] == ["c", "a", "b"]
+    assert [m.name for m in pool._ordered_members(1)] == ["c", "a", "b"]
+
+    clock.advance(29)
+    assert a.health.healthy and not b.health.healthy
+    assert [m.name for m in pool._ordered_members(0)] == ["a", "c", "b"]
+
+def test_success_resets_consecutive_failures(clock, monkeypatch):
+    monkeypatch.setattr(settings, "provider_failure_threshold", 2)
+    member = _member("a", FakeChatModel("ok"))
+    member.record_failure(FakeAPIError(503))
+    member.health.record_success()
+    member.record_failure(FakeAPIError(503))
+    assert member.health.healthy
+    member.record_failure(FakeAPIError(503))
+    assert not member.health.healthy
+    assert member.health.snapshot()["cooldown_remaining"] == 30.0
+
+# ---------- Retry-After ----------
+
+def test_rate_limit_error_pauses_the_provider_limiter(clock):
+    member = _member("a", FakeChatModel("ok"))
+    member.record_failure(FakeAPIError(429, {"retry-after": "12"}))
+    assert member.limiter.snapshot()["blocked_remaining"] == 12.0
+
+def test_rate_limit_error_without_header_pauses_for_base_delay(clock, monkeypatch):
+    monkeypatch.setattr(settings, "llm_retry_base_delay", 2.0)
+    member = _member("a", FakeChatModel("ok"))
+    member.record_failure(FakeAPIError(429))
+    assert member.limiter.snapshot()["blocked_remaining"] == 2.0
+
+def test_server_error_does_not_pause_the_limiter(clock):
+    member = _member("a", FakeChatModel("ok"))
+    member.record_failure(FakeAPIError(503))
+    assert member.limiter.snapshot()["blocked_remaining"] == 0.0
+
+# ---------- 流式调用和对冲 ----------
+
+def test_astream_fails_over_before_first_token():
+    primary = FakeChatModel(FakeAPIError(503))
+    backup = FakeChatModel(["hello", " world"])
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)])
+
+    parts, error = _stream(pool)
+
+    assert error is None
+    assert "".join(parts) == "hello world"
+    assert pool.members[0].health.failures == 1
+
+def test_astream_does_not_retry_after_output_started():
+    primary = FakeChatModel(["partial", FakeAPIError(503)])
+    backup = FakeChatModel("from backup")
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)])
+
+    parts, error = _stream(pool)
+
+    # 已经输出的内容无法撤回，不能再切换 provider
+    assert isinstance(error, FakeAPIError)
+    assert parts == ["partial"]
+    assert backup.calls == 0
+
+def test_hedge_starts_backup_when_first_token_is_slow():
+    primary = FakeChatModel(HANG)
+    backup = FakeChatModel(["fast", " answer"])
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)], hedge_delay=0.01)
+
+    parts, error = _stream(pool)
+
+    assert error is None
+    assert "".join(parts) == "fast answer"
+    # 落败的请求被取消，且不算作失败
+    assert primary.cancelled
+    assert pool.members[0].health.failures == 0
+    assert pool.members[1].health.successes == 1
+
+def test_hedge_not_started_when_primary_is_fast():
+    primary = FakeChatModel(["quick"])
+    backup = FakeChatModel("unused")
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)], hedge_delay=5.0)
+
+    parts, error = _stream(pool)
+
+    assert error is None
+    assert parts == ["quick"]
+    assert backup.calls == 0
+
+def test_hedge_switches_immediately_when_primary_fails():
+    primary = FakeChatModel(FakeAPIError(503))
+    backup = FakeChatModel("from backup")
+    # 对冲延迟很长：主 provider 失败后不等对冲计时，立即启动备用
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)], hedge_delay=60.0)
+
+    parts, error = _stream(pool)
+
+    assert error is None
+    assert parts == ["from backup"]
+
+def test_hedge_raises_when_every_provider_fails(monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_retries", 0)
+    primary = FakeChatModel(FakeAPIError(503))
+    backup = FakeChatModel(FakeAPIError(502))
+    pool = ProviderPool("test", [_member("primary", primary), _member("backup", backup)], hedge_delay=0.01)
+
+    parts, error = _stream(pool)
+
+    assert parts == []
+    assert isinstance(error, FakeAPIError) and error.status_code == 502
+    assert (primary.calls, backup.calls) == (1, 1)
+
+# ---------- 补全缓存 ----------
+
+class FakeCache:
+    """内存中的补全缓存（与 SharedCache 相同的接口）"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, namespace, key):
+        return self.values.get((namespace, key))
+
+    def put(self, namespace, key, value, ttl):
+        self.values[(namespace, key)] = value
+
+    async def aget(self, namespace, key):
+        return self.get(namespace, key)
+
+    async def aput(self, namespace, key, value, ttl):
+        self.put(namespace, key, value, ttl)
+
+def test_completion_cache_hits_are_counted_separately_and_scoped_by_tenant():
+    model = FakeChatModel("planned")
+    pool = ProviderPool("planner", [_member("primary", model)])
+    llm = PooledChatModel(pool=pool, stage="planner", primary_model="fake-model", completion_cache=FakeCache())
+    tracker = UsageTracker()
+    config = {"callbacks": [StageUsageCallback("planner", tracker)]}
+
+    async def run(tenant):
+        current_tenant.set(tenant)
+        return (await llm.ainvoke(MESSAGES, config=config)).content
+
+    assert asyncio.run(run("team-a")) == "planned"
+    assert asyncio.run(run("team-a")) == "planned"
+    assert model.calls == 1
+    # 缓存命中不计入调用次数和耗时分位数
+    stats = tracker.snapshot()["planner"]
+    assert (stats["calls"], stats["cache_hits"]) == (1, 1)
+
+    # 其他租户不复用该租户的补全
+    assert asyncio.run(run("team-b")) == "planned"
+    assert model.calls == 2
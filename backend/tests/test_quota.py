@@ -0,0 +1,103 @@
+"""
+租户配额账本的测试：软限制降级、超过预算拒绝、多个进程的账本合并
+"""
+import json
+
+import pytest
+
+from config import settings
+from services.load_policy import DEPTH_LEVELS, degrade_for_quota
+from services.quota import QuotaExceededError, QuotaLedger
+
+@pytest.fixture(autouse=True)
+def quota_settings(monkeypatch):
+    """每日 1000 token、10 次搜索，80% 为软限制；不自动写盘，由测试显式 flush"""
+    monkeypatch.setattr(settings, "quota_enabled", True)
+    monkeypatch.setattr(settings, "quota_daily_tokens", 1000)
+    monkeypatch.setattr(settings, "quota_daily_searches", 10)
+    monkeypatch.setattr(settings, "quota_tenant_budgets", "")
+    monkeypatch.setattr(settings, "quota_soft_ratio", 0.8)
+    monkeypatch.setattr(settings, "quota_flush_interval", 3600)
+
+# ---------- check / record ----------
+
+def test_usage_below_soft_limit_is_ok():
+    ledger = QuotaLedger(None)
+    ledger.record("team-a", prompt_tokens=500, completion_tokens=200, searches=7)
+    assert ledger.status("team-a")["level"] == "ok"
+    ledger.check("team-a", "tokens")
+    ledger.check("team-a", "searches")
+
+def test_soft_limit_degrades_new_runs():
+    ledger = QuotaLedger(None)
+    ledger.record("team-a", prompt_tokens=600, completion_tokens=200)
+
+    status = ledger.status("team-a")
+    assert status["level"] == "soft"
+    assert status["used"] == {"tokens": 800, "searches": 0}
+    # 软限制只降级，不拒绝
+    ledger.check("team-a", "tokens")
+    depth = degrade_for_quota(DEPTH_LEVELS[0])
+    assert depth.level == 1 and depth.reasons == ["quota"]
+
+def test_hard_limit_raises():
+    ledger = QuotaLedger(None)
+    ledger.record("team-a", prompt_tokens=700, completion_tokens=300, searches=3)
+
+    assert ledger.status("team-a")["level"] == "exceeded"
+    with pytest.raises(QuotaExceededError) as info:
+        ledger.check("team-a", "tokens")
+    assert (info.value.tenant, info.value.resource, info.value.used, info.value.limit) == ("team-a", "tokens", 1000, 1000)
+    # 其他资源和其他租户不受影响
+    ledger.check("team-a", "searches")
+    ledger.check("team-b", "tokens")
+
+def test_tenant_budget_overrides_default(monkeypatch):
+    monkeypatch.setattr(settings, "quota_tenant_budgets", json.dumps({"team-a": {"tokens": 0, "searches": 2}}))
+    ledger = QuotaLedger(None)
+    ledger.record("team-a", prompt_tokens=5000, searches=2)
+
+    # 0 表示不限
+    ledger.check("team-a", "tokens")
+    with pytest.raises(QuotaExceededError):
+        ledger.check("team-a", "searches")
+
+def test_check_is_skipped_when_quota_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "quota_enabled", False)
+    ledger = QuotaLedger(None)
+    ledger.record("team-a", prompt_tokens=5000)
+    ledger.check("team-a", "tokens")
+
+# ---------- flush ----------
+
+def test_flush_merges_counts_from_two_ledgers(tmp_path):
+    path = str(tmp_path / "ledger.json")
+    first = QuotaLedger(path)
+    second = QuotaLedger(path)
+    first.record("team-a", prompt_tokens=100, runs=1)
+    second.record("team-a", prompt_tokens=50, searches=2, runs=1)
+    second.record("team-b", completion_tokens=30)
+
+    first.flush()
+    second.flush()
+    # 第二次同步只载入对方的用量，不重复累加自己已写入的用量
+    first.flush()
+
+    expected = {"prompt_tokens": 150, "completion_tokens": 0, "searches": 2, "runs": 2}
+    assert first.today("team-a") == expected
+    assert second.today("team-a") == expected
+    assert first.today("team-b")["completion_tokens"] == 30
+
+    restarted = QuotaLedger(path)
+    assert restarted.today("team-a") == expected
+
+def test_usage_recorded_after_flush_is_kept(tmp_path):
+    path = str(tmp_path / "ledger.json")
+    ledger = QuotaLedger(path)
+    ledger.record("team-a", prompt_tokens=100)
+    ledger.flush()
+    ledger.record("team-a", prompt_tokens=20)
+
+    assert ledger.today("team-a")["prompt_tokens"] == 120
+    ledger.flush()
+    assert QuotaLedger(path).today("team-a")["prompt_tokens"] == 120
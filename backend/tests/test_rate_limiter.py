@@ -0,0 +1,185 @@
+"""
+出站限流调度器的测试：令牌桶、运行之间的轮询放行、Retry-After 暂停
+"""
+from types import SimpleNamespace
+import asyncio
+
+from config import settings
+from services.rate_limiter import RateLimiter, TokenBucket, get_rate_limiter, parse_retry_after
+
+async def _settle():
+    """让已放行的等待者运行到下一个等待点"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+class _HeaderError(Exception):
+    """带响应头的调用异常（与 openai SDK 的 APIStatusError 一样在 response 上）"""
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers=headers)
+
+# ---------- TokenBucket ----------
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    assert bucket.wait_time(1) == 1.0
+    clock.advance(0.5)
+    assert bucket.wait_time(1) == 0.5
+    clock.advance(0.5)
+    assert bucket.wait_time(1) == 0.0
+
+def test_bucket_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(60)
+    clock.advance(3600)
+    assert bucket.available() == 60
+
+def test_bucket_clamps_requests_larger_than_capacity(clock):
+    bucket = TokenBucket(100)
+    # 单次调用的估算超过每分钟上限时按整桶计算，不会永远等待
+    assert bucket.wait_time(500) == 0.0
+    bucket.consume(500)
+    assert bucket.available() == 0
+    assert bucket.wait_time(500) == 60.0
+
+def test_bucket_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(0)
+    assert bucket.unlimited
+    bucket.consume(10 ** 6)
+    assert bucket.wait_time(10 ** 6) == 0.0
+    assert bucket.available() is None
+
+# ---------- RateLimiter ----------
+
+def test_acquire_grants_immediately_with_quota(clock):
+    limiter = RateLimiter("test", rpm=60, tpm=1000)
+
+    async def run():
+        await limiter.acquire(100, run_id="a")
+
+    asyncio.run(run())
+    assert limiter.granted == 1
+    assert limiter.throttled == 0
+    assert limiter.snapshot()["available_tokens"] == 900
+
+def test_token_budget_throttles_until_refilled(clock):
+    limiter = RateLimiter("test", tpm=600)
+
+    async def run():
+        await limiter.acquire(600, run_id="a")
+        waiter = asyncio.ensure_future(limiter.acquire(300, run_id="a"))
+        await _settle()
+        assert not waiter.done()
+        # 600 tpm 即每秒 10 个 token，300 个需要 30 秒
+        clock.advance(29)
+        limiter._dispatch()
+        await _settle()
+        assert not waiter.done()
+        clock.advance(1)
+        limiter._dispatch()
+        await _settle()
+        assert waiter.done()
+
+    asyncio.run(run())
+    assert limiter.throttled == 1
+
+def test_acquire_blocking_sleeps_until_refilled(clock):
+    limiter = RateLimiter("test", tpm=600)
+    limiter.acquire_blocking(600)
+    started = clock.now
+
+    limiter.acquire_blocking(300)
+
+    # 600 tpm 即每秒 10 个 token，300 个需要 30 秒
+    assert clock.now - started == 30.0
+    assert limiter.granted == 2
+    assert limiter.throttled == 1
+
+def test_waiting_runs_are_served_round_robin(clock):
+    limiter = RateLimiter("test", rpm=60)
+    limiter.requests.consume(60)
+    order = []
+
+    async def call(run_id, label):
+        await limiter.acquire(run_id=run_id)
+        order.append(label)
+
+    async def run():
+        tasks = [asyncio.ensure_future(call("big", f"big-{i}")) for i in range(3)]
+        await _settle()
+        tasks.append(asyncio.ensure_future(call("small", "small-0")))
+        await _settle()
+        assert limiter.snapshot()["queued_by_run"] == {"big": 3, "small": 1}
+        # 每秒补充一个请求配额
+        for _ in range(4):
+            clock.advance(1)
+            limiter._dispatch()
+            await _settle()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # 后到的运行不必等前一个运行的全部调用完成
+    assert order == ["big-0", "small-0", "big-1", "big-2"]
+    assert limiter.queued == 0
+
+def test_cancelled_waiter_is_skipped(clock):
+    limiter = RateLimiter("test", rpm=60)
+    limiter.requests.consume(60)
+
+    async def run():
+        first = asyncio.ensure_future(limiter.acquire(run_id="a"))
+        second = asyncio.ensure_future(limiter.acquire(run_id="b"))
+        await _settle()
+        first.cancel()
+        await _settle()
+        clock.advance(1)
+        limiter._dispatch()
+        await _settle()
+        assert second.done() and not second.cancelled()
+
+    asyncio.run(run())
+    assert limiter.granted == 1
+
+def test_penalize_blocks_until_retry_after(clock):
+    limiter = RateLimiter("test")
+    limiter.penalize(5)
+
+    async def run():
+        waiter = asyncio.ensure_future(limiter.acquire(run_id="a"))
+        await _settle()
+        assert not waiter.done()
+        assert limiter.snapshot()["blocked_remaining"] == 5.0
+        clock.advance(4.9)
+        limiter._dispatch()
+        await _settle()
+        assert not waiter.done()
+        clock.advance(0.1)
+        limiter._dispatch()
+        await _settle()
+        assert waiter.done()
+
+    asyncio.run(run())
+    assert limiter.retry_after_events == 1
+
+def test_penalize_keeps_the_longest_pause(clock):
+    limiter = RateLimiter("test")
+    limiter.penalize(10)
+    limiter.penalize(2)
+    assert limiter.snapshot()["blocked_remaining"] == 10.0
+
+def test_parse_retry_after_headers():
+    assert parse_retry_after(_HeaderError({"retry-after": "3"})) == 3.0
+    assert parse_retry_after(_HeaderError({"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+    assert parse_retry_after(_HeaderError({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+    assert parse_retry_after(_HeaderError({})) is None
+    assert parse_retry_after(Exception("rate limited")) is None
+
+def test_limits_are_split_across_workers(monkeypatch):
+    monkeypatch.setattr(settings, "openai_rpm", 600)
+    monkeypatch.setattr(settings, "openai_tpm", 90000)
+    monkeypatch.setattr(settings, "workers", 3)
+    limiter = get_rate_limiter("openai:https://api.example.com", "openai")
+    assert limiter.requests.rate_per_minute == 200
+    assert limiter.tokens.rate_per_minute == 30000
+    assert get_rate_limiter("openai:https://api.example.com", "openai") is limiter
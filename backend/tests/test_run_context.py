@@ -0,0 +1,43 @@
+"""
+运行上下文的测试：current_run_id 的设置和恢复、临时上下文不登记追踪
+"""
+import contextvars
+
+from services.run_context import RunContext, current_run_id, get_run_id
+from services.tracing import trace_store
+
+def test_finish_restores_the_previous_run_id():
+    before = current_run_id.get()
+    outer = RunContext(name="outer")
+    inner = RunContext(name="inner")
+    assert get_run_id() == inner.run_id
+
+    inner.finish()
+    assert get_run_id() == outer.run_id
+    outer.finish()
+    assert current_run_id.get() == before
+
+def test_registered_trace_is_finished():
+    run = RunContext(name="research", query="问题")
+    assert trace_store.get(run.run_id) is run.trace
+
+    run.finish()
+    assert run.trace.summary()["status"] == "ok"
+
+def test_unregistered_context_leaves_no_trace_or_run_id():
+    before = current_run_id.get()
+    run = RunContext(name="plan_research", register=False, query="问题")
+    span = run.trace.start_span("plan", "stage")
+    span.end()
+
+    assert trace_store.get(run.run_id) is None
+    assert current_run_id.get() == before
+    run.finish()
+    assert current_run_id.get() == before
+
+def test_finish_in_another_context_does_not_raise():
+    before = current_run_id.get()
+    run = contextvars.copy_context().run(RunContext, name="research")
+    assert current_run_id.get() == before
+    run.finish()
+    assert current_run_id.get() == before
@@ -0,0 +1,116 @@
+"""
+会话存储的测试：LRU 落盘和取回、摘要索引、运行中的会话不被淘汰、增量计算占用
+"""
+from datetime import datetime
+import asyncio
+
+from models.schemas import Message, Session
+from services import session_store as session_store_module
+from services.session_store import SessionStore
+
+def _session(session_id: str, *contents: str) -> Session:
+    now = datetime.now()
+    return Session(
+        session_id=session_id, title=f"标题 {session_id}", created_at=now, updated_at=now,
+        messages=[Message(role="user", content=content, timestamp=now) for content in contents]
+    )
+
+def _message(content: str) -> Message:
+    return Message(role="assistant", content=content, timestamp=datetime.now())
+
+def test_evicted_sessions_are_spilled_and_reloaded(tmp_path):
+    store = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    store.put(_session("a", "问题 A"))
+    store.put(_session("b", "问题 B"))
+
+    assert store.stats()["sessions_spilled"] == 1
+    summaries = {session.session_id: session for session in store.list()}
+    assert summaries["a"].messages == []
+
+    session = store.get("a")
+    assert [m.content for m in session.messages] == ["问题 A"]
+    assert store.stats()["reloaded"] == 1
+
+def test_summary_index_is_used_at_startup(tmp_path, monkeypatch):
+    store = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    store.put(_session("a", "问题 A"))
+    store.put(_session("b", "问题 B"))
+    assert (tmp_path / "index.json").exists()
+
+    # 启动时只读索引，不解压会话文件
+    def fail(*args, **kwargs):
+        raise AssertionError("session file decompressed")
+
+    monkeypatch.setattr(session_store_module.gzip, "open", fail)
+    restarted = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    assert [session.title for session in restarted.list()] == ["标题 a"]
+
+    monkeypatch.undo()
+    assert [m.content for m in restarted.get("a").messages] == ["问题 A"]
+
+def test_spill_files_missing_from_the_index_are_recovered(tmp_path):
+    store = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    store.put(_session("a", "问题 A"))
+    store.put(_session("b", "问题 B"))
+    (tmp_path / "index.json").unlink()
+
+    restarted = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    assert [session.session_id for session in restarted.list()] == ["a"]
+    assert (tmp_path / "index.json").exists()
+
+def test_pinned_sessions_are_not_evicted(tmp_path):
+    store = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+    running = _session("running", "问题")
+    store.put(running)
+    store.pin("running")
+    store.put(_session("b"))
+    store.put(_session("c"))
+
+    # 运行写入的回复留在内存中的同一个会话对象上
+    store.add_message(running, _message("回复"))
+    assert store.get("running") is running
+    assert [m.content for m in running.messages] == ["问题", "回复"]
+
+    store.unpin("running")
+    store.put(_session("d"))
+    assert store.stats()["sessions_in_memory"] == 1
+    assert [m.content for m in store.get("running").messages] == ["问题", "回复"]
+
+def test_add_message_tracks_size_incrementally(monkeypatch):
+    store = SessionStore(max_sessions=0, max_messages=3, max_bytes=0)
+    session = _session("a")
+    store.put(session)
+
+    def fail(session):
+        raise AssertionError("whole session re-serialized")
+
+    monkeypatch.setattr(store, "_size_of", fail)
+    for i in range(5):
+        store.add_message(session, _message(f"回复 {i}" * (i + 1)))
+    monkeypatch.undo()
+
+    assert [m.content for m in session.messages] == [f"回复 {i}" * (i + 1) for i in (2, 3, 4)]
+    # 增量累计的占用与重新序列化的结果一致（允许列表分隔符的误差）
+    assert abs(store.stats()["bytes_in_memory"] - store._size_of(session)) <= 3
+
+def test_spill_and_reload_happen_off_the_event_loop(tmp_path):
+    store = SessionStore(max_sessions=1, max_messages=0, max_bytes=0, spill_dir=str(tmp_path))
+
+    async def run():
+        store.put(_session("a", "问题 A"))
+        store.put(_session("b", "问题 B"))
+        # 写入尚未完成时取回，直接使用内存中的对象
+        pending = await store.aget("a")
+        assert [m.content for m in pending.messages] == ["问题 A"]
+
+        store.put(_session("c", "问题 C"))
+        # 等线程池中的写入完成后从磁盘读取
+        for _ in range(100):
+            if not store.stats()["spills_pending"]:
+                break
+            await asyncio.sleep(0.01)
+        reloaded = await store.aget("a")
+        assert [m.content for m in reloaded.messages] == ["问题 A"]
+
+    asyncio.run(run())
+    assert sorted(session.session_id for session in store.list()) == ["a", "b", "c"]
@@ -0,0 +1,35 @@
+"""
+子任务研究结果缓存的测试：精确和近似命中、降级结果、租户隔离
+"""
+from services.task_cache import TaskResultCache
+
+TASK = {"title": "电动汽车 市场规模", "directions": ["全球 销量", "增长 趋势"]}
+
+def _cache() -> TaskResultCache:
+    return TaskResultCache(ttl=3600, max_entries=10, threshold=0.6)
+
+def test_same_and_similar_tasks_hit():
+    cache = _cache()
+    cache.put(TASK, "结果", tenant="team-a")
+    assert cache.get(dict(TASK), tenant="team-a") == "结果"
+    similar = {"title": "电动汽车 市场规模", "directions": ["全球 销量", "增长 趋势", "预测"]}
+    assert cache.get(similar, tenant="team-a") == "结果"
+
+def test_results_are_not_shared_across_tenants():
+    cache = _cache()
+    cache.put(TASK, "A 的结果", tenant="team-a")
+
+    assert cache.get(TASK, tenant="team-b") is None
+    cache.put(TASK, "B 的结果", tenant="team-b")
+    assert cache.get(TASK, tenant="team-a") == "A 的结果"
+    assert cache.get(TASK, tenant="team-b") == "B 的结果"
+
+def test_degraded_results_only_serve_equal_or_lower_depth():
+    cache = _cache()
+    cache.put(TASK, "降级结果", depth_level=2)
+    assert cache.get(TASK, depth_level=0) is None
+    assert cache.get(TASK, depth_level=2) == "降级结果"
+    # 完整结果可以覆盖降级结果，反之不行
+    cache.put(TASK, "完整结果", depth_level=0)
+    cache.put(TASK, "另一个降级结果", depth_level=1)
+    assert cache.get(TASK, depth_level=0) == "完整结果"
@@ -1,4 +1,8 @@
-from .tavily_search import create_tavily_tool, get_search_tools
+from .tavily_search import create_tavily_tool, get_search_tools, RateLimitedTavilySearch
+from .search_dedup import SearchDeduplicator, current_search_dedup
 
-__all__ = ["create_tavily_tool", "get_search_tools"]
+__all__ = [
+    "create_tavily_tool", "get_search_tools", "RateLimitedTavilySearch",
+    "SearchDeduplicator", "current_search_dedup"
+]
 
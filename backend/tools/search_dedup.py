@@ -0,0 +1,74 @@
+"""
+批量研究中的搜索去重：相同或近似的搜索查询只执行一次，结果共享
+"""
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+
+from services.similarity import jaccard, normalize_text, term_set
+
+class SharedSearchFailed(Exception):
+    """共享的搜索执行失败，等待者需要自行搜索"""
+
+class SearchDeduplicator:
+    """在一组并发研究之间共享搜索结果"""
+
+    def __init__(self, threshold: float = 0.85):
+        """
+        Args:
+            threshold: 词项 Jaccard 相似度达到该值即视为近似查询
+        """
+        self.threshold = threshold
+        # (词项集合, 规范化查询, 结果 future)
+        self._entries: List[Tuple[Set[str], str, asyncio.Future]] = []
+        self.executed = 0
+        self.shared = 0
+
+    def _find(self, terms: Set[str], normalized: str) -> Optional[asyncio.Future]:
+        for entry_terms, entry_key, future in self._entries:
+            if entry_key == normalized or jaccard(terms, entry_terms) >= self.threshold:
+                return future
+        return None
+
+    async def run(self, query: str, search: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行搜索；已有相同或近似查询时直接复用其结果
+
+        Args:
+            query: 搜索查询
+            search: 实际执行搜索的协程函数
+
+        Returns:
+            Any: 搜索结果
+        """
+        terms = term_set(query)
+        normalized = normalize_text(query)
+        future = self._find(terms, normalized)
+        if future is not None:
+            try:
+                result = await asyncio.shield(future)
+                self.shared += 1
+                return result
+            except SharedSearchFailed:
+                return await search()
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (terms, normalized, future)
+        self._entries.append(entry)
+        self.executed += 1
+        try:
+            result = await search()
+        except BaseException:
+            self._entries.remove(entry)
+            future.set_exception(SharedSearchFailed(query))
+            # 标记异常已读取，避免没有等待者时产生警告
+            future.exception()
+            raise
+        future.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"executed": self.executed, "shared": self.shared}
+
+# 当前上下文的搜索去重器（批量研究时设置）
+current_search_dedup: ContextVar[Optional[SearchDeduplicator]] = ContextVar("current_search_dedup", default=None)
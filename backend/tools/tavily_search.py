@@ -1,11 +1,65 @@
 """
 Tavily Search 工具集成
 """
-from typing import Optional
+from typing import Any, Optional
 from langchain_community.tools import TavilySearchResults
 from config import settings
+from services.rate_limiter import get_rate_limiter
+from services.quota import QuotaExceededError, current_tenant, quota_ledger
+from services.shared_cache import SEARCH, shared_cache
+from tools.search_dedup import current_search_dedup
 import os
 
+class RateLimitedTavilySearch(TavilySearchResults):
+    """接入出站限流的 Tavily 搜索工具（批量研究时共享相同查询的结果）"""
+    
+    async def _arun(self, query: str, run_manager: Optional[Any] = None) -> Any:
+        dedup = current_search_dedup.get()
+        if dedup is not None:
+            return await dedup.run(query, lambda: self._search(query, run_manager))
+        return await self._search(query, run_manager)
+    
+    async def _search(self, query: str, run_manager: Optional[Any] = None) -> Any:
+        """执行搜索（优先使用跨进程共享缓存，带租户配额、限流和限流错误重试）"""
+        cache_key = f"{self.max_results}:{' '.join(query.lower().split())}"
+        if settings.shared_cache_enabled:
+            cached = await shared_cache.aget(SEARCH, cache_key)
+            if cached is not None:
+                return tuple(cached["result"]) if cached["tuple"] else cached["result"]
+        
+        tenant = current_tenant.get()
+        try:
+            quota_ledger.check(tenant, "searches")
+        except QuotaExceededError as e:
+            # 返回提示而不是报错，Agent 可以根据已有信息继续完成
+            return f"{e}，请根据已有信息作答"
+        quota_ledger.record(tenant, searches=1)
+        
+        limiter = get_rate_limiter("tavily")
+        result = None
+        for attempt in range(settings.search_max_retries + 1):
+            await limiter.acquire()
+            result = await super()._arun(query, run_manager=run_manager)
+            
+            # TavilySearchResults 会把异常转成字符串返回，这里识别限流错误并等待重试
+            content = result[0] if isinstance(result, tuple) else result
+            if not (isinstance(content, str) and _is_rate_limited(content)):
+                # 出错时 content 为错误信息字符串，只缓存正常的搜索结果
+                if settings.shared_cache_enabled and isinstance(content, list):
+                    await shared_cache.aput(
+                        SEARCH, cache_key,
+                        {"result": list(result) if isinstance(result, tuple) else result,
+                         "tuple": isinstance(result, tuple)},
+                        settings.shared_cache_search_ttl
+                    )
+                return result
+            limiter.penalize(settings.search_retry_after)
+        return result
+
+def _is_rate_limited(message: str) -> bool:
+    """判断 Tavily 返回的错误信息是否为限流"""
+    return "429" in message or "Too Many Requests" in message or "rate limit" in message.lower()
+
 def create_tavily_tool(max_results: int = 5) -> TavilySearchResults:
     """
     创建 Tavily 搜索工具
@@ -25,7 +79,7 @@ def create_tavily_tool(max_results: int = 5) -> TavilySearchResults:
     # 设置环境变量（确保 TavilySearchResults 能读取）
     os.environ["TAVILY_API_KEY"] = tavily_key
     
-    return TavilySearchResults(
+    return RateLimitedTavilySearch(
         max_results=max_results,
     )
 
@@ -10,7 +10,7 @@ import ChatInput from '../components/ChatInput';
 import SessionList from '../components/SessionList';
 import ThinkingIndicator from '../components/ThinkingIndicator';
 import { Message, StreamEvent, Session } from '../types';
-import { streamChat, streamChatMulti, getSessions, createSession, deleteSession } from '../services/api';
+import { streamChatWs, getSessions, getSession, createSession, deleteSession } from '../services/api';
 import './ChatPage.css';
 
 const { Header, Content, Sider } = Layout;
@@ -51,12 +51,21 @@ const ChatPage: React.FC = () => {
     }
   };
 
-  const handleSelectSession = (id: string) => {
+  const handleSelectSession = async (id: string) => {
     const session = sessions.find((s) => s.session_id === id);
     if (session) {
       setSessionId(id);
       setMessages(session.messages as Message[]);
       setDrawerVisible(false);
+      // 列表中的旧会话只有摘要，需要单独获取消息
+      if (session.messages.length === 0) {
+        try {
+          const detail = await getSession(id);
+          setMessages(detail.messages as Message[]);
+        } catch (error) {
+          console.error('Load session error:', error);
+        }
+      }
     }
   };
 
@@ -117,10 +126,8 @@ const ChatPage: React.FC = () => {
       let fullContent = '';
       const events: StreamEvent[] = [];
 
-      // 选择使用单 Agent 或多 Agent
-      const streamFunc = useMultiAgent ? streamChatMulti : streamChat;
-
-      for await (const event of streamFunc(content, sessionId)) {
+      // 选择使用单 Agent 或多 Agent（所有研究共用一个 WebSocket 连接）
+      for await (const event of streamChatWs(content, sessionId, useMultiAgent)) {
         // 处理会话 ID
         if (event.type === 'session') {
           const sessionData = event.content as { session_id?: string };
@@ -144,6 +144,157 @@ export async function* streamChat(
   }
 }
 
+// WebSocket 地址（API 地址为相对路径时使用当前页面的域名）
+const WS_URL = API_BASE_URL.startsWith('/')
+  ? `${window.location.protocol === 'https:' ? 'wss:' : 'ws:'}//${window.location.host}${API_BASE_URL}/ws`
+  : `${API_BASE_URL.replace(/^http/, 'ws')}/ws`;
+
+type FrameHandler = (event: string, data: any) => void;
+
+/**
+ * 把 WebSocket 消息转换为流式事件
+ */
+function toStreamEvent(event: string, data: any): StreamEvent {
+  if (event === 'session') {
+    return { type: 'session', content: data };
+  }
+  if (event === 'error' && data && data.error !== undefined) {
+    return { type: 'error', content: data.error };
+  }
+  if (event === 'cancelled') {
+    return { type: 'error', content: '运行已取消' };
+  }
+  return data as StreamEvent;
+}
+
+/**
+ * 多路复用的 WebSocket 连接：多个研究流共用一个连接，按流 ID 分发事件
+ */
+class ResearchSocket {
+  private socket: WebSocket | null = null;
+  private opening: Promise<WebSocket> | null = null;
+  private handlers = new Map<string, FrameHandler>();
+  private nextId = 1;
+
+  /**
+   * 获取已建立的连接（没有时新建）
+   */
+  ready(): Promise<WebSocket> {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      return Promise.resolve(this.socket);
+    }
+    if (!this.opening) {
+      this.opening = new Promise((resolve, reject) => {
+        const socket = new WebSocket(WS_URL);
+        socket.onopen = () => {
+          this.socket = socket;
+          this.opening = null;
+          resolve(socket);
+        };
+        socket.onerror = () => {
+          this.opening = null;
+          reject(new Error('WebSocket connection failed'));
+        };
+        socket.onclose = () => {
+          this.socket = null;
+          // 通知所有进行中的流连接已断开
+          this.handlers.forEach((handler) => {
+            handler('error', { error: '连接已断开' });
+            handler('end', {});
+          });
+          this.handlers.clear();
+        };
+        socket.onmessage = (message) => {
+          const frame = JSON.parse(message.data);
+          if (frame.s !== undefined) {
+            this.handlers.get(frame.s)?.(frame.e, frame.d);
+          }
+        };
+      });
+    }
+    return this.opening;
+  }
+
+  /**
+   * 发送 start / subscribe 请求，并按顺序产出该流的事件
+   */
+  async *stream(request: Record<string, any>): AsyncGenerator<StreamEvent, void, unknown> {
+    const socket = await this.ready();
+    const streamId = String(this.nextId++);
+    const queue: Array<[string, any]> = [];
+    let wake: (() => void) | null = null;
+    let finished = false;
+
+    this.handlers.set(streamId, (event, data) => {
+      queue.push([event, data]);
+      wake?.();
+      wake = null;
+    });
+    socket.send(JSON.stringify({ ...request, s: streamId }));
+
+    try {
+      while (true) {
+        const frame = queue.shift();
+        if (!frame) {
+          await new Promise<void>((resolve) => {
+            wake = resolve;
+          });
+          continue;
+        }
+        const [event, data] = frame;
+        if (event === 'end') {
+          finished = true;
+          return;
+        }
+        const streamEvent = toStreamEvent(event, data);
+        if (streamEvent.type === 'done' || streamEvent.type === 'error') {
+          finished = true;
+        }
+        yield streamEvent;
+      }
+    } finally {
+      this.handlers.delete(streamId);
+      // 提前停止读取时取消运行
+      if (!finished && this.socket) {
+        this.socket.send(JSON.stringify({ op: 'cancel', s: streamId }));
+      }
+    }
+  }
+}
+
+const researchSocket = new ResearchSocket();
+
+/**
+ * 流式聊天接口（WebSocket，多个研究共用一个连接；WebSocket 不可用时退回 SSE）
+ */
+export async function* streamChatWs(
+  message: string,
+  sessionId?: string,
+  multiAgent: boolean = true
+): AsyncGenerator<StreamEvent, void, unknown> {
+  try {
+    await researchSocket.ready();
+  } catch (e) {
+    console.warn('WebSocket unavailable, falling back to SSE:', e);
+    yield* multiAgent ? streamChatMulti(message, sessionId) : streamChat(message, sessionId);
+    return;
+  }
+
+  yield* researchSocket.stream({
+    op: 'start',
+    message,
+    session_id: sessionId,
+    mode: multiAgent ? 'multi' : 'single',
+  });
+}
+
+/**
+ * 订阅进行中的研究（例如在其他标签页中发起的运行），会先收到最近的事件
+ */
+export function subscribeRun(runId: string): AsyncGenerator<StreamEvent, void, unknown> {
+  return researchSocket.stream({ op: 'subscribe', run_id: runId });
+}
+
 /**
  * 简单聊天接口（非流式）
  */
@@ -190,6 +341,8 @@ export async function deleteSession(sessionId: string): Promise<void> {
 export default {
   streamChat,
   streamChatMulti,
+  streamChatWs,
+  subscribeRun,
   chatSimple,
   getSessions,
   getSession,